@@ -3,19 +3,21 @@
 # @Date:   2023-05-15 14:21:40
 # @Last Modified by:   Bi Ying
 # @Last Modified time: 2024-07-01 18:34:20
-from pathlib import Path
+import time
+import uuid
 from typing import TypeVar, Type, Tuple, Union, Dict, Any
 
-from diskcache import Deque
+from peewee import chunked
 
 from models import (
     Message,
     Workflow,
+    database,
     model_serializer,
     WorkflowRunRecord,
 )
 from models.base import BaseModel
-from utilities.config import config
+from utilities.workflow import get_queue_route, open_workflow_queue
 
 
 T = TypeVar("T", bound=BaseModel)
@@ -112,6 +114,7 @@ def run_workflow_common(
     message=None,
     run_from=WorkflowRunRecord.RunFromTypes.WEB,
     workflow_version: int | None = None,
+    parent_record_id: str | None = None,
 ) -> str:
     workflow_data["wid"] = workflow.wid.hex
 
@@ -127,12 +130,55 @@ def run_workflow_common(
     )
     workflow_data["rid"] = record.rid.hex
 
-    worker_queue = Deque(directory=Path(config.data_path) / "cache" / "workflow_task")
-    worker_queue.appendleft(workflow_data)
+    # 按运行来源和父工作流分配队列通道，子工作流不会挡住聊天和编辑器中的运行
+    queue_route = get_queue_route(run_from, parent_record_id)
+    workflow_data["queue_route"] = queue_route
+    # 出队时记录排队耗时
+    workflow_data["queued_at"] = time.time()
+    open_workflow_queue().put(workflow_data, **queue_route)
 
     return record.rid.hex
 
 
+def run_workflows_bulk(
+    workflow_data_list: list[dict],
+    workflow: Workflow,
+    run_from=WorkflowRunRecord.RunFromTypes.WORKFLOW,
+    parent_record_id: str | None = None,
+) -> list[str]:
+    """
+    批量启动同一个工作流的多次运行：在一个事务中插入全部运行记录，然后依次入队。
+    Start several runs of the same workflow: insert all run records in one transaction, then queue them.
+    """
+    rows = []
+    for workflow_data in workflow_data_list:
+        workflow_data["wid"] = workflow.wid.hex
+        rows.append(
+            {
+                "rid": uuid.uuid4(),
+                "workflow": workflow,
+                "data": workflow_data,
+                "status": "RUNNING",
+                "run_from": run_from,
+                "workflow_version": workflow.version,
+            }
+        )
+    with database.atomic():
+        # SQLite 单条语句的参数个数有限，分批插入
+        for batch in chunked(rows, 100):
+            WorkflowRunRecord.insert_many(batch).execute()
+
+    queue_route = get_queue_route(run_from, parent_record_id)
+    queue = open_workflow_queue()
+    for row, workflow_data in zip(rows, workflow_data_list):
+        workflow_data["rid"] = row["rid"].hex
+        workflow_data["queue_route"] = queue_route
+        workflow_data["queued_at"] = time.time()
+        queue.put(workflow_data, **queue_route)
+
+    return [row["rid"].hex for row in rows]
+
+
 class JResponse(dict):
     def __init__(self, status=200, data=None, msg="", **kwargs):
         if data is None:
@@ -21,7 +21,7 @@ from api.utils import (
     get_user_object_general,
 )
 from utilities.config import cache
-from utilities.workflow import WorkflowData
+from utilities.workflow import WorkflowData, build_timeline
 from utilities.file_processing import static_file_server
 from background_task.tasks import update_workflow_tool_call_data
 
@@ -371,6 +371,9 @@ class WorkflowRunRecordAPI:
         limit = page_size
         records = records.offset(offset).limit(limit)
         records_list = model_serializer(records, many=True, manytomany=True)
+        for record in records_list:
+            # 列表中不需要 trace，通过 timeline 单独获取
+            record.pop("trace", None)
 
         if need_workflow:
             for record in records_list:
@@ -400,6 +403,23 @@ class WorkflowRunRecordAPI:
         record.delete_instance()
         return JResponse()
 
+    def timeline(self, payload):
+        """
+        返回运行记录的时间线数据，用于火焰图展示排队、重试、节点执行和模型请求的耗时。
+        Timeline data of a run for the flame chart view: queueing, retries, node execution and model requests.
+        """
+        status, msg, record = get_user_object_general(
+            WorkflowRunRecord,
+            rid=payload.get("rid", None),
+        )
+        if status != 200 or not isinstance(record, WorkflowRunRecord):
+            return JResponse(status=status, msg=msg)
+
+        timeline = build_timeline(record.trace or [])
+        timeline["rid"] = record.rid.hex
+        timeline["status"] = record.status
+        return JResponse(data=timeline)
+
 
 class WorkflowTagAPI:
     name = "workflow_tag"
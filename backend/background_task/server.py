@@ -3,6 +3,7 @@
 # This is a simple simulation of a background task handler like Celery.
 import time
 import traceback
+from queue import Empty
 from pathlib import Path
 from threading import Thread, Event
 
@@ -18,10 +19,15 @@ qdrant_mprint = mprint_with_name(name="Qdrant Task Server")
 
 
 class BackgroundTaskServer:
-    def __init__(self, cache_dir: str | Path | None = None, num_workers: int = 2):
+    def __init__(
+        self, cache_dir: str | Path | None = None, num_workers: int = 2, qdrant_path: str | Path | None = None
+    ):
         if cache_dir is None:
             cache_dir = Path(config.data_path) / "cache"
+        if qdrant_path is None:
+            qdrant_path = Path(config.data_path) / "qdrant_db"
         self.cache_dir = Path(cache_dir)
+        self.qdrant_path = Path(qdrant_path)
         self.task_queue_directory = self.cache_dir / "background_task"
         self.qdrant_tasks_queue_directory = self.cache_dir / "qdrant_task"
         self.num_workers = num_workers
@@ -40,7 +46,9 @@ class BackgroundTaskServer:
         # All qdrant tasks should be processed in the same thread.
         # https://github.com/qdrant/qdrant-client
         qdrant_thread = Thread(
-            target=self.run_qdrant_task_server, args=(self.stop_event, self.qdrant_tasks_queue_directory), daemon=True
+            target=self.run_qdrant_task_server,
+            args=(self.stop_event, self.qdrant_tasks_queue_directory, self.qdrant_path),
+            daemon=True,
         )
         qdrant_thread.start()
         self.threads.append(qdrant_thread)
@@ -86,34 +94,63 @@ class BackgroundTaskServer:
             time.sleep(sleep_time)
 
     @staticmethod
-    def run_qdrant_task_server(stop_event: Event, qdrant_tasks_queue_directory: str | Path | None = None):
-        from background_task.tasks import get_task
-
-        qdrant_path = Path(config.data_path) / "qdrant_db"
-        qdrant_client = QdrantClient(path=qdrant_path.absolute().as_posix())
+    def run_qdrant_task_server(
+        stop_event: Event,
+        qdrant_tasks_queue_directory: str | Path | None = None,
+        qdrant_path: str | Path | None = None,
+    ):
+        from background_task.tasks import get_task, qdrant_requests
+
+        if qdrant_path is None:
+            qdrant_path = Path(config.data_path) / "qdrant_db"
+        qdrant_client = QdrantClient(path=Path(qdrant_path).absolute().as_posix())
         qdrant_tasks_queue = Deque(directory=qdrant_tasks_queue_directory)
-        sleep_time = 1
+        wait_time = 1
         task_name = ""
 
         qdrant_mprint("Started.")
         while not stop_event.is_set():
+            # 同进程提交的请求（如检索）优先于磁盘队列中尚未写入的数据处理；空闲时阻塞在请求队列上，有请求立即唤醒
+            # In-process requests such as searches run ahead of writes still in the durable queue; when idle
+            # the thread blocks on the request queue so that a new request wakes it immediately
+            try:
+                future, task_name, args, kwargs = qdrant_requests.get(timeout=wait_time)
+            except Empty:
+                pass
+            else:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(get_task(task_name)(qdrant_client, *args, **kwargs))
+                    except Exception as e:
+                        qdrant_mprint.error(f"Error running request {task_name}: {e}")
+                        future.set_exception(e)
+                wait_time = 0
+                continue
+
+            # 磁盘队列只用于不需要结果的写入任务
+            # The durable queue only carries fire-and-forget writes
             try:
                 if len(qdrant_tasks_queue) > 0:
                     task = qdrant_tasks_queue.pop()
                     if not isinstance(task, dict):
                         continue
-                    task_name, task_id, args, kwargs = task["task_name"], task["task_id"], task["args"], task["kwargs"]
+                    task_name, task_id = task["task_name"], task["task_id"]
                     task_func = get_task(task_name)
                     if not task_func:
                         continue
-                    task_result = task_func(qdrant_client, *args, **kwargs)
-                    cache.set(f"task_result_{task_id}", task_result, expire=60 * 10)
+                    task_func(qdrant_client, *task["args"], **task["kwargs"])
                     qdrant_mprint(f"Task {task_id} {task_name} completed.")
-                    sleep_time = 0.01
+                    wait_time = 0.01
                 else:
-                    sleep_time = 1
+                    wait_time = 1
             except Exception as e:
                 qdrant_mprint.error(traceback.format_exc())
                 qdrant_mprint.error(f"Error running task {task_name}: {e}")
 
-            time.sleep(sleep_time)
+        # 停止后仍在等待的请求不会再被处理
+        while not qdrant_requests.empty():
+            future, task_name, _, _ = qdrant_requests.get_nowait()
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError(f"Qdrant task server stopped before running {task_name}"))
+        qdrant_client.close()
+        qdrant_mprint("Stopped.")
@@ -1,7 +1,9 @@
 # @Author: Bi Ying
 # @Date:   2024-06-06 16:04:26
 import uuid
+from queue import Queue
 from pathlib import Path
+from concurrent.futures import Future
 from typing_extensions import ParamSpec
 from typing import Callable, Any, TypeVar, Protocol, Dict
 
@@ -39,12 +41,16 @@ class DelayableFunction(Protocol[P, R]):
 
     def __call__(self, *args: P.args, **kwargs: P.kwargs) -> R: ...
     def delay(self, *args: P.args, **kwargs: P.kwargs) -> str: ...
+    def submit(self, *args: P.args, **kwargs: P.kwargs) -> Future: ...
 
 
 tasks_registry: Dict[str, Callable[..., Any]] = {}
 
 tasks_queue: Deque = Deque(directory=Path(config.data_path) / "cache" / "background_task")
 qdrant_tasks_queue: Deque = Deque(directory=Path(config.data_path) / "cache" / "qdrant_task")
+# 本进程内提交给 Qdrant 线程、需要返回结果的请求，元素为 (future, task_name, args, kwargs)
+# In-process requests to the Qdrant thread that need a result, as (future, task_name, args, kwargs)
+qdrant_requests: Queue = Queue()
 
 
 def background_task(func: Callable[..., Any]) -> DelayableFunction:
@@ -58,9 +64,18 @@ def background_task(func: Callable[..., Any]) -> DelayableFunction:
         mprint(f"Task {task_id} {func.__name__} added to queue.")
         return task["task_id"]
 
+    def submit(*args: Any, **kwargs: Any) -> Future:
+        # 不经过磁盘队列，由同一进程中的 Qdrant 线程直接设置 Future 的结果
+        if not is_qdrant_task(func.__name__):
+            raise ValueError(f"Only qdrant tasks can be submitted: {func.__name__}")
+        future: Future = Future()
+        qdrant_requests.put((future, func.__name__, args, kwargs))
+        return future
+
     wrapped: DelayableFunction = wrapper  # type: ignore
     wrapped.__name__ = func.__name__
     wrapped.delay = wrapper
+    wrapped.submit = submit
     tasks_registry[func.__name__] = func
     return wrapped
 
@@ -130,34 +145,61 @@ def q_delete_collection(client: QdrantClient, vid: str):
         return False
 
 
+def upsert_points(client: QdrantClient, vid: str, points: list[dict]):
+    """
+    一次请求写入多个点。
+    Upsert several points in one request.
+    """
+    client.upsert(
+        collection_name=f"{vid}_text_collection",
+        points=[
+            PointStruct(
+                id=uuid.uuid4().hex,
+                payload={
+                    "object_id": point.get("object_id"),
+                    "text": point.get("text"),
+                    "embedding_type": point.get("embedding_type"),
+                    "extra_data": point.get("extra_data"),
+                },
+                vector=point.get("embedding") or [],
+            )
+            for point in points
+        ],
+    )
+
+
+def update_point_progress(vid: str, point: dict):
+    chunk_count = point.get("chunk_count") or 0
+    if point.get("chunk_index") == chunk_count - 1:
+        user_object: UserObject = UserObject.get(UserObject.oid == point.get("object_id"))
+        user_object.status = "VA"
+        user_object.save()
+    cache.set(
+        f"qdrant-point-progress:{vid}:{point.get('object_id')}",
+        {"chunk_index": point.get("chunk_index"), "chunk_count": chunk_count},
+        expire=60 * 60,
+    )
+
+
 @background_task
 def q_add_point(client: QdrantClient, vid: str, point: dict):
     try:
-        client.upsert(
-            collection_name=f"{vid}_text_collection",
-            points=[
-                PointStruct(
-                    id=uuid.uuid4().hex,
-                    payload={
-                        "object_id": point.get("object_id"),
-                        "text": point.get("text"),
-                        "embedding_type": point.get("embedding_type"),
-                        "extra_data": point.get("extra_data"),
-                    },
-                    vector=point.get("embedding") or [],
-                ),
-            ],
-        )
-        chunk_count = point.get("chunk_count") or 0
-        if point.get("chunk_index") == chunk_count - 1:
-            user_object: UserObject = UserObject.get(UserObject.oid == point.get("object_id"))
-            user_object.status = "VA"
-            user_object.save()
-        cache.set(
-            f"qdrant-point-progress:{vid}:{point.get('object_id')}",
-            {"chunk_index": point.get("chunk_index"), "chunk_count": chunk_count},
-            expire=60 * 60,
-        )
+        upsert_points(client, vid, [point])
+        update_point_progress(vid, point)
+        return True
+    except Exception as e:
+        mprint.error(e)
+        return False
+
+
+@background_task
+def q_add_points(client: QdrantClient, vid: str, points: list[dict]):
+    # points 为同一个对象按顺序排列的一批分块，进度以最后一块为准
+    if not points:
+        return True
+    try:
+        upsert_points(client, vid, points)
+        update_point_progress(vid, points[-1])
         return True
     except Exception as e:
         mprint.error(e)
@@ -179,23 +221,29 @@ def embedding_and_upload(
     if extra_data is None:
         extra_data = {}
 
-    embedding_client = EmbeddingClient(
+    with EmbeddingClient(
         provider=embedding_provider, model_id=embedding_model, dimensions=embedding_dimensions
-    )
-    for index, text in enumerate(input):
-        embedding = embedding_client.get(text)
-        q_add_point.delay(
-            vid=vid,
-            point={
-                "object_id": object_id,
-                "text": text,
-                "embedding": embedding,
-                "embedding_type": embedding_type,
-                "extra_data": extra_data,
-                "chunk_index": index,
-                "chunk_count": len(input),
-            },
-        )
+    ) as embedding_client:
+        # 每批文本一次 embedding 请求，得到的向量作为一个任务批量写入 Qdrant
+        for start, texts in embedding_client.split_batches(input):
+            embeddings = embedding_client.get(texts)
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+            q_add_points.delay(
+                vid=vid,
+                points=[
+                    {
+                        "object_id": object_id,
+                        "text": text,
+                        "embedding": embedding,
+                        "embedding_type": embedding_type,
+                        "extra_data": extra_data,
+                        "chunk_index": start + offset,
+                        "chunk_count": len(input),
+                    }
+                    for offset, (text, embedding) in enumerate(zip(texts, embeddings))
+                ],
+            )
     return True
 
 
@@ -0,0 +1,5 @@
+# @Author: Bi Ying
+# @Date:   2024-08-12 10:21:37
+# 工作流引擎的性能基准测试，需要在 backend 目录下以模块方式运行，例如：
+# Benchmarks for the workflow engine. Run them as modules from the backend directory, e.g.:
+#   python -m benchmarks.bench_edge_resolution
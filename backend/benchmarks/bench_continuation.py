@@ -0,0 +1,72 @@
+# @Author: Bi Ying
+# @Date:   2024-08-16 17:12:40
+"""
+测量每次重试写入的字节数：原先把完整的工作流数据写入延迟队列和主队列，
+现在工作流状态保存在 ContinuationStore 中，队列只保存引用。
+Measure bytes written per retry: previously the full workflow data was written to the delayed
+queue and again to the main queue; now the state lives in a ContinuationStore and the queues
+only carry a reference.
+
+    python -m benchmarks.bench_continuation --payload-mb 4 --retries 20
+"""
+import time
+import pickle
+import base64
+import argparse
+import tempfile
+from pathlib import Path
+
+from utilities.workflow import ContinuationStore
+
+
+def make_workflow_data(payload_bytes: int) -> dict:
+    image = base64.b64encode(b"\0" * payload_bytes).decode()
+    return {
+        "wid": "benchmark",
+        "rid": "benchmark-run",
+        "nodes": [
+            {"id": "image", "type": "ImageEditing", "data": {"template": {"output": {"value": image}}}},
+            {"id": "invoke", "type": "WorkflowInvoke", "data": {"template": {"output": {"value": ""}}}},
+        ],
+        "edges": [],
+        "completed_nodes": ["image"],
+    }
+
+
+def run(payload_mb: float, retries: int):
+    workflow_data = make_workflow_data(int(payload_mb * 1024 * 1024))
+
+    # 原先：每次重试写入延迟队列一次，移回主队列再写一次
+    full_bytes_per_retry = len(pickle.dumps(workflow_data, protocol=pickle.HIGHEST_PROTOCOL)) * 2
+
+    first_park_bytes = 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = ContinuationStore(Path(temp_dir) / "continuations")
+        reference_bytes = 0
+        start_time = time.perf_counter()
+        for attempt in range(retries):
+            # 每次重试只有等待中的异步任务状态发生变化
+            workflow_data["async_tasks"] = {"invoke": {"data": {"finished_record_ids": list(range(attempt))}}}
+            task_data = dict(workflow_data, node_id="invoke")
+            reference = store.park(task_data)
+            assert reference is not None
+            if attempt == 0:
+                first_park_bytes = store.bytes_written
+            reference_bytes += len(pickle.dumps(reference, protocol=pickle.HIGHEST_PROTOCOL)) * 2
+            assert store.resume(reference) is not None
+        elapsed_time = time.perf_counter() - start_time
+        later_bytes = store.bytes_written - first_park_bytes + reference_bytes
+
+    print(f"payload={payload_mb}MB retries={retries}")
+    print(f"full payload per retry:  {full_bytes_per_retry / 1024:.1f}KB")
+    print(f"continuation first park: {first_park_bytes / 1024:.1f}KB")
+    print(f"continuation per retry:  {later_bytes / max(retries - 1, 1) / 1024:.1f}KB after the first park")
+    print(f"continuation park+resume: {elapsed_time / retries * 1000:.2f}ms/retry")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payload-mb", type=float, default=4)
+    parser.add_argument("--retries", type=int, default=20)
+    args = parser.parse_args()
+    run(args.payload_mb, args.retries)
@@ -0,0 +1,102 @@
+# @Author: Bi Ying
+# @Date:   2024-08-29 10:05:51
+"""
+从本地服务器下载不同大小的文件，用 tracemalloc 统计 Python 分配的峰值内存，
+比较原来先读完整个响应再写入的做法与流式下载。之后再次下载同一个文件，检查按内容去重返回已有文件。
+Download files of several sizes from a local server and measure peak Python memory with tracemalloc.
+Compares the old approach that reads the whole response before writing it against the streamed
+download. Then downloads the same file again to check that it is deduplicated by content.
+
+    python -m benchmarks.bench_copy_online_file --sizes 16 64 256
+"""
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utilities.network import new_httpx_client
+from utilities.file_processing import StaticFileServer
+from utilities.file_processing.static_file_index import StaticFileIndex
+
+
+BLOCK = bytes(range(256)) * 4096
+
+
+class LargeFileHandler(BaseHTTPRequestHandler):
+    # /<MB>.bin 返回指定大小的内容，边生成边发送，服务器本身不占用内存
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        size_mb = int(self.path.strip("/").split(".")[0])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size_mb * len(BLOCK)))
+        self.end_headers()
+        for _ in range(size_mb):
+            self.wfile.write(BLOCK)
+
+
+def legacy_copy_online_file(file_url: str, folder: Path) -> Path:
+    # 原来的 copy_online_file：response.content 一次性读入内存
+    response = new_httpx_client(is_async=False).get(file_url, timeout=30)
+    dst = folder / file_url.rsplit("/", 1)[-1]
+    with open(dst, "wb") as f:
+        f.write(response.content)
+    return dst
+
+
+def measure(func, *args) -> tuple[int, object]:
+    # tracemalloc 会明显拖慢分配密集的代码，这里只统计峰值内存
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, result
+
+
+def run(sizes: list[int]):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LargeFileHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        static_file_server = StaticFileServer(Path(temp_dir) / "static")
+        static_file_server.file_index = StaticFileIndex(static_file_server.static_folder_path, Path(temp_dir) / "index")
+        folder = static_file_server.static_folder_path / "downloads"
+        folder.mkdir(parents=True)
+        legacy_folder = Path(temp_dir) / "legacy"
+        legacy_folder.mkdir()
+
+        for size_mb in sizes:
+            url = f"{base_url}/{size_mb}.bin"
+            for label, func in (
+                ("legacy", lambda: legacy_copy_online_file(url, legacy_folder)),
+                ("stream", lambda: static_file_server.copy_online_file(url, folder)),
+            ):
+                peak, file_path = measure(func)
+                assert file_path.stat().st_size == size_mb * len(BLOCK)
+                print(f"  [{size_mb:4d}MB {label}] peak memory={peak / 1024 / 1024:8.1f}MB -> {file_path.name}")
+
+            first = folder / f"{size_mb}.octet-stream"
+            start_time = time.perf_counter()
+            file_path = static_file_server.copy_online_file(url, folder)
+            elapsed_time = time.perf_counter() - start_time
+            print(f"  [{size_mb:4d}MB again ] time={elapsed_time:6.2f}s deduplicated={file_path == first}")
+            assert file_path == first
+
+        leftovers = [path.name for path in folder.iterdir() if path.name.startswith(".")]
+        assert not leftovers, leftovers
+        static_file_server.file_index.cache.close()
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 64, 256])
+    args = parser.parse_args()
+    run(args.sizes)
@@ -0,0 +1,56 @@
+# @Author: Bi Ying
+# @Date:   2024-08-14 16:02:11
+"""
+比较调度器每次检查延迟任务的开销：原先每 0.5 秒排序全部键，与 DelayedTaskQueue 的堆索引。
+Compare the per-tick cost of sorting every delayed-task key (previous scheduler) against the
+heap index of DelayedTaskQueue.
+
+    python -m benchmarks.bench_delayed_tasks --parked 5000
+"""
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from utilities.general import DelayedTaskQueue
+
+
+def run(parked: int, ticks: int):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        delayed_tasks = DelayedTaskQueue(Path(temp_dir) / "delayed_tasks")
+        payload = {"nodes": [], "edges": []}
+        start_time = time.perf_counter()
+        for _ in range(parked):
+            delayed_tasks.put(payload, 3600)
+        put_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for _ in range(ticks):
+            keys = sorted(delayed_tasks.cache.iterkeys())
+            float(str(keys[0]).split("_", 1)[0]) <= time.time()
+        sorted_tick_time = (time.perf_counter() - start_time) / ticks
+
+        start_time = time.perf_counter()
+        for _ in range(ticks):
+            delayed_tasks.get_due(timeout=0)
+        heap_tick_time = (time.perf_counter() - start_time) / ticks
+
+        start_time = time.perf_counter()
+        delayed_tasks.put(payload, 0)
+        due_items = delayed_tasks.get_due(timeout=1)
+        wake_latency = time.perf_counter() - start_time
+        assert len(due_items) == 1
+
+    print(f"parked={parked}")
+    print(f"put:               {put_time / parked * 1e6:.1f}us/task")
+    print(f"sorted keys tick:  {sorted_tick_time * 1000:.3f}ms")
+    print(f"heap tick:         {heap_tick_time * 1000:.3f}ms")
+    print(f"due task wake-up:  {wake_latency * 1000:.3f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--parked", type=int, default=5000)
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+    run(args.parked, args.ticks)
@@ -0,0 +1,92 @@
+# @Author: Bi Ying
+# @Date:   2024-08-12 10:23:05
+"""
+比较 Workflow.get_node_field_value 通过边索引查找与逐条遍历边的耗时。
+Compare Workflow.get_node_field_value using the edge index against a linear edge scan.
+
+    python -m benchmarks.bench_edge_resolution --nodes 500 --fields 4
+"""
+import time
+import argparse
+from copy import deepcopy
+
+from utilities.workflow import Workflow
+
+
+def make_chain_workflow(node_count: int, field_count: int) -> dict:
+    nodes = []
+    edges = []
+    for index in range(node_count):
+        template = {f"input_{i}": {"value": f"{index}-{i}"} for i in range(field_count)}
+        template["output"] = {"value": f"output-{index}", "is_output": True}
+        nodes.append(
+            {
+                "id": f"node-{index}",
+                "type": "TextReplace",
+                "category": "textProcessing",
+                "data": {"task_name": "text_processing.text_replace", "template": template},
+            }
+        )
+        if index == 0:
+            continue
+        for i in range(field_count):
+            edges.append(
+                {
+                    "id": f"edge-{index}-{i}",
+                    "source": f"node-{index - 1}",
+                    "sourceHandle": "output",
+                    "target": f"node-{index}",
+                    "targetHandle": f"input_{i}",
+                }
+            )
+    return {"wid": "benchmark", "rid": "benchmark", "nodes": nodes, "edges": edges}
+
+
+def linear_scan_field_value(workflow: Workflow, node_id: str, field: str, default=None):
+    """原先的实现：每次读取字段都遍历所有边。"""
+    node = workflow.get_node(node_id)
+    if node is None:
+        return default
+    for edge in workflow.edges:
+        source_node = workflow.get_node(edge["source"])
+        if source_node is None:
+            continue
+        if source_node.type in ("Empty", "ButtonTrigger"):
+            continue
+        if edge["target"] == node_id and edge["targetHandle"] == field:
+            input_data = source_node.get_field(edge["sourceHandle"]).get("value", default)
+            workflow.update_node_field_value(node_id, field, input_data)
+            return input_data
+    return node.get_field(field).get("value", default)
+
+
+def run(node_count: int, field_count: int, repeat: int):
+    workflow = Workflow(deepcopy(make_chain_workflow(node_count, field_count)))
+    lookups = [(node_id, f"input_{i}") for node_id in workflow.nodes for i in range(field_count)]
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for node_id, field in lookups:
+            linear_scan_field_value(workflow, node_id, field)
+    linear_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for node_id, field in lookups:
+            workflow.get_node_field_value(node_id, field)
+    indexed_time = time.perf_counter() - start_time
+
+    total_lookups = len(lookups) * repeat
+    print(f"nodes={node_count} edges={len(workflow.edges)} lookups={total_lookups}")
+    print(f"linear scan: {linear_time:.4f}s ({linear_time / total_lookups * 1e6:.2f}us/lookup)")
+    print(f"edge index:  {indexed_time:.4f}s ({indexed_time / total_lookups * 1e6:.2f}us/lookup)")
+    print(f"speedup:     {linear_time / indexed_time:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=500)
+    parser.add_argument("--fields", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+    run(args.nodes, args.fields, args.repeat)
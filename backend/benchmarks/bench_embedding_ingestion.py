@@ -0,0 +1,162 @@
+# @Author: Bi Ying
+# @Date:   2024-08-30 14:26:37
+"""
+向量数据库导入测试：本地假的 text-embeddings-inference 服务按请求固定开销加每条文本的开销返回向量，
+比较原来每个分块一次 embedding 请求、一次写入一个点，与按批请求、批量写入本地 Qdrant 的耗时。
+The ingestion benchmark runs against a fake local text-embeddings-inference server.
+The fake server charges a fixed cost per request plus a cost per text.
+It compares the old approach, which makes one embedding request and one single-point upsert per chunk,
+with batched requests and bulk upserts into a local Qdrant database.
+
+    python -m benchmarks.bench_embedding_ingestion --chunks 2000
+"""
+import json
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, VectorParams
+
+from utilities.ai_utils import EmbeddingClient
+from background_task.tasks import upsert_points
+
+
+DIMENSIONS = 384
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    # 模拟 text-embeddings-inference 的 /embed：超过 max_client_batch_size 时返回 413
+    request_latency = 0.02
+    text_latency = 0.001
+    max_client_batch_size = 32
+    request_count = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        inputs = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["inputs"]
+        texts = [inputs] if isinstance(inputs, str) else inputs
+        FakeEmbeddingHandler.request_count += 1
+        if len(texts) > self.max_client_batch_size:
+            self.send_response(413)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        time.sleep(self.request_latency + self.text_latency * len(texts))
+        embeddings = [fake_embedding(text) for text in texts]
+        body = json.dumps(embeddings).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def fake_embedding(text: str) -> list[float]:
+    rng = random.Random(text)
+    return [rng.gauss(0, 1) for _ in range(DIMENSIONS)]
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    return dot / (sum(x * x for x in a) ** 0.5 * sum(y * y for y in b) ** 0.5)
+
+
+def make_point(text: str, embedding: list, index: int, count: int) -> dict:
+    return {
+        "object_id": "benchmark",
+        "text": text,
+        "embedding": embedding,
+        "embedding_type": "text",
+        "extra_data": {},
+        "chunk_index": index,
+        "chunk_count": count,
+    }
+
+
+def legacy_ingest(embedding_client: EmbeddingClient, qdrant_client: QdrantClient, vid: str, texts: list[str]):
+    # 原来的 embedding_and_upload 与 q_add_point：每个分块一次请求，一次写入一个点
+    for index, text in enumerate(texts):
+        embedding = embedding_client.get(text)
+        upsert_points(qdrant_client, vid, [make_point(text, embedding, index, len(texts))])
+
+
+def batched_ingest(embedding_client: EmbeddingClient, qdrant_client: QdrantClient, vid: str, texts: list[str]):
+    for start, batch in embedding_client.split_batches(texts):
+        embeddings = embedding_client.get(batch)
+        assert len(embeddings) == len(batch)
+        points = [
+            make_point(text, embedding, start + offset, len(texts))
+            for offset, (text, embedding) in enumerate(zip(batch, embeddings))
+        ]
+        upsert_points(qdrant_client, vid, points)
+
+
+def run(chunks: int, chunk_length: int):
+    rng = random.Random(0)
+    words = ["vector", "workflow", "embedding", "数据库", "检索", "qdrant", "batch", "token"]
+    texts = []
+    for index in range(chunks):
+        text = f"{index} "
+        while len(text) < chunk_length:
+            text += rng.choice(words) + " "
+        texts.append(text)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeEmbeddingHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    embedding_client = EmbeddingClient(provider="text-embeddings-inference", model_id="bge-small")
+    embedding_client.api_base = f"http://127.0.0.1:{server.server_address[1]}/embed"
+    embedding_client.api_key = None
+    batches = list(embedding_client.split_batches(texts))
+    print(
+        f"{chunks} chunks of {chunk_length} characters, {len(batches)} batches "
+        f"(max {embedding_client.max_batch_size} texts, {embedding_client.max_batch_tokens} tokens)"
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        qdrant_client = QdrantClient(path=Path(temp_dir).as_posix())
+        for label, ingest in (("legacy", legacy_ingest), ("batched", batched_ingest)):
+            vid = label
+            qdrant_client.create_collection(
+                collection_name=f"{vid}_text_collection",
+                vectors_config=VectorParams(size=DIMENSIONS, distance=Distance.COSINE),
+                on_disk_payload=True,
+            )
+            FakeEmbeddingHandler.request_count = 0
+            start_time = time.perf_counter()
+            ingest(embedding_client, qdrant_client, vid, texts)
+            elapsed_time = time.perf_counter() - start_time
+            point_count = qdrant_client.count(collection_name=f"{vid}_text_collection").count
+            assert point_count == chunks, point_count
+            print(
+                f"  [{label:<7}] {elapsed_time:6.2f}s {chunks / elapsed_time:8.1f} chunks/s "
+                f"requests={FakeEmbeddingHandler.request_count}"
+            )
+
+        # 批量写入的每个点都对应正确的原文和向量
+        records, _ = qdrant_client.scroll(
+            collection_name="batched_text_collection", limit=chunks, with_payload=True, with_vectors=True
+        )
+        # 余弦距离的集合中向量已归一化，按余弦相似度比较
+        for record in records:
+            assert cosine_similarity(record.vector, fake_embedding(record.payload["text"])) > 0.999
+        assert sorted(record.payload["text"] for record in records) == sorted(texts)
+        qdrant_client.close()
+
+    embedding_client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-length", type=int, default=500)
+    args = parser.parse_args()
+    run(args.chunks, args.chunk_length)
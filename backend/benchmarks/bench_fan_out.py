@@ -0,0 +1,86 @@
+# @Author: Bi Ying
+# @Date:   2024-08-25 14:48:09
+"""
+一个 workflow_invoke 节点以列表输入启动大量子工作流，同时从编辑器发起若干次小的运行，
+比较有并发窗口和不限制（窗口等于列表长度）时：子工作流队列的峰值长度、全部子工作流的总耗时、
+以及编辑器中运行从入队到结束的延迟。
+One workflow_invoke node fans out over a long list while a few small runs are started from the editor.
+Compares a bounded window against no limit (window as large as the list): peak length of the child lane,
+total time of the fan-out, and enqueue-to-finish latency of the editor runs.
+
+    python -m benchmarks.bench_fan_out --items 1000 --window 8
+"""
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from threading import Event, Thread
+
+from benchmarks.bench_suite import ServerBenchmark, format_latencies
+from benchmarks.workflow_generators import make_deep_workflow, make_wide_workflow, make_sub_workflow_heavy_workflow
+
+
+def run(items: int, window: int, sleep: float, probes: int, num_workers: int):
+    from models import WorkflowRunRecord
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with ServerBenchmark(Path(temp_dir), num_workers, num_node_workers=4) as benchmark:
+            child_model = benchmark.create_workflow("benchmark child", make_deep_workflow(2, sleep))
+            probe_model = benchmark.create_workflow("benchmark probe", make_wide_workflow(3, sleep))
+            print(f"{items} child runs, child sleep={sleep}s per node, workers={num_workers}")
+
+            for label, max_concurrency in ((f"window={window}", window), ("unbounded", items)):
+                parent_model = benchmark.create_workflow(
+                    f"benchmark fan-out {label}",
+                    make_sub_workflow_heavy_workflow(child_model.wid.hex, 2, 1, items, max_concurrency),
+                )
+
+                peak_child_lane = 0
+                stop_sampling = Event()
+
+                def sample_queue():
+                    nonlocal peak_child_lane
+                    while not stop_sampling.wait(0.01):
+                        lane_length = benchmark.server.main_queue.lane_lengths().get("child", 0)
+                        peak_child_lane = max(peak_child_lane, lane_length)
+
+                sampler = Thread(target=sample_queue, daemon=True)
+                sampler.start()
+
+                parent_record_id, parent_enqueue_time = benchmark.enqueue(parent_model)
+                probe_enqueue_times = {}
+                for _ in range(probes):
+                    time.sleep(0.2)
+                    record_id, enqueue_time = benchmark.enqueue(
+                        probe_model, run_from=WorkflowRunRecord.RunFromTypes.WEB
+                    )
+                    probe_enqueue_times[record_id] = enqueue_time
+                benchmark.wait()
+                stop_sampling.set()
+                sampler.join()
+
+                parent_record = WorkflowRunRecord.get(WorkflowRunRecord.rid == parent_record_id)
+                invoke_node = next(node for node in parent_record.data["nodes"] if node["id"] == "invoke-0")
+                outputs = invoke_node["data"]["template"]["output"]["value"]
+                probe_latencies = [
+                    benchmark.finish_times[record_id] - enqueue_time
+                    for record_id, enqueue_time in probe_enqueue_times.items()
+                ]
+                print(f"[{label}]")
+                print(
+                    f"  fan-out: {benchmark.finish_times[parent_record_id] - parent_enqueue_time:7.2f}s "
+                    f"status={parent_record.status} outputs={len(outputs)} peak child lane={peak_child_lane}"
+                )
+                if probe_latencies:
+                    print(f"  editor runs: {format_latencies(probe_latencies)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--window", type=int, default=8)
+    parser.add_argument("--sleep", type=float, default=0.0)
+    parser.add_argument("--probes", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    run(args.items, args.window, args.sleep, args.probes, args.workers)
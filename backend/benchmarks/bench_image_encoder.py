@@ -0,0 +1,108 @@
+# @Author: Bi Ying
+# @Date:   2024-08-27 10:16:42
+"""
+比较按尺寸上限编码图片的两种做法：原来每次把缩放比例减 0.1 后完整缩放并重新编码，
+以及按字节比例估计后对质量和缩放比例二分。统计编码次数、耗时和最终大小，并检查内容哈希缓存命中时的耗时。
+测试图片为合成的照片（渐变加噪声）和截图（大块纯色、线条和文字）。
+Compare two ways of encoding an image to a size limit: the old loop that lowers the scale by 0.1 and does
+a full resize and re-encode every step, against estimating from the byte ratio and bisecting quality and
+scale. Reports encode passes, time and final size, and checks the time of a content hash cache hit.
+The test images are a synthetic photo (gradient plus noise) and a screenshot (flat areas, lines, text).
+
+    python -m benchmarks.bench_image_encoder --max-size 1048576
+"""
+import time
+import random
+import argparse
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from utilities.media_processing import ImageProcessor
+from utilities.media_processing.image import (
+    encode_image_to_size,
+    get_encoded_image_cache,
+    get_encoded_image_cache_key,
+)
+
+
+def make_photo(width: int, height: int) -> Image.Image:
+    gradient = Image.linear_gradient("L").resize((width, height))
+    channels = [
+        Image.blend(gradient, Image.effect_noise((width, height), sigma), 0.5) for sigma in (40, 60, 80)
+    ]
+    image = Image.merge("RGB", channels)
+    image.format = "JPEG"
+    return image
+
+
+def make_screenshot(width: int, height: int) -> Image.Image:
+    rng = random.Random(0)
+    image = Image.new("RGB", (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    for _ in range(300):
+        x, y = rng.randrange(width), rng.randrange(height)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle((x, y, x + rng.randrange(20, 400), y + rng.randrange(10, 200)), fill=color)
+    for row in range(0, height, 18):
+        draw.text((10 + row % 50, row), "The quick brown fox jumps over the lazy dog " * 8, fill=(20, 20, 20))
+    image.format = "PNG"
+    return image
+
+
+def legacy_encode(img: Image.Image, image_format: str, max_size: int) -> tuple[bytes, int]:
+    # 原来的 ImageProcessor._resize_image 中按尺寸上限编码的部分
+    passes = 1
+    img_bytes = BytesIO()
+    img.save(img_bytes, format=image_format, optimize=True)
+    if img_bytes.getbuffer().nbytes <= max_size:
+        return img_bytes.getvalue(), passes
+
+    scale_factor = 0.9
+    while True:
+        new_size = (int(img.width * scale_factor), int(img.height * scale_factor))
+        img_resized = img.resize(new_size, Image.Resampling.LANCZOS)
+        img_bytes_resized = BytesIO()
+        img_resized.save(img_bytes_resized, format=image_format, optimize=True)
+        passes += 1
+        if img_bytes_resized.getbuffer().nbytes <= max_size:
+            return img_bytes_resized.getvalue(), passes
+        scale_factor -= 0.1
+        if scale_factor < 0.1:
+            return img_bytes_resized.getvalue(), passes
+
+
+def run(max_size: int, width: int, height: int):
+    images = {"photo": make_photo(width, height), "screenshot": make_screenshot(width, height)}
+    print(f"{width}x{height} images, max size {max_size / 1024:.0f}KB")
+    for name, image in images.items():
+        for label, encoder in (("legacy", legacy_encode), ("bisect", encode_image_to_size)):
+            start_time = time.perf_counter()
+            encoded, passes = encoder(image, image.format, max_size)
+            elapsed_time = time.perf_counter() - start_time
+            encoded_image = Image.open(BytesIO(encoded))
+            print(
+                f"  [{name:<10} {label}] passes={passes} time={elapsed_time * 1000:8.1f}ms "
+                f"size={len(encoded) / 1024:7.0f}KB dimensions={encoded_image.width}x{encoded_image.height}"
+            )
+            assert len(encoded) <= max_size
+
+        # 同一张图片再次编码时命中内容哈希缓存，先删除之前运行留下的缓存
+        get_encoded_image_cache().delete(get_encoded_image_cache_key(image, image.format, max_size, None, None))
+        timings = []
+        for _ in range(2):
+            start_time = time.perf_counter()
+            image_copy = image.copy()
+            image_copy.format = image.format
+            ImageProcessor(image_copy, max_size=max_size).bytes
+            timings.append(time.perf_counter() - start_time)
+        print(f"  [{name:<10} cache ] first={timings[0] * 1000:8.1f}ms repeated={timings[1] * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-size", type=int, default=1024 * 1024)
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    args = parser.parse_args()
+    run(args.max_size, args.width, args.height)
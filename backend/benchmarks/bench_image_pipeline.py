@@ -0,0 +1,101 @@
+# @Author: Bi Ying
+# @Date:   2024-08-27 17:05:33
+"""
+比较图片编辑节点处理一批图片的两种做法：
+原来逐张处理，每个操作在 ImageProcessor 上执行，压缩时额外编码解码一次，写文件前再编码一次；
+合并后的流水线在线程中处理，每张图片只解码和编码一次。
+操作链为按比例裁剪、缩放、压缩、旋转和图片水印。
+Compare two ways an image editing node processes a batch:
+the old per-image path where every operation runs on an ImageProcessor, compress encodes and decodes
+once more and the result is encoded again before writing; and the fused pipeline in threads, which
+decodes and encodes each image once.
+The chain is a proportional crop, scale, compress, rotate and an image watermark.
+
+    python -m benchmarks.bench_image_pipeline --images 200
+"""
+import os
+import time
+import uuid
+import argparse
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+
+from utilities.media_processing import ImageProcessor, render_images
+
+
+def make_images(folder: Path, count: int, width: int, height: int) -> tuple[list[str], str]:
+    sources = []
+    for index in range(count):
+        gradient = Image.linear_gradient("L").resize((width, height))
+        noise = Image.effect_noise((width, height), 30 + index % 40)
+        image = Image.merge("RGB", (gradient, Image.blend(gradient, noise, 0.5), noise))
+        path = folder / f"input_{index}.jpg"
+        image.save(path, format="JPEG", quality=90)
+        sources.append(str(path))
+    watermark_path = folder / "watermark.png"
+    Image.new("RGBA", (200, 80), (255, 0, 0, 128)).save(watermark_path)
+    return sources, str(watermark_path)
+
+
+def make_operations(watermark: str) -> list[tuple[str, dict]]:
+    return [
+        ("crop", dict(method="proportional", width_ratio=16, height_ratio=9, position="center")),
+        ("scale", dict(method="proportional_scale", ratio=0.5)),
+        ("compress", dict(quality=80)),
+        ("rotate", dict(angle=90)),
+        (
+            "add_image_watermark",
+            dict(watermark_image=watermark, width_ratio=0.2, height_ratio=0, position="bottom_right"),
+        ),
+    ]
+
+
+def legacy_render(image_source: str, operations: list[tuple[str, dict]], output_folder: Path) -> str:
+    # 原来 image_editing 和 image_watermark 中逐张处理的做法
+    image_processor = ImageProcessor(image_source, max_size=None)
+    for method, params in operations:
+        if method == "add_image_watermark":
+            params = {**params, "watermark_image": ImageProcessor(params["watermark_image"], max_size=None).image}
+        getattr(image_processor, method)(**params)
+    extension = image_processor.mime_type.split("/")[1].lower()
+    image_name = f"{uuid.uuid4().hex}.{extension}"
+    with open(output_folder / image_name, "wb") as file:
+        file.write(image_processor.bytes)
+    return image_name
+
+
+def run(count: int, width: int, height: int):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_folder = Path(temp_dir) / "input"
+        input_folder.mkdir()
+        sources, watermark = make_images(input_folder, count, width, height)
+        jobs = [(source, make_operations(watermark)) for source in sources]
+        print(f"{count} images of {width}x{height}, {os.cpu_count()} CPUs")
+
+        for label in ("legacy", "fused threads"):
+            output_folder = Path(temp_dir) / label.replace(" ", "_")
+            output_folder.mkdir()
+            start_time = time.perf_counter()
+            if label == "legacy":
+                image_names = [legacy_render(source, operations, output_folder) for source, operations in jobs]
+            else:
+                image_names = render_images(jobs, output_folder)
+            elapsed_time = time.perf_counter() - start_time
+            written = sorted(path.name for path in output_folder.iterdir())
+            output_size = sum(path.stat().st_size for path in output_folder.iterdir())
+            print(
+                f"  [{label:<18}] time={elapsed_time:6.2f}s per image={elapsed_time / count * 1000:6.1f}ms "
+                f"files={len(written)} output={output_size / 1024 / 1024:6.1f}MB"
+            )
+            assert written == sorted(image_names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1440)
+    args = parser.parse_args()
+    run(args.images, args.width, args.height)
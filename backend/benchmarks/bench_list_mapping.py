@@ -0,0 +1,122 @@
+# @Author: Bi Ying
+# @Date:   2024-08-26 15:32:10
+"""
+用本地的假服务器比较 map_list 逐项请求与并发请求的耗时：服务器对每个请求注入固定延迟并记录同时进行的请求数。
+单项失败等行为的测试见 tests/test_list_mapping.py。
+Compare sequential against concurrent map_list requests using a local fake server that adds a fixed
+latency to every request and records how many requests are in flight. Behaviour such as failed items
+is tested in tests/test_list_mapping.py.
+
+    python -m benchmarks.bench_list_mapping --items 20 --latency 0.2
+"""
+import time
+import argparse
+from threading import Thread, Lock
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from utilities.general.list_mapping import map_list, set_provider_limits
+
+
+class LatencyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float):
+        super().__init__(("127.0.0.1", 0), LatencyHandler)
+        self.latency = latency
+        self.lock = Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.start_times: list[float] = []
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset(self):
+        with self.lock:
+            self.peak_in_flight = 0
+            self.start_times = []
+
+
+class LatencyHandler(BaseHTTPRequestHandler):
+    server: LatencyServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.peak_in_flight = max(self.server.peak_in_flight, self.server.in_flight)
+            self.server.start_times.append(time.monotonic())
+        try:
+            time.sleep(self.server.latency)
+            url = urlparse(self.path)
+            if "fail" in parse_qs(url.query):
+                self.send_response(500)
+                self.end_headers()
+                return
+            payload = url.path.rsplit("/", 1)[-1].encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+
+def run(items: int, latency: float, concurrency: int):
+    server = LatencyServer(latency)
+    Thread(target=server.serve_forever, daemon=True).start()
+    http_client = httpx.Client()
+
+    def fetch(url: str) -> str:
+        response = http_client.get(url)
+        response.raise_for_status()
+        return response.text
+
+    urls = [f"{server.base_url}/item/{index}" for index in range(items)]
+    expected = [str(index) for index in range(items)]
+    print(f"{items} items, {latency * 1000:.0f}ms per request")
+
+    set_provider_limits("bench-sequential", 1)
+    set_provider_limits("bench-concurrent", concurrency)
+    elapsed_times = {}
+    for provider, limit in (("bench-sequential", 1), ("bench-concurrent", concurrency)):
+        server.reset()
+        start_time = time.perf_counter()
+        results = map_list(fetch, urls, provider=provider)
+        elapsed_times[provider] = time.perf_counter() - start_time
+        print(
+            f"  [{provider:<16}] time={elapsed_times[provider]:6.2f}s "
+            f"peak in flight={server.peak_in_flight} (limit {limit})"
+        )
+        assert results == expected
+        assert server.peak_in_flight <= limit
+    print(f"  speedup: {elapsed_times['bench-sequential'] / elapsed_times['bench-concurrent']:.1f}x")
+
+    # 请求间隔：并发数足够时，相邻请求开始的间隔仍不小于 interval
+    interval = latency / 2
+    set_provider_limits("bench-interval", items, interval)
+    server.reset()
+    results = map_list(fetch, urls[:6], provider="bench-interval")
+    gaps = [later - earlier for earlier, later in zip(server.start_times, server.start_times[1:])]
+    print(f"  [bench-interval  ] interval={interval * 1000:.0f}ms smallest gap={min(gaps) * 1000:.0f}ms")
+    assert results == expected[:6]
+    assert min(gaps) >= interval * 0.9
+
+    http_client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    run(args.items, args.latency, args.concurrency)
@@ -0,0 +1,173 @@
+# @Author: Bi Ying
+# @Date:   2024-08-21 14:05:52
+"""
+用一个本地的 OpenAI 兼容假服务器统计实际请求次数，检查大模型回复缓存：
+重复运行同一个节点、同一批次中重复的提示词都不会再次请求模型，流式输出的缓存会被重放。
+Check the model response cache against a local fake OpenAI-compatible server that counts requests:
+re-running a node and duplicate prompts in one batch do not reach the model again, and cached
+streams are replayed.
+
+    python -m benchmarks.bench_llm_response_cache
+"""
+import re
+import json
+import time
+import copy
+from threading import Thread, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from vectorvein.settings import settings as vectorvein_settings
+
+from utilities.config import cache
+from worker.tasks.llms.open_ai import OpenAITask
+
+
+MODEL = "gpt-4o-mini"
+RESPONSE_DELAY = 0.2
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.request_count = 0
+        self.request_count_lock = Lock()
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.request_count_lock:
+            self.server.request_count += 1
+        time.sleep(RESPONSE_DELAY)
+        content = f"echo: {body['messages'][-1]['content']}"
+        usage = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            data = {
+                **base,
+                "object": "chat.completion",
+                "choices": [
+                    {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}
+                ],
+                "usage": usage,
+            }
+            payload = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        chunks = [
+            {"index": 0, "delta": {"role": "assistant", "content": word}, "finish_reason": None}
+            for word in re.findall(r"\S+\s*", content)
+        ]
+        chunks.append({"index": 0, "delta": {}, "finish_reason": "stop"})
+        for choice in chunks:
+            data = {**base, "object": "chat.completion.chunk", "choices": [choice]}
+            if choice["finish_reason"]:
+                data["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class FakeServerOpenAITask(OpenAITask):
+    api_base = ""
+
+    def load_llm_settings(self):
+        vectorvein_settings.load(
+            {
+                "VERSION": "2",
+                "endpoints": [
+                    {"id": "fake", "api_base": self.api_base, "api_key": "fake", "rpm": 10000, "concurrent_requests": 8}
+                ],
+                "backends": {
+                    "openai": {
+                        "models": {
+                            MODEL: {
+                                "id": MODEL,
+                                "endpoints": ["fake"],
+                                "context_length": 128000,
+                                "max_output_tokens": 4096,
+                            }
+                        }
+                    }
+                },
+            }
+        )
+
+
+def make_workflow_data(prompt: str | list[str], temperature: float, stream: bool = False) -> dict:
+    template = {
+        "llm_model": {"value": MODEL},
+        "prompt": {"value": prompt},
+        "temperature": {"value": temperature},
+        "stream": {"value": stream},
+        "output": {"value": "", "is_output": True},
+    }
+    return {
+        "rid": f"bench-{time.time_ns()}",
+        "nodes": [{"id": "llm", "type": "OpenAI", "category": "llms", "data": {"task_name": "llms.open_ai", "template": template}}],
+        "edges": [],
+    }
+
+
+def run_node(server: FakeOpenAIServer, workflow_data: dict) -> tuple[int, float, dict]:
+    count_before = server.request_count
+    start_time = time.perf_counter()
+    result = FakeServerOpenAITask(copy.deepcopy(workflow_data), "llm").run()
+    return server.request_count - count_before, time.perf_counter() - start_time, result
+
+
+def run():
+    server = FakeOpenAIServer()
+    Thread(target=server.serve_forever, daemon=True).start()
+    FakeServerOpenAITask.api_base = server.api_base
+    unique = time.time_ns()
+
+    single = make_workflow_data(f"hello {unique}", temperature=0)
+    for attempt in ("first run", "second run"):
+        requests, elapsed_time, _ = run_node(server, single)
+        print(f"temperature=0 {attempt:<11} requests={requests} time={elapsed_time * 1000:7.1f}ms")
+    assert requests == 0
+
+    batch = make_workflow_data([f"a {unique}", f"b {unique}", f"a {unique}", f"a {unique}"], temperature=0)
+    requests, elapsed_time, result = run_node(server, batch)
+    print(f"batch of 4 with 2 unique prompts    requests={requests} time={elapsed_time * 1000:7.1f}ms")
+    assert requests == 2
+    assert result["nodes"][0]["data"]["template"]["output"]["value"][2] == f"echo: a {unique}"
+
+    random_sampling = make_workflow_data(f"creative {unique}", temperature=0.7)
+    for attempt in ("first run", "second run"):
+        requests, _, _ = run_node(server, random_sampling)
+        print(f"temperature=0.7 {attempt:<11} requests={requests}")
+        assert requests == 1
+
+    stream = make_workflow_data(f"stream {unique}", temperature=0, stream=True)
+    for attempt in ("first run", "second run"):
+        requests, elapsed_time, result = run_node(server, stream)
+        pushed = cache.get(f"workflow_record{result['rid']}_nodellm:data_queue", [])
+        print(f"stream {attempt:<11} requests={requests} time={elapsed_time * 1000:7.1f}ms pushed={pushed}")
+    assert requests == 0 and pushed[-1] == {"end": True}
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    run()
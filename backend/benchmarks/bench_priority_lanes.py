@@ -0,0 +1,86 @@
+# @Author: Bi Ying
+# @Date:   2024-08-20 16:42:18
+"""
+模拟一个父工作流一次启动大量子工作流时，聊天/编辑器中新启动的运行需要等待多久才开始执行。
+对比原先的单一先进先出队列与按通道加权轮询的工作流队列。
+Measure how long interactive runs wait while a large workflow_invoke fan-out is draining,
+comparing the previous single FIFO queue with the lane-weighted workflow queue.
+
+    python -m benchmarks.bench_priority_lanes --children 100 --interactive 10
+"""
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from threading import Thread
+
+from utilities.general import TaskQueue
+from utilities.workflow import WORKFLOW_QUEUE_LANES, get_queue_route
+
+
+def worker(queue: TaskQueue, run_time: float, results: dict, total: int):
+    while len(results["children"]) + len(results["interactive"]) < total:
+        task_data = queue.get(timeout=1)
+        if task_data is None:
+            continue
+        results[task_data["kind"]].append(time.perf_counter() - task_data["enqueue_time"])
+        # 模拟运行一个工作流
+        time.sleep(run_time)
+
+
+def measure(queue: TaskQueue, children: int, interactive: int, num_workers: int, run_time: float) -> dict:
+    results: dict[str, list[float]] = {"children": [], "interactive": []}
+    # 单通道队列模拟原先的先进先出行为，不区分来源
+    routed = len(queue.lanes) > 1
+    parent_route = get_queue_route("WORKFLOW", parent_record_id="parent") if routed else {}
+    for _ in range(children):
+        queue.put({"kind": "children", "enqueue_time": time.perf_counter()}, **parent_route)
+
+    threads = [
+        Thread(target=worker, args=(queue, run_time, results, children + interactive), daemon=True)
+        for _ in range(num_workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    # 子工作流排空期间，用户陆续在聊天中发起工具调用
+    chat_route = get_queue_route("CHAT") if routed else {}
+    for _ in range(interactive):
+        time.sleep(run_time * children / num_workers / (interactive + 1))
+        queue.put({"kind": "interactive", "enqueue_time": time.perf_counter()}, **chat_route)
+
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def report(name: str, latencies: list[float]):
+    print(
+        f"{name:<24} mean={statistics.mean(latencies) * 1000:9.2f}ms "
+        f"p50={statistics.median(latencies) * 1000:9.2f}ms max={max(latencies) * 1000:9.2f}ms"
+    )
+
+
+def run(children: int, interactive: int, num_workers: int, run_time: float):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fifo_results = measure(TaskQueue(Path(temp_dir) / "fifo"), children, interactive, num_workers, run_time)
+        lane_results = measure(
+            TaskQueue(Path(temp_dir) / "lanes", lanes=WORKFLOW_QUEUE_LANES), children, interactive, num_workers, run_time
+        )
+
+    print(f"children={children} interactive={interactive} workers={num_workers} run_time={run_time * 1000:.0f}ms")
+    report("fifo interactive", fifo_results["interactive"])
+    report("lanes interactive", lane_results["interactive"])
+    report("fifo children", fifo_results["children"])
+    report("lanes children", lane_results["children"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--children", type=int, default=100)
+    parser.add_argument("--interactive", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--run-time", type=float, default=0.02)
+    args = parser.parse_args()
+    run(args.children, args.interactive, args.workers, args.run_time)
@@ -0,0 +1,74 @@
+# @Author: Bi Ying
+# @Date:   2024-08-19 10:48:26
+"""
+并发执行多个 CPU 密集型桩节点，比较只使用线程与使用进程池的总耗时。
+Run several CPU-heavy stub nodes in parallel and compare threads only against the process pool.
+
+    python -m benchmarks.bench_process_pool --nodes 4 --loops 3000000
+"""
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from utilities.workflow import Workflow
+from worker.tasks import task, graph
+
+
+@task(cpu_bound=True)
+def cpu_node(workflow_data: dict, node_id: str):
+    workflow = Workflow(workflow_data)
+    loops = int(workflow.get_node_field_value(node_id, "loops"))
+    total = 0
+    for i in range(loops):
+        total += i * i
+    workflow.update_node_field_value(node_id, "output", total)
+    return workflow.data
+
+
+def make_workflow_data(node_count: int, loops: int) -> dict:
+    nodes = [
+        {
+            "id": f"cpu-{index}",
+            "type": "ProgrammingFunction",
+            "category": "tools",
+            "data": {
+                "task_name": "tools.programming_function",
+                "template": {"loops": {"value": loops}, "output": {"value": None}},
+            },
+        }
+        for index in range(node_count)
+    ]
+    return {"wid": "benchmark", "rid": "benchmark", "nodes": nodes, "edges": []}
+
+
+def run_graph(node_count: int, loops: int, process_pool=None) -> float:
+    workflow = Workflow(make_workflow_data(node_count, loops))
+    node_tasks = {node_id: cpu_node.s(node_id) for node_id in workflow.nodes}
+    start_time = time.perf_counter()
+    graph(workflow.dag, node_tasks, max_workers=node_count, process_pool=process_pool)(workflow.data, workflow=workflow)
+    elapsed_time = time.perf_counter() - start_time
+    assert all(node.get_field("output")["value"] is not None for node in workflow.nodes.values())
+    return elapsed_time
+
+
+def run(node_count: int, loops: int):
+    thread_time = run_graph(node_count, loops)
+    with ProcessPoolExecutor(max_workers=node_count, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # 预热：子进程启动和导入任务模块的开销不计入
+        run_graph(node_count, 1000, pool)
+        process_time = run_graph(node_count, loops, pool)
+
+    print(f"nodes={node_count} loops={loops} cpus={os.cpu_count()}")
+    print(f"threads:      {thread_time:.3f}s")
+    print(f"process pool: {process_time:.3f}s")
+    print(f"speedup:      {thread_time / process_time:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--loops", type=int, default=3_000_000)
+    args = parser.parse_args()
+    run(args.nodes, args.loops)
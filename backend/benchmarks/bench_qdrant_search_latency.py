@@ -0,0 +1,171 @@
+# @Author: Bi Ying
+# @Date:   2024-08-30 17:48:12
+"""
+向量检索延迟测试：在本地 Qdrant 中写入一批随机向量，比较原来经过磁盘队列提交检索、轮询缓存中的结果，
+与通过 submit 提交、等待 Qdrant 线程直接设置的 Future。分别统计逐条检索和多线程并发检索的延迟。
+Vector search latency benchmark. A batch of random vectors is written to a local Qdrant database.
+It compares the old path, which sends each search through the durable queue and polls the cache for the
+result, with submit, which waits on a Future set directly by the Qdrant thread.
+Latency is measured for sequential searches and for searches from several threads.
+
+    python -m benchmarks.bench_qdrant_search_latency --points 5000 --searches 50
+"""
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
+
+from diskcache import Cache, Deque
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+
+from background_task.server import BackgroundTaskServer
+from background_task.tasks import background_task, get_task
+
+
+DIMENSIONS = 384
+
+
+@background_task
+def q_benchmark_search(client: QdrantClient, vid: str, text_embedding: list, limit: int = 5):
+    # 与 q_search_point 相同，使用新旧版本 qdrant-client 都支持的 query_points
+    response = client.query_points(collection_name=f"{vid}_text_collection", query=text_embedding, limit=limit)
+    return [point.payload for point in response.points]
+
+
+def legacy_qdrant_task_server(stop_event: Event, queue_directory: Path, qdrant_path: Path, result_cache: Cache):
+    # 原来的 run_qdrant_task_server：空闲时每秒检查一次磁盘队列，结果写入缓存
+    qdrant_client = QdrantClient(path=qdrant_path.as_posix())
+    qdrant_tasks_queue = Deque(directory=queue_directory)
+    sleep_time = 1
+    while not stop_event.is_set():
+        if len(qdrant_tasks_queue) > 0:
+            task = qdrant_tasks_queue.pop()
+            task_result = get_task(task["task_name"])(qdrant_client, *task["args"], **task["kwargs"])
+            result_cache.set(f"task_result_{task['task_id']}", task_result, expire=60 * 10)
+            sleep_time = 0.01
+        else:
+            sleep_time = 1
+        time.sleep(sleep_time)
+    qdrant_client.close()
+
+
+def legacy_search(queue: Deque, result_cache: Cache, vector: list) -> list:
+    # 原来的 search_data：提交到磁盘队列后每 0.1 秒检查一次结果
+    task_id = uuid.uuid4().hex
+    task = {
+        "task_name": "q_benchmark_search",
+        "task_id": task_id,
+        "args": (),
+        "kwargs": {"vid": "benchmark", "text_embedding": vector, "limit": 5},
+    }
+    queue.appendleft(task)
+    search_results = result_cache.get(f"task_result_{task_id}", None)
+    while search_results is None:
+        time.sleep(0.1)
+        search_results = result_cache.get(f"task_result_{task_id}", None)
+    return search_results
+
+
+def future_search(vector: list) -> list:
+    return q_benchmark_search.submit(vid="benchmark", text_embedding=vector, limit=5).result()
+
+
+def measure(search, vectors: list[list], threads: int) -> list[float]:
+    def timed_search(vector: list) -> float:
+        start_time = time.perf_counter()
+        results = search(vector)
+        assert len(results) == 5
+        return time.perf_counter() - start_time
+
+    if threads == 1:
+        latencies = []
+        for vector in vectors:
+            latencies.append(timed_search(vector))
+            # 检索之间有间隔，与工作流中的实际调用一样
+            time.sleep(random.uniform(0, 0.2))
+        return latencies
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(timed_search, vectors))
+
+
+def format_latencies(latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+    return (
+        f"median={statistics.median(latencies) * 1000:8.1f}ms p95={p95 * 1000:8.1f}ms "
+        f"max={latencies[-1] * 1000:8.1f}ms"
+    )
+
+
+def run(points: int, searches: int, threads: int):
+    rng = random.Random(0)
+    vectors = [[rng.gauss(0, 1) for _ in range(DIMENSIONS)] for _ in range(searches)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        qdrant_path = Path(temp_dir) / "qdrant_db"
+        qdrant_client = QdrantClient(path=qdrant_path.as_posix())
+        qdrant_client.create_collection(
+            collection_name="benchmark_text_collection",
+            vectors_config=VectorParams(size=DIMENSIONS, distance=Distance.COSINE),
+            on_disk_payload=True,
+        )
+        for start in range(0, points, 1000):
+            qdrant_client.upsert(
+                collection_name="benchmark_text_collection",
+                points=[
+                    PointStruct(
+                        id=uuid.uuid4().hex,
+                        payload={"text": f"chunk {index}"},
+                        vector=[rng.gauss(0, 1) for _ in range(DIMENSIONS)],
+                    )
+                    for index in range(start, min(start + 1000, points))
+                ],
+            )
+        # 本地模式同一时间只能有一个客户端
+        qdrant_client.close()
+        print(f"{points} points of {DIMENSIONS} dimensions, {searches} searches")
+
+        queue_directory = Path(temp_dir) / "legacy_queue"
+        result_cache = Cache(directory=Path(temp_dir) / "legacy_results")
+        queue = Deque(directory=queue_directory)
+        stop_event = Event()
+        legacy_thread = Thread(
+            target=legacy_qdrant_task_server, args=(stop_event, queue_directory, qdrant_path, result_cache)
+        )
+        legacy_thread.start()
+        for count in (1, threads):
+            latencies = measure(lambda vector: legacy_search(queue, result_cache, vector), vectors, count)
+            print(f"  [legacy  threads={count}] {format_latencies(latencies)}")
+        stop_event.set()
+        legacy_thread.join()
+        result_cache.close()
+
+        server = BackgroundTaskServer(cache_dir=Path(temp_dir) / "cache", num_workers=0, qdrant_path=qdrant_path)
+        server.start()
+        for count in (1, threads):
+            latencies = measure(future_search, vectors, count)
+            print(f"  [future  threads={count}] {format_latencies(latencies)}")
+        # 任务中的异常通过 Future 传给调用方，不会一直等待
+        future = q_benchmark_search.submit(vid="missing", text_embedding=vectors[0], limit=5)
+        try:
+            future.result(timeout=10)
+        except Exception as e:
+            print(f"  error propagated: {type(e).__name__}")
+        else:
+            raise AssertionError("search in a missing collection should fail")
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=5000)
+    parser.add_argument("--searches", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    run(args.points, args.searches, args.threads)
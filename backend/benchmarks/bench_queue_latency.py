@@ -0,0 +1,68 @@
+# @Author: Bi Ying
+# @Date:   2024-08-14 11:30:46
+"""
+测量从入队到 worker 开始处理的延迟：阻塞式 TaskQueue.get 与原先 len() + sleep(1) 轮询的对比。
+Measure enqueue-to-start latency of the blocking TaskQueue.get against the previous
+len() + sleep(1) polling loop.
+
+    python -m benchmarks.bench_queue_latency --count 20
+"""
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from threading import Thread
+
+from utilities.general import TaskQueue
+
+
+def polling_worker(queue: TaskQueue, count: int, latencies: list[float]):
+    while len(latencies) < count:
+        if len(queue) > 0:
+            task_data = queue.get(timeout=0)
+            latencies.append(time.perf_counter() - task_data["enqueue_time"])
+        else:
+            time.sleep(1)
+
+
+def blocking_worker(queue: TaskQueue, count: int, latencies: list[float]):
+    while len(latencies) < count:
+        task_data = queue.get(timeout=1)
+        if task_data is None:
+            continue
+        latencies.append(time.perf_counter() - task_data["enqueue_time"])
+
+
+def measure(worker, directory: Path, count: int) -> list[float]:
+    queue = TaskQueue.open(directory)
+    latencies: list[float] = []
+    thread = Thread(target=worker, args=(queue, count, latencies), daemon=True)
+    thread.start()
+    for _ in range(count):
+        # 随机间隔入队，模拟用户在任意时刻启动工作流
+        time.sleep(random.uniform(0.05, 0.3))
+        queue.put({"enqueue_time": time.perf_counter()})
+    thread.join()
+    return latencies
+
+
+def report(name: str, latencies: list[float]):
+    print(
+        f"{name:<10} mean={statistics.mean(latencies) * 1000:8.2f}ms "
+        f"p50={statistics.median(latencies) * 1000:8.2f}ms max={max(latencies) * 1000:8.2f}ms"
+    )
+
+
+def run(count: int):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        report("polling", measure(polling_worker, Path(temp_dir) / "polling", count))
+        report("blocking", measure(blocking_worker, Path(temp_dir) / "blocking", count))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20)
+    args = parser.parse_args()
+    run(args.count)
@@ -0,0 +1,98 @@
+# @Author: Bi Ying
+# @Date:   2024-08-13 11:06:52
+"""
+在分支耗时不均的工作流上比较按层执行与按依赖就绪执行的总耗时。
+节点任务替换为只 sleep 的桩函数。
+Compare layer-by-layer execution with the dependency-driven TaskGraph on a workflow whose
+branches have uneven latencies. Node tasks are replaced with stubs that only sleep.
+
+    python -m benchmarks.bench_scheduler --branches 4 --depth 3 --slow 0.5 --fast 0.05
+"""
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from utilities.workflow import DAG
+from worker.tasks import task, graph
+
+
+node_sleep_times: dict[str, float] = {}
+
+
+@task
+def sleep_node(workflow_data: dict, node_id: str):
+    time.sleep(node_sleep_times[node_id])
+    return workflow_data
+
+
+def make_branches(branch_count: int, depth: int, slow: float, fast: float) -> DAG:
+    """
+    每个分支是一条长度为 depth 的链，第 i 个分支的第 i % depth 个节点是慢节点。
+    Each branch is a chain of `depth` nodes; node i % depth of branch i is the slow one.
+    """
+    dag = DAG()
+    for branch in range(branch_count):
+        previous = None
+        for level in range(depth):
+            node_id = f"branch-{branch}-{level}"
+            node_sleep_times[node_id] = slow if level == branch % depth else fast
+            dag.add_node(node_id)
+            if previous is not None:
+                dag.add_edge(previous, node_id)
+            previous = node_id
+    return dag
+
+
+def topological_layers(dag: DAG) -> list[list[str]]:
+    """按入度分层，同一层的节点之间没有依赖。"""
+    in_degree = dag.get_in_degrees()
+    layer = [node for node, degree in in_degree.items() if degree == 0]
+    layers = []
+    while layer:
+        layers.append(layer)
+        next_layer = []
+        for node in layer:
+            for child in dag.get_children(node):
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    next_layer.append(child)
+        layer = next_layer
+    return layers
+
+
+def run_layered(dag: DAG, workflow_data: dict):
+    """原先的执行方式：每一层的节点并发执行，层与层之间等待。"""
+    for layer in topological_layers(dag):
+        with ThreadPoolExecutor(max_workers=len(layer)) as executor:
+            list(executor.map(lambda node_id: sleep_node(workflow_data, node_id), layer))
+
+
+def run(branch_count: int, depth: int, slow: float, fast: float):
+    dag = make_branches(branch_count, depth, slow, fast)
+    workflow_data = {"nodes": [], "edges": []}
+
+    start_time = time.perf_counter()
+    run_layered(dag, workflow_data)
+    layered_time = time.perf_counter() - start_time
+
+    node_tasks = {node_id: sleep_node.s(node_id) for node_id in dag.get_all_nodes()}
+    start_time = time.perf_counter()
+    graph(dag, node_tasks, max_workers=branch_count)(workflow_data)
+    graph_time = time.perf_counter() - start_time
+
+    critical_path = slow + fast * (depth - 1)
+    print(f"branches={branch_count} depth={depth} slow={slow}s fast={fast}s")
+    print(f"critical path: {critical_path:.3f}s")
+    print(f"layered:       {layered_time:.3f}s")
+    print(f"ready queue:   {graph_time:.3f}s")
+    print(f"speedup:       {layered_time / graph_time:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--branches", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--slow", type=float, default=0.5)
+    parser.add_argument("--fast", type=float, default=0.05)
+    args = parser.parse_args()
+    run(args.branches, args.depth, args.slow, args.fast)
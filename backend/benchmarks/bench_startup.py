@@ -0,0 +1,111 @@
+# @Author: Bi Ying
+# @Date:   2024-08-23 11:20:31
+"""
+比较任务模块按需导入与启动时全部导入的启动开销：导入 worker 的耗时和进程常驻内存。
+每次测量都在新的子进程中进行，避免模块缓存影响结果。常驻内存使用 resource 模块读取，Windows 上不可用。
+Compare the startup cost of importing task modules on demand against importing all of them up front:
+time to import worker and resident memory. Each measurement runs in a fresh subprocess so that the
+module cache does not skew the results. Resident memory is read with the resource module, which is not
+available on Windows.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+
+def get_max_rss() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def measure_in_child(mode: str):
+    baseline_rss = get_max_rss()
+    start_time = time.perf_counter()
+    import worker
+
+    import_time = time.perf_counter() - start_time
+    load_time = 0.0
+    failed = []
+    if mode == "eager":
+        # 等同于原来在 worker/__init__.py 中导入全部任务模块
+        start_time = time.perf_counter()
+        for module_name in worker.task_functions.module_names:
+            try:
+                worker.task_functions.load(module_name)
+            except Exception as e:
+                failed.append(f"{module_name}: {e!r}")
+        load_time = time.perf_counter() - start_time
+    elif mode != "lazy":
+        # 只运行某一个模块的任务时，第一次运行需要等待的导入时间
+        start_time = time.perf_counter()
+        worker.task_functions.load(mode)
+        load_time = time.perf_counter() - start_time
+
+    max_rss = get_max_rss()
+    print(
+        json.dumps(
+            {
+                "import_time": import_time,
+                "load_time": load_time,
+                "rss": max_rss - baseline_rss if max_rss is not None else None,
+                "failed": failed,
+            }
+        )
+    )
+
+
+def run_child(mode: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child", mode],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def format_result(results: list[dict]) -> str:
+    import_time = statistics.median(result["import_time"] for result in results)
+    load_time = statistics.median(result["load_time"] for result in results)
+    rss = [result["rss"] for result in results if result["rss"] is not None]
+    rss_text = f"{statistics.median(rss) / 1024 / 1024:8.1f}MB" if rss else "     n/a"
+    return (
+        f"import worker={import_time * 1000:8.1f}ms load modules={load_time * 1000:8.1f}ms "
+        f"total={(import_time + load_time) * 1000:8.1f}ms rss={rss_text}"
+    )
+
+
+def run(runs: int, first_task_module: str):
+    modes = {
+        "lazy": "lazy (no task module loaded)",
+        first_task_module: f"lazy + first task of {first_task_module}",
+        "eager": "eager (all task modules)",
+    }
+    for mode, label in modes.items():
+        results = [run_child(mode) for _ in range(runs)]
+        print(f"[{label}]")
+        print(f"  {format_result(results)}")
+        for failed in results[0]["failed"]:
+            print(f"  failed to import {failed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--first-task-module", default="text_processing")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        measure_in_child(args.child)
+    else:
+        run(args.runs, args.first_task_module)
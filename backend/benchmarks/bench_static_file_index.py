@@ -0,0 +1,93 @@
+# @Author: Bi Ying
+# @Date:   2024-08-28 11:37:20
+"""
+在有大量文件的静态目录中查找与上传文件内容相同的文件，比较原来每次计算目录中所有文件 MD5 的做法
+与持久化的内容索引：索引为空时的第一次查找、索引命中、以及目录中没有相同内容时的查找。
+最后修改一个已索引的文件，检查索引按大小和修改时间发现变化。
+Look up a file with the same content as an upload in a static directory with many files. Compares the
+old approach that hashes every file in the directory on every lookup against the persistent content
+index: the first lookup with an empty index, index hits, and lookups with no matching content.
+Finally an indexed file is modified to check that the index notices the change by size and mtime.
+
+    python -m benchmarks.bench_static_file_index --files 10000
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+from utilities.file_processing.static_file_index import StaticFileIndex, calculate_file_md5
+
+
+def legacy_find(local_file: Path, static_dir: Path, root: Path) -> str | None:
+    # 原来的 find_file_in_static_dir：逐个读取目录中的文件并计算 MD5
+    local_file_md5 = calculate_file_md5(local_file)
+    for file in static_dir.iterdir():
+        if file.is_file() and calculate_file_md5(file) == local_file_md5:
+            return file.relative_to(root).as_posix()
+    return None
+
+
+def indexed_find(index: StaticFileIndex, local_file: Path, subdir: str) -> str | None:
+    return index.find(calculate_file_md5(local_file), local_file.stat().st_size, subdir)
+
+
+def timed(func, *args) -> tuple[float, object]:
+    start_time = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start_time, result
+
+
+def run(count: int, min_size: int, max_size: int):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "static"
+        static_dir = root / "images"
+        static_dir.mkdir(parents=True)
+        for index in range(count):
+            (static_dir / f"{index}.png").write_bytes(os.urandom(rng.randint(min_size, max_size)))
+        total_size = sum(file.stat().st_size for file in static_dir.iterdir())
+        print(f"{count} files, {total_size / 1024 / 1024:.0f}MB")
+
+        uploads = Path(temp_dir) / "uploads"
+        uploads.mkdir()
+        existing = uploads / "existing.png"
+        existing.write_bytes((static_dir / f"{count // 2}.png").read_bytes())
+        missing = uploads / "missing.png"
+        missing.write_bytes(os.urandom(max_size + 1))
+
+        index = StaticFileIndex(root, Path(temp_dir) / "index")
+
+        elapsed_time, result = timed(legacy_find, existing, static_dir, root)
+        print(f"  [legacy  hit ] {elapsed_time * 1000:9.1f}ms -> {result}")
+        elapsed_time, result = timed(legacy_find, missing, static_dir, root)
+        print(f"  [legacy  miss] {elapsed_time * 1000:9.1f}ms -> {result}")
+
+        elapsed_time, result = timed(indexed_find, index, existing, "images")
+        print(f"  [index   cold] {elapsed_time * 1000:9.1f}ms -> {result}")
+        assert result == f"images/{count // 2}.png"
+        elapsed_time, result = timed(indexed_find, index, existing, "images")
+        print(f"  [index   hit ] {elapsed_time * 1000:9.1f}ms -> {result}")
+        elapsed_time, result = timed(indexed_find, index, missing, "images")
+        print(f"  [index   miss] {elapsed_time * 1000:9.1f}ms -> {result}")
+        assert result is None
+
+        # 修改已索引的文件后不应再命中
+        indexed_file = static_dir / f"{count // 2}.png"
+        indexed_file.write_bytes(os.urandom(indexed_file.stat().st_size))
+        elapsed_time, result = timed(indexed_find, index, existing, "images")
+        print(f"  [index  stale] {elapsed_time * 1000:9.1f}ms -> {result}")
+        assert result is None
+
+        index.cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--min-size", type=int, default=1024)
+    parser.add_argument("--max-size", type=int, default=64 * 1024)
+    args = parser.parse_args()
+    run(args.files, args.min_size, args.max_size)
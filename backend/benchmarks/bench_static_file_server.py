@@ -0,0 +1,154 @@
+# @Author: Bi Ying
+# @Date:   2024-08-28 15:20:06
+"""
+静态文件服务器的并发测试：一个客户端以限定的速度下载大文件，同时多个客户端请求小图片，
+比较原来的单线程服务器与多线程服务器上小图片请求的延迟。之后检查 Range、ETag 与 304，并统计大文件的吞吐。
+Concurrency test of the static file server: one client downloads a large file at a limited rate while
+several clients request small images. Compares the latency of the image requests on the old
+single-threaded server and on the threaded server, then checks Range, ETag and 304 responses and
+measures the throughput of large files.
+
+    python -m benchmarks.bench_static_file_server --images 200 --clients 8
+"""
+import os
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from functools import partial
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import httpx
+
+from utilities.file_processing.static_file_server import StaticFileRequestHandler, StaticHTTPServer
+
+
+class LegacyRequestHandler(SimpleHTTPRequestHandler):
+    # 原来的请求处理：不缓存，不支持 Range
+    def end_headers(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-store, no-cache, must-revalidate")
+        return super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietStaticFileRequestHandler(StaticFileRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(server_class, handler_class, directory: Path) -> HTTPServer:
+    server = server_class(("127.0.0.1", 0), partial(handler_class, directory=str(directory)))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def slow_download(url: str, rate: int) -> int:
+    # 以 rate 字节/秒读取响应，模拟浏览器中播放的视频
+    received = 0
+    with httpx.stream("GET", url, timeout=None) as response:
+        for chunk in response.iter_bytes(64 * 1024):
+            received += len(chunk)
+            time.sleep(len(chunk) / rate)
+    return received
+
+
+def image_latencies(base_url: str, count: int, clients: int) -> list[float]:
+    http_client = httpx.Client(timeout=None, limits=httpx.Limits(max_connections=clients))
+
+    def fetch(index: int) -> float:
+        start_time = time.perf_counter()
+        response = http_client.get(f"{base_url}/images/{index}.png")
+        response.raise_for_status()
+        return time.perf_counter() - start_time
+
+    with http_client, ThreadPoolExecutor(max_workers=clients) as executor:
+        return list(executor.map(fetch, range(count)))
+
+
+def format_latencies(latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return (
+        f"median={statistics.median(latencies) * 1000:8.1f}ms p95={p95 * 1000:8.1f}ms "
+        f"max={latencies[-1] * 1000:8.1f}ms"
+    )
+
+
+def check_protocol(base_url: str, large_file: Path):
+    size = large_file.stat().st_size
+    with open(large_file, "rb") as file:
+        file.seek(1000)
+        expected_middle = file.read(1000)
+        file.seek(size - 500)
+        expected_tail = file.read(500)
+
+    response = httpx.get(f"{base_url}/large.bin", headers={"Range": "bytes=1000-1999"})
+    assert response.status_code == 206 and response.content == expected_middle
+    assert response.headers["Content-Range"] == f"bytes 1000-1999/{size}"
+    response = httpx.get(f"{base_url}/large.bin", headers={"Range": "bytes=-500"})
+    assert response.status_code == 206 and response.content == expected_tail
+    response = httpx.get(f"{base_url}/large.bin", headers={"Range": f"bytes={size}-"})
+    assert response.status_code == 416
+
+    response = httpx.get(f"{base_url}/images/0.png")
+    etag = response.headers["ETag"]
+    response = httpx.get(f"{base_url}/images/0.png", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and not response.content
+    response = httpx.get(f"{base_url}/large.bin", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200 and len(response.content) == size
+    print(f"  Range, 416, ETag/304 and If-Range checks passed (ETag {etag})")
+
+    start_time = time.perf_counter()
+    with httpx.stream("GET", f"{base_url}/large.bin") as response:
+        received = sum(len(chunk) for chunk in response.iter_raw(1024 * 1024))
+    elapsed_time = time.perf_counter() - start_time
+    assert received == size
+    print(f"  large file throughput: {size / elapsed_time / 1024 / 1024:8.1f}MB/s")
+
+
+def run(images: int, clients: int, large_size: int, rate: int):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = Path(temp_dir)
+        (directory / "images").mkdir()
+        for index in range(images):
+            (directory / "images" / f"{index}.png").write_bytes(os.urandom(32 * 1024))
+        large_file = directory / "large.bin"
+        with open(large_file, "wb") as file:
+            for _ in range(large_size // (1024 * 1024)):
+                file.write(os.urandom(1024 * 1024))
+        print(f"{images} images of 32KB from {clients} clients while {large_size / 1024 / 1024:.0f}MB downloads")
+
+        servers = (
+            ("single-threaded", HTTPServer, LegacyRequestHandler),
+            ("threaded", StaticHTTPServer, QuietStaticFileRequestHandler),
+        )
+        for label, server_class, handler_class in servers:
+            server = start_server(server_class, handler_class, directory)
+            base_url = f"http://127.0.0.1:{server.server_address[1]}"
+            download = Thread(target=slow_download, args=(f"{base_url}/large.bin", rate), daemon=True)
+            download.start()
+            time.sleep(0.2)
+            start_time = time.perf_counter()
+            latencies = image_latencies(base_url, images, clients)
+            elapsed_time = time.perf_counter() - start_time
+            print(f"  [{label:<15}] total={elapsed_time:6.2f}s {format_latencies(latencies)}")
+            if handler_class is QuietStaticFileRequestHandler:
+                check_protocol(base_url, large_file)
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--large-size", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--rate", type=int, default=16 * 1024 * 1024)
+    args = parser.parse_args()
+    run(args.images, args.clients, args.large_size, args.rate)
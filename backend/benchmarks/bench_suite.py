@@ -0,0 +1,223 @@
+# @Author: Bi Ying
+# @Date:   2024-08-22 11:02:37
+"""
+工作流引擎基准测试。在 wide / deep / sub_workflows 三种合成工作流上测量：
+构建 Workflow 的耗时、边解析耗时、每个节点的调度开销、峰值内存，以及从入队到运行结束的延迟。
+节点任务全部替换为只 sleep 的桩函数，数据库、队列和缓存都放在临时目录中，不需要网络。
+Workflow engine benchmarks. On wide / deep / sub_workflows synthetic workflows, measure the cost of
+building a Workflow, edge resolution, per-node scheduling overhead, peak memory and enqueue-to-finish
+latency. Node tasks are stubs that only sleep; the database, queues and caches live in a temporary
+directory, so everything runs offline.
+
+    python -m benchmarks.bench_suite --size 200 --sleep 0.01 --runs 5
+    python -m benchmarks.bench_suite --skip-server  # 只测试进程内的部分 / in-process measurements only
+"""
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from copy import deepcopy
+from threading import Event, Lock
+
+from utilities.workflow import Workflow, workflow_finished_listeners
+from worker.tasks import graph
+
+from benchmarks.stubs import stub_node
+from benchmarks.workflow_generators import make_wide_workflow, make_deep_workflow, make_sub_workflow_heavy_workflow
+
+
+def build_workflow(workflow_data: dict) -> Workflow:
+    # 每次使用新的数据，避免命中正在运行的 Workflow 的复用
+    return Workflow(deepcopy(workflow_data))
+
+
+def measure_build(workflow_data: dict, repeat: int) -> float:
+    total_time = 0.0
+    for _ in range(repeat):
+        data = deepcopy(workflow_data)
+        start_time = time.perf_counter()
+        Workflow(data)
+        total_time += time.perf_counter() - start_time
+    return total_time / repeat
+
+
+def measure_edge_resolution(workflow_data: dict) -> tuple[float, int]:
+    workflow = build_workflow(workflow_data)
+    connected_fields = list(workflow.input_edge_map.keys())
+    start_time = time.perf_counter()
+    for node_id, field in connected_fields:
+        workflow.get_node_field_value(node_id, field)
+    return time.perf_counter() - start_time, len(connected_fields)
+
+
+def critical_path(workflow: Workflow) -> float:
+    finish_times: dict[str, float] = {}
+    for node_id in workflow.dag.topological_sort():
+        parents = workflow.dag.get_parents(node_id)
+        start_time = max((finish_times[parent] for parent in parents), default=0.0)
+        finish_times[node_id] = start_time + float(workflow.get_node_field_value(node_id, "sleep", 0))
+    return max(finish_times.values(), default=0.0)
+
+
+def measure_scheduling(workflow_data: dict, max_workers: int) -> tuple[float, float]:
+    """
+    返回 (总耗时, 每个节点的调度开销)。调度开销为总耗时减去关键路径上的 sleep 时间后按节点平均。
+    Returns (elapsed, per-node overhead): elapsed minus the sleep along the critical path, averaged per node.
+    """
+    workflow = build_workflow(workflow_data)
+    node_tasks = {node_id: stub_node.s(node_id) for node_id in workflow.nodes}
+    start_time = time.perf_counter()
+    graph(workflow.dag, node_tasks, max_workers=max_workers)(workflow.data, workflow=workflow)
+    elapsed_time = time.perf_counter() - start_time
+    return elapsed_time, max(elapsed_time - critical_path(workflow), 0) / len(node_tasks)
+
+
+def measure_peak_memory(workflow_data: dict, max_workers: int) -> int:
+    tracemalloc.start()
+    try:
+        workflow = build_workflow(workflow_data)
+        node_tasks = {node_id: stub_node.s(node_id) for node_id in workflow.nodes}
+        graph(workflow.dag, node_tasks, max_workers=max_workers)(workflow.data, workflow=workflow)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+class ServerBenchmark:
+    """
+    在临时目录中启动 WorkflowServer，通过 run_workflow_common 入队，统计到运行结束的延迟。
+    Run a WorkflowServer in a temporary directory, enqueue through run_workflow_common and time each run
+    until it finishes.
+    """
+
+    def __init__(self, data_path: Path, num_workers: int, num_node_workers: int):
+        from models import database, create_tables
+        from utilities.config import config
+        from worker import WorkflowServer
+        from benchmarks.stubs import install_stub_tasks
+
+        # 只修改内存中的配置，不会写回 config.json
+        config.config["data_path"] = str(data_path)
+        database.init(str(data_path / "benchmark.db"))
+        create_tables()
+        install_stub_tasks()
+
+        self.finish_times: dict[str, float] = {}
+        self.lock = Lock()
+        self.all_finished = Event()
+        self.pending: set[str] = set()
+        workflow_finished_listeners.append(self.on_workflow_finished)
+        self.server = WorkflowServer(
+            cache_dir=data_path / "cache",
+            num_workers=num_workers,
+            num_node_workers=num_node_workers,
+            num_process_workers=0,
+        )
+
+    def on_workflow_finished(self, record_id: str):
+        with self.lock:
+            self.finish_times.setdefault(record_id, time.perf_counter())
+            self.pending.discard(record_id)
+            if not self.pending:
+                self.all_finished.set()
+
+    def create_workflow(self, title: str, workflow_data: dict):
+        from models import Workflow as WorkflowModel
+
+        workflow_model = WorkflowModel.create(title=title, data=workflow_data)
+        workflow_model.data["wid"] = workflow_model.wid.hex
+        workflow_model.save()
+        return workflow_model
+
+    def enqueue(self, workflow_model, **kwargs) -> tuple[str, float]:
+        """返回 (运行记录 ID, 入队时间)，kwargs 传给 run_workflow_common。"""
+        from api.utils import run_workflow_common
+
+        with self.lock:
+            self.all_finished.clear()
+            enqueue_time = time.perf_counter()
+            record_id = run_workflow_common(deepcopy(workflow_model.data), workflow_model, **kwargs)
+            self.pending.add(record_id)
+        return record_id, enqueue_time
+
+    def wait(self, timeout: float = 600):
+        if not self.all_finished.wait(timeout):
+            raise TimeoutError(f"{len(self.pending)} runs did not finish in {timeout} seconds")
+
+    def measure(self, workflow_model, runs: int, timeout: float = 600) -> list[float]:
+        enqueue_times = dict(self.enqueue(workflow_model) for _ in range(runs))
+        self.wait(timeout)
+        return [self.finish_times[record_id] - enqueue_time for record_id, enqueue_time in enqueue_times.items()]
+
+    def __enter__(self):
+        self.server.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.stop()
+        workflow_finished_listeners.remove(self.on_workflow_finished)
+
+
+def format_latencies(latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    return (
+        f"mean={sum(latencies) / len(latencies) * 1000:9.2f}ms "
+        f"p50={latencies[len(latencies) // 2] * 1000:9.2f}ms max={latencies[-1] * 1000:9.2f}ms"
+    )
+
+
+def run(size: int, sleep: float, runs: int, num_workers: int, num_node_workers: int, skip_server: bool):
+    child_depth = 3
+    invoke_count = max(size // 50, 1)
+    batch_size = 10
+    shapes = {
+        "wide": make_wide_workflow(size, sleep),
+        "deep": make_deep_workflow(size, sleep),
+        "sub_workflows": make_sub_workflow_heavy_workflow("child", child_depth, invoke_count, batch_size),
+    }
+
+    print(f"size={size} sleep={sleep}s node_workers={num_node_workers}")
+    for name, workflow_data in shapes.items():
+        node_count = len(workflow_data["nodes"])
+        build_time = measure_build(workflow_data, repeat=20)
+        edge_time, edge_count = measure_edge_resolution(workflow_data)
+        print(f"[{name}] nodes={node_count} edges={len(workflow_data['edges'])}")
+        print(f"  build Workflow:      {build_time * 1000:9.3f}ms")
+        print(f"  edge resolution:     {edge_time / max(edge_count, 1) * 1e6:9.3f}us per connected field")
+        if name == "sub_workflows":
+            # workflow_invoke 需要数据库和 WorkflowServer，只在端到端测试中运行
+            continue
+        elapsed_time, overhead = measure_scheduling(workflow_data, num_node_workers)
+        peak = measure_peak_memory(workflow_data, num_node_workers)
+        print(f"  run (TaskGraph):     {elapsed_time * 1000:9.3f}ms")
+        print(f"  scheduling overhead: {overhead * 1e6:9.3f}us per node")
+        print(f"  peak memory:         {peak / 1024:9.1f}KB")
+
+    if skip_server:
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with ServerBenchmark(Path(temp_dir), num_workers, num_node_workers) as benchmark:
+            child_model = benchmark.create_workflow("benchmark child", make_deep_workflow(child_depth, sleep))
+            shapes["sub_workflows"] = make_sub_workflow_heavy_workflow(
+                child_model.wid.hex, child_depth, invoke_count, batch_size
+            )
+            print(f"enqueue-to-finish latency, {runs} runs, workers={num_workers}")
+            for name, workflow_data in shapes.items():
+                workflow_model = benchmark.create_workflow(f"benchmark {name}", workflow_data)
+                latencies = benchmark.measure(workflow_model, runs)
+                print(f"  [{name:<13}] {format_latencies(latencies)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=200)
+    parser.add_argument("--sleep", type=float, default=0.01)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--node-workers", type=int, default=8)
+    parser.add_argument("--skip-server", action="store_true")
+    args = parser.parse_args()
+    run(args.size, args.sleep, args.runs, args.workers, args.node_workers, args.skip_server)
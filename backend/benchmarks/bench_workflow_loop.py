@@ -0,0 +1,64 @@
+# @Author: Bi Ying
+# @Date:   2024-08-24 11:05:52
+"""
+比较 workflow_loop 在当前 worker 中直接运行循环体与每次迭代通过队列运行一次子工作流的耗时。
+循环体为只包含桩节点的链，sleep 为 0，结果基本上全部是调度开销。同时统计每种模式创建的运行记录数。
+Compare workflow_loop running its body inline in the current worker against queueing one child run per
+iteration. The body is a chain of stub nodes that do not sleep, so the time is almost all overhead.
+Also counts the run records each mode creates.
+
+    python -m benchmarks.bench_workflow_loop --iterations 100 --body-depth 2
+"""
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.bench_suite import ServerBenchmark
+from benchmarks.workflow_generators import make_deep_workflow, make_loop_workflow
+
+
+def run(iterations: int, body_depth: int, runs: int, num_workers: int):
+    from models import WorkflowRunRecord
+    from worker import task_functions
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with ServerBenchmark(Path(temp_dir), num_workers, num_node_workers=4) as benchmark:
+            # 先导入 control_flows，避免第一个模式的耗时包含导入时间
+            task_functions.load("control_flows")
+            body_model = benchmark.create_workflow("benchmark loop body", make_deep_workflow(body_depth))
+            print(f"{iterations} iterations of a {body_depth}-node body, {runs} runs")
+            for mode, inline_execution in (("inline", True), ("queued", False)):
+                loop_model = benchmark.create_workflow(
+                    f"benchmark loop {mode}",
+                    make_loop_workflow(body_model.wid.hex, body_depth, iterations, inline_execution),
+                )
+                record_count = WorkflowRunRecord.select().count()
+                start_time = time.perf_counter()
+                latencies = benchmark.measure(loop_model, runs)
+                elapsed_time = time.perf_counter() - start_time
+                body_records = WorkflowRunRecord.select().count() - record_count - runs
+
+                loop_records = (
+                    WorkflowRunRecord.select()
+                    .where(WorkflowRunRecord.workflow == loop_model)
+                    .order_by(WorkflowRunRecord.start_time.desc())
+                )
+                record = loop_records.first()
+                output = next(node for node in record.data["nodes"] if node["id"] == "loop")["data"]["template"]["output"]
+                print(
+                    f"  [{mode:<6}] per run={sum(latencies) / len(latencies) * 1000:9.1f}ms "
+                    f"per iteration={sum(latencies) / len(latencies) / iterations * 1000:7.2f}ms "
+                    f"total={elapsed_time:6.2f}s status={record.status} "
+                    f"body records per run={body_records / runs:5.1f} output={output['value']!r}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--body-depth", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    run(args.iterations, args.body_depth, args.runs, args.workers)
@@ -0,0 +1,41 @@
+# @Author: Bi Ying
+# @Date:   2024-08-12 15:40:18
+"""
+比较每个节点都重新构建 Workflow 与整次运行复用同一个 Workflow 的开销。
+Compare rebuilding the Workflow in every node against reusing one parsed Workflow per run.
+
+    python -m benchmarks.bench_workflow_reuse --nodes 100
+"""
+import time
+import argparse
+
+from utilities.workflow import Workflow
+from benchmarks.bench_edge_resolution import make_chain_workflow
+
+
+def run(node_count: int):
+    workflow_data = make_chain_workflow(node_count, 2)
+    workflow = Workflow(workflow_data)
+    node_ids = list(workflow.nodes)
+
+    start_time = time.perf_counter()
+    for _ in node_ids:
+        Workflow(workflow_data)
+    rebuild_time = time.perf_counter() - start_time
+
+    with workflow.activate():
+        start_time = time.perf_counter()
+        for _ in node_ids:
+            assert Workflow(workflow_data) is workflow
+        reuse_time = time.perf_counter() - start_time
+
+    print(f"nodes={node_count}")
+    print(f"rebuild per node: {rebuild_time:.4f}s ({rebuild_time / node_count * 1e6:.1f}us/node)")
+    print(f"reuse per node:   {reuse_time:.6f}s ({reuse_time / node_count * 1e6:.2f}us/node)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=100)
+    args = parser.parse_args()
+    run(args.nodes)
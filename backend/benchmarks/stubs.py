@@ -0,0 +1,34 @@
+# @Author: Bi Ying
+# @Date:   2024-08-22 10:41:09
+import time
+
+from utilities.workflow import Workflow
+from worker.tasks import task
+
+
+@task
+def stub_node(workflow_data: dict, node_id: str):
+    """
+    按 sleep 字段睡眠，然后把输入字段的值写到 output，代替真实的节点任务。
+    Sleep for the sleep field, then copy the input values to output. Stands in for real node tasks.
+    """
+    workflow = Workflow(workflow_data)
+    time.sleep(float(workflow.get_node_field_value(node_id, "sleep", 0)))
+    values = [
+        workflow.get_node_field_value(node_id, field)
+        for field in workflow.get_node_fields(node_id)
+        if field not in ("sleep", "output")
+    ]
+    workflow.update_node_field_value(node_id, "output", values[0] if len(values) == 1 else values)
+    return workflow.data
+
+
+def install_stub_tasks():
+    """
+    把桩任务注册到 WorkflowServer 的任务表中，对应 STUB_TASK_NAME。
+    任务表对外是只读的，这里直接写入它已加载模块的函数表。
+    """
+    from worker import task_functions
+
+    with task_functions.lock:
+        task_functions.functions["benchmark"] = {"stub_node": stub_node}
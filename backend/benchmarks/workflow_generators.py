@@ -0,0 +1,132 @@
+# @Author: Bi Ying
+# @Date:   2024-08-22 10:16:43
+"""
+生成基准测试用的工作流数据，节点全部使用 benchmarks.stubs 中的桩任务。
+Synthetic workflow data for benchmarks. Every node runs the stub task from benchmarks.stubs.
+
+- wide:  一个起点扇出到 width 个并行节点，再汇总到一个终点。One source fans out to width nodes and back into a sink.
+- deep:  depth 个节点组成的链。A chain of depth nodes.
+- sub_workflows: invoke_count 个 workflow_invoke 节点，每个以列表输入启动 batch_size 个子工作流。
+  invoke_count workflow_invoke nodes, each starting batch_size child runs from a list input.
+- loop: 一个 workflow_loop 节点，把循环体上一次的输出作为下一次的输入。
+  One workflow_loop node feeding the body's last output back as the next input.
+"""
+
+STUB_TASK_NAME = "benchmark.stub_node"
+
+
+def make_stub_node(node_id: str, sleep: float, input_fields: list[str] | None = None) -> dict:
+    template: dict = {"sleep": {"value": sleep}}
+    for field in input_fields or ["input"]:
+        template[field] = {"value": node_id}
+    template["output"] = {"value": "", "is_output": True}
+    return {
+        "id": node_id,
+        "type": "BenchmarkStub",
+        "category": "benchmark",
+        "data": {"task_name": STUB_TASK_NAME, "template": template},
+    }
+
+
+def make_edge(source: str, target: str, target_handle: str = "input") -> dict:
+    return {
+        "id": f"edge-{source}-{target}-{target_handle}",
+        "source": source,
+        "sourceHandle": "output",
+        "target": target,
+        "targetHandle": target_handle,
+    }
+
+
+def make_wide_workflow(width: int, sleep: float = 0.0) -> dict:
+    sink_fields = [f"input_{index}" for index in range(width)]
+    nodes = [make_stub_node("source", sleep), make_stub_node("sink", sleep, sink_fields)]
+    edges = []
+    for index in range(width):
+        node_id = f"node-{index}"
+        nodes.append(make_stub_node(node_id, sleep))
+        edges.append(make_edge("source", node_id))
+        edges.append(make_edge(node_id, "sink", f"input_{index}"))
+    return {"wid": "benchmark-wide", "rid": "benchmark-wide", "nodes": nodes, "edges": edges}
+
+
+def make_deep_workflow(depth: int, sleep: float = 0.0) -> dict:
+    nodes = []
+    edges = []
+    for index in range(depth):
+        nodes.append(make_stub_node(f"node-{index}", sleep))
+        if index > 0:
+            edges.append(make_edge(f"node-{index - 1}", f"node-{index}"))
+    return {"wid": "benchmark-deep", "rid": "benchmark-deep", "nodes": nodes, "edges": edges}
+
+
+def make_sub_workflow_heavy_workflow(
+    child_workflow_id: str,
+    child_depth: int,
+    invoke_count: int,
+    batch_size: int,
+    max_concurrency: int | None = None,
+) -> dict:
+    """
+    子工作流为 make_deep_workflow(child_depth) 生成的链，列表中的每一项作为第一个节点的输入。
+    max_concurrency 为空时使用配置中的 workflow.invoke_concurrency。
+    The child workflow is a make_deep_workflow(child_depth) chain; each list item feeds its first node.
+    max_concurrency falls back to workflow.invoke_concurrency from the config when not given.
+    """
+    sink_fields = [f"input_{index}" for index in range(invoke_count)]
+    nodes = [make_stub_node("sink", 0.0, sink_fields)]
+    edges = []
+    for index in range(invoke_count):
+        node_id = f"invoke-{index}"
+        template = {
+            "workflow_id": {"value": child_workflow_id},
+            "list_input": {"value": True},
+            "input": {"value": [f"{node_id}-{item}" for item in range(batch_size)], "nodeId": "node-0"},
+            "output": {
+                "value": "",
+                "is_output": True,
+                "node": f"node-{child_depth - 1}",
+                "output_field_key": "output",
+            },
+        }
+        if max_concurrency is not None:
+            template["max_concurrency"] = {"value": max_concurrency}
+        nodes.append(
+            {
+                "id": node_id,
+                "type": "WorkflowInvoke",
+                "category": "tools",
+                "data": {"task_name": "tools.workflow_invoke", "template": template},
+            }
+        )
+        edges.append(make_edge(node_id, "sink", f"input_{index}"))
+    return {"wid": "benchmark-sub-workflows", "rid": "benchmark-sub-workflows", "nodes": nodes, "edges": edges}
+
+
+def make_loop_workflow(body_workflow_id: str, body_depth: int, loop_count: int, inline_execution: bool) -> dict:
+    """
+    循环体为 make_deep_workflow(body_depth) 生成的链，固定循环 loop_count 次。
+    The loop body is a make_deep_workflow(body_depth) chain, run exactly loop_count times.
+    """
+    template = {
+        "workflow_id": {"value": body_workflow_id},
+        "max_loop_count": {"value": loop_count},
+        "assignment_in_loop": {"value": {"input": {"source": "output_field", "value": "output"}}},
+        "loop_end_condition": {"value": "loop_count"},
+        "output_field_condition_field": {"value": ""},
+        "output_field_condition_operator": {"value": "equal"},
+        "output_field_condition_value": {"value": ""},
+        "judgement_model": {"value": "OpenAI⋄gpt-4o-mini"},
+        "judgement_prompt": {"value": ""},
+        "judgement_end_output": {"value": ""},
+        "inline_execution": {"value": inline_execution},
+        "input": {"value": "loop", "nodeId": "node-0"},
+        "output": {"value": "", "is_output": True, "node": f"node-{body_depth - 1}", "output_field_key": "output"},
+    }
+    node = {
+        "id": "loop",
+        "type": "WorkflowLoop",
+        "category": "controlFlows",
+        "data": {"task_name": "control_flows.workflow_loop", "template": template},
+    }
+    return {"wid": "benchmark-loop", "rid": "benchmark-loop", "nodes": [node], "edges": []}
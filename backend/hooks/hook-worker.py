@@ -0,0 +1,4 @@
+from PyInstaller.utils.hooks import collect_submodules
+
+# 任务模块由 worker.tasks.registry 按需导入，静态分析找不到，需要显式收集
+hiddenimports = collect_submodules("worker.tasks")
@@ -5,6 +5,7 @@
 # @Last Modified time: 2024-07-10 00:49:51
 import os
 import time
+import multiprocessing
 from pathlib import Path
 
 import webview
@@ -224,5 +225,7 @@ class MainServer:
 
 
 if __name__ == "__main__":
+    # 打包后的程序需要在启动时调用，否则进程池的子进程会重新启动整个程序
+    multiprocessing.freeze_support()
     main_server = MainServer()
     main_server.start()
@@ -106,6 +106,8 @@ class WorkflowRunRecord(BaseModel):
 
     run_from = CharField(max_length=16, choices=RunFromTypes.__dict__.items(), default=RunFromTypes.WEB)
     source_message = UUIDField(null=True)
+    # 运行过程中记录的各阶段耗时（排队、重试、节点执行、模型请求等），用于时间线展示
+    trace = JSONField(default=list)
 
     def __str__(self):
         return self.rid.hex
@@ -0,0 +1,108 @@
+# @Author: Bi Ying
+# @Date:   2024-08-26 16:05:41
+"""
+用注入延迟的本地假服务器测试 map_list。
+Tests for map_list against a local fake server that injects latency.
+
+    python -m pytest tests/test_list_mapping.py
+"""
+import time
+import unittest
+from threading import Thread, current_thread
+
+import httpx
+
+from benchmarks.bench_list_mapping import LatencyServer
+from utilities.general.list_mapping import map_list, set_provider_limits
+
+
+class MapListTest(unittest.TestCase):
+    latency = 0.1
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LatencyServer(cls.latency)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.http_client = httpx.Client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.http_client.close()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.reset()
+
+    def fetch(self, url: str) -> str:
+        response = self.http_client.get(url)
+        response.raise_for_status()
+        return response.text
+
+    def urls(self, count: int) -> list[str]:
+        return [f"{self.server.base_url}/item/{index}" for index in range(count)]
+
+    def test_results_keep_input_order(self):
+        set_provider_limits("test-order", 4)
+        results = map_list(self.fetch, self.urls(8), provider="test-order")
+        self.assertEqual(results, [str(index) for index in range(8)])
+
+    def test_concurrency_limit(self):
+        set_provider_limits("test-concurrency", 3)
+        start_time = time.monotonic()
+        map_list(self.fetch, self.urls(9), provider="test-concurrency")
+        elapsed_time = time.monotonic() - start_time
+        self.assertLessEqual(self.server.peak_in_flight, 3)
+        self.assertGreater(self.server.peak_in_flight, 1)
+        # 9 项、每次 3 个并发，至少需要 3 轮
+        self.assertGreaterEqual(elapsed_time, self.latency * 3 * 0.9)
+
+    def test_limit_is_shared_between_calls(self):
+        set_provider_limits("test-shared", 2)
+        threads = [
+            Thread(target=map_list, args=(self.fetch, self.urls(4)), kwargs={"provider": "test-shared"})
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(self.server.peak_in_flight, 2)
+
+    def test_interval_between_requests(self):
+        interval = self.latency / 2
+        set_provider_limits("test-interval", 8, interval)
+        map_list(self.fetch, self.urls(5), provider="test-interval")
+        start_times = sorted(self.server.start_times)
+        gaps = [later - earlier for earlier, later in zip(start_times, start_times[1:])]
+        self.assertGreaterEqual(min(gaps), interval * 0.9)
+
+    def test_ignore_replaces_failed_items(self):
+        set_provider_limits("test-ignore", 4)
+        urls = self.urls(5)
+        urls[2] += "?fail=1"
+        results = map_list(self.fetch, urls, provider="test-ignore", errors="ignore", default="")
+        self.assertEqual(results, ["0", "1", "", "3", "4"])
+
+    def test_raise_after_all_items_finish(self):
+        set_provider_limits("test-raise", 4)
+        urls = self.urls(5)
+        urls[1] += "?fail=1"
+        with self.assertRaises(httpx.HTTPStatusError):
+            map_list(self.fetch, urls, provider="test-raise")
+        # 失败的项不会取消其他项
+        self.assertEqual(len(self.server.start_times), len(urls))
+
+    def test_single_item_runs_in_calling_thread(self):
+        thread_names = []
+
+        def record_thread(item):
+            thread_names.append(current_thread().name)
+            return item
+
+        self.assertEqual(map_list(record_thread, [1]), [1])
+        self.assertEqual(thread_names, [current_thread().name])
+
+
+if __name__ == "__main__":
+    unittest.main()
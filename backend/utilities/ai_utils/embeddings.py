@@ -3,11 +3,35 @@
 # @Date:   2023-05-16 18:15:11
 # @Last Modified by:   Bi Ying
 # @Last Modified time: 2024-06-24 15:32:02
-from utilities.config import Settings
+from functools import cached_property
+from typing import Callable, Iterator
+
+import httpx
+from vectorvein.chat_clients.utils import get_gpt_35_encoding
+
+from utilities.config import Settings, config
 from utilities.network import new_httpx_client
 from .client import get_openai_client_and_model_id
 
 
+def get_token_counter(provider: str) -> Callable[[str], int]:
+    """
+    返回估算单条文本 token 数的函数。OpenAI 的 embedding 模型使用 cl100k_base 编码；
+    text-embeddings-inference 的模型分词器未知，按字符数估算，对常见分词器不会低估。
+    Return a function estimating the token count of a text. OpenAI embedding models use the cl100k_base
+    encoding; the tokenizer of a text-embeddings-inference model is unknown, so characters are counted,
+    which does not underestimate common tokenizers.
+    """
+    if provider == "openai":
+        try:
+            encoding = get_gpt_35_encoding()
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception:
+            # 离线且没有编码文件缓存时退回字符数
+            pass
+    return len
+
+
 class EmbeddingClient:
     def __init__(self, provider: str, model_id: str, dimensions: int | None = None) -> None:
         self.provider = provider
@@ -24,6 +48,27 @@ class EmbeddingClient:
             )
             self.api_key = setting.get("embedding_models.text_embeddings_inference.api_key")
 
+        batching = config.get(f"embedding_batching.{provider}", {})
+        self.max_batch_size = batching.get("max_batch_size", 32)
+        self.max_batch_tokens = batching.get("max_batch_tokens", 16384)
+
+    @cached_property
+    def http_client(self) -> httpx.Client:
+        # 复用同一个连接池，多线程共用也是安全的
+        return new_httpx_client(is_async=False)
+
+    def close(self):
+        # 只有用过 text-embeddings-inference 时才创建了连接池
+        http_client = self.__dict__.pop("http_client", None)
+        if http_client is not None:
+            http_client.close()
+
+    def __enter__(self) -> "EmbeddingClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
     def get(self, input: str | list) -> list:
         if self.provider == "openai":
             if self.dimensions and self.model_id != "text-embedding-ada-002":
@@ -39,9 +84,8 @@ class EmbeddingClient:
                 headers = {"Authorization": f"Bearer {self.api_key}"}
             else:
                 headers = None
-            response = new_httpx_client(is_async=False).post(
-                self.api_base, headers=headers, json={"inputs": input}, timeout=60 * 60
-            )
+            response = self.http_client.post(self.api_base, headers=headers, json={"inputs": input}, timeout=60 * 60)
+            response.raise_for_status()
             result = response.json()
             if isinstance(input, str):
                 return result[0]
@@ -49,3 +93,24 @@ class EmbeddingClient:
                 return result
         else:
             raise ValueError(f"Invalid provider: {self.provider}")
+
+    def split_batches(self, texts: list[str]) -> Iterator[tuple[int, list[str]]]:
+        """
+        按顺序把文本分成若干批，每批的文本数不超过 max_batch_size、估算的 token 总数不超过 max_batch_tokens，
+        返回 (第一条文本的下标, 文本列表)。单条文本超过 token 上限时单独成批。
+        Split texts in order into batches of at most max_batch_size texts and max_batch_tokens estimated
+        tokens, yielding (index of the first text, texts). A single text over the token limit is sent alone.
+        """
+        count_tokens = get_token_counter(self.provider)
+        start = 0
+        batch: list[str] = []
+        batch_tokens = 0
+        for index, text in enumerate(texts):
+            tokens = count_tokens(text)
+            if batch and (len(batch) >= self.max_batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield start, batch
+                start, batch, batch_tokens = index, [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield start, batch
@@ -14,6 +14,40 @@ DEFAULT_CONFIG = {
     "data_path": "./data",
     "window": {"width": 1600, "height": 1000, "x": 0, "y": 0, "fullscreen": False, "on_top": False},
     "theme": "default",
+    # num_process_workers 为 null 时使用 CPU 核数，为 0 时不使用进程池
+    # node_result_cache_size_limit 为节点结果缓存占用磁盘的上限（字节），超出后淘汰最久未使用的结果
+    # warm_up_task_modules 为 true 时启动后在后台导入全部任务模块，否则在第一次用到时才导入
+    # invoke_concurrency 为 workflow_invoke 同时排队或运行的子工作流数量上限
+    "workflow": {
+        "num_workers": 2,
+        "num_node_workers": 8,
+        "num_process_workers": None,
+        "node_result_cache_size_limit": 256 * 1024 * 1024,
+        "warm_up_task_modules": False,
+        "invoke_concurrency": 8,
+    },
+    # 节点对列表输入逐项调用外部服务时，每个服务商同时进行的请求数和相邻请求的最小间隔（秒），未列出的使用 default
+    # concurrency 为 null 时使用 CPU 核数，用于本地的 CPU 密集型处理
+    "list_mapping": {
+        "providers": {
+            "default": {"concurrency": 4, "interval": 0},
+            "gemini": {"concurrency": 1, "interval": 5},
+            "local": {"concurrency": 1, "interval": 0},
+            "bilibili": {"concurrency": 2, "interval": 0.5},
+            "youtube": {"concurrency": 2, "interval": 0},
+            "stable-diffusion:self-host": {"concurrency": 1, "interval": 0},
+            "image_processing": {"concurrency": None, "interval": 0},
+        }
+    },
+    # 向量数据库导入时每次 embedding 请求的文本数和 token 数上限，text-embeddings-inference 的默认值与其服务端默认配置一致
+    "embedding_batching": {
+        "openai": {"max_batch_size": 2048, "max_batch_tokens": 100000},
+        "text-embeddings-inference": {"max_batch_size": 32, "max_batch_tokens": 16384},
+    },
+    # temperature 为 0 或节点开启 cache_response 时缓存大模型回复，ttl 单位为秒，size_limit 单位为字节
+    "llm_response_cache": {"ttl": 60 * 60 * 24 * 7, "size_limit": 512 * 1024 * 1024},
+    # encoded_cache_size_limit 为按尺寸上限编码后的图片缓存占用磁盘的上限（字节）
+    "image_processing": {"encoded_cache_size_limit": 256 * 1024 * 1024},
 }
 
 
@@ -0,0 +1,114 @@
+# @Author: Bi Ying
+# @Date:   2024-08-28 10:12:45
+import os
+import hashlib
+from pathlib import Path
+from functools import cached_property
+
+from diskcache import Cache
+
+from utilities.config import config
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def calculate_file_md5(file_path: str | Path) -> str:
+    """
+    按块读取文件计算 MD5，内存占用与文件大小无关。
+    MD5 of a file read in chunks, so memory use does not grow with the file size.
+    """
+    hasher = hashlib.md5()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class StaticFileIndex:
+    """
+    静态文件目录的内容索引，持久化保存在磁盘上：
+    每个文件记录 (大小, 修改时间, MD5)，同时记录 (子目录, MD5) -> 文件路径。
+    记录只在使用时按大小和修改时间检查，文件变化后重新计算哈希。查找时只需要计算与目标大小相同的文件的哈希。
+    Persistent content index of the static file directory. Each file is recorded as (size, mtime, MD5),
+    along with (subdir, MD5) -> file path. Records are only checked against the size and mtime when they
+    are used, and the hash is recomputed if the file changed. A lookup only hashes files whose size
+    matches the target.
+    """
+
+    def __init__(self, root: str | Path, directory: str | Path | None = None):
+        self.root = Path(root)
+        self.directory = Path(directory) if directory else Path(config.data_path) / "cache" / "static_file_index"
+
+    @cached_property
+    def cache(self) -> Cache:
+        # 第一次使用时才打开，导入本模块的子进程不会打开数据库
+        return Cache(directory=self.directory)
+
+    def relative_path(self, file_path: str | Path) -> str:
+        return Path(file_path).relative_to(self.root).as_posix()
+
+    def get_md5(self, file_path: str | Path, stat: os.stat_result | None = None) -> str:
+        """
+        返回文件的 MD5，大小和修改时间与记录一致时直接使用记录的值。
+        Return the MD5 of a file, using the recorded value when the size and mtime still match.
+        """
+        relative_path = self.relative_path(file_path)
+        stat = stat or os.stat(file_path)
+        record = self.cache.get(("file", relative_path))
+        if record is not None and record[0] == stat.st_size and record[1] == stat.st_mtime_ns:
+            return record[2]
+        return self.record(file_path, stat=stat)
+
+    def record(self, file_path: str | Path, md5: str | None = None, stat: os.stat_result | None = None) -> str:
+        """
+        写入文件后记录它的哈希，md5 为空时按块读取计算。
+        Record the hash of a file after it is written; it is computed in chunks when md5 is not given.
+        """
+        relative_path = self.relative_path(file_path)
+        stat = stat or os.stat(file_path)
+        md5 = md5 or calculate_file_md5(file_path)
+        subdir = Path(relative_path).parent.as_posix()
+        self.cache.set(("file", relative_path), (stat.st_size, stat.st_mtime_ns, md5))
+        self.cache.set(("md5", subdir, md5), relative_path)
+        return md5
+
+    def is_current(self, relative_path: str) -> bool:
+        record = self.cache.get(("file", relative_path))
+        if record is None:
+            return False
+        try:
+            stat = os.stat(self.root / relative_path)
+        except OSError:
+            return False
+        return record[0] == stat.st_size and record[1] == stat.st_mtime_ns
+
+    def find(self, md5: str, size: int, subdir: str | Path) -> str | None:
+        """
+        在 subdir 中查找内容为 md5 的文件，返回相对于根目录的路径。
+        先查索引；索引中没有或已经失效时扫描目录，只对大小相同的文件计算（或复用）哈希。
+        Find a file in subdir whose content hashes to md5 and return its path relative to the root.
+        The index is checked first; when it has no current entry the directory is scanned and only files
+        of the same size are hashed (or their recorded hash reused).
+        """
+        subdir = Path(subdir).as_posix()
+        relative_path = self.cache.get(("md5", subdir, md5))
+        if relative_path is not None and self.is_current(relative_path):
+            return relative_path
+
+        directory = self.root / subdir
+        if not directory.is_dir():
+            return None
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # 跳过隐藏文件，包括下载中的临时文件
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if stat.st_size != size:
+                    continue
+                if self.get_md5(entry.path, stat=stat) == md5:
+                    relative_path = self.relative_path(entry.path)
+                    self.cache.set(("md5", subdir, md5), relative_path)
+                    return relative_path
+        return None
@@ -3,45 +3,175 @@
 # @Date:   2023-05-17 20:17:51
 # @Last Modified by:   Bi Ying
 # @Last Modified time: 2024-08-07 19:32:57
+import os
 import uuid
 import shutil
 import hashlib
+import tempfile
 import threading
 from pathlib import Path
-from urllib.parse import unquote, urlparse
-from http.server import SimpleHTTPRequestHandler, HTTPServer
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import urlparse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 from utilities.config import config
 from utilities.general import mprint_with_name
 from utilities.network import new_httpx_client
+from utilities.file_processing.static_file_index import HASH_CHUNK_SIZE, StaticFileIndex, calculate_file_md5
 
 
 mprint = mprint_with_name(name="Static File Server")
 
 
+def parse_byte_range(value: str, size: int) -> tuple[int, int] | None:
+    """
+    解析单个 Range 请求头，返回闭区间 (start, end)。格式不支持（包括多个范围）时返回 None，按完整文件响应；
+    范围不可满足时 start >= size。
+    Parse a single Range header into an inclusive (start, end). Returns None for unsupported values,
+    including multiple ranges, so that the whole file is sent; start >= size when it is unsatisfiable.
+    """
+    unit, _, byte_range = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in byte_range:
+        return None
+    start_text, separator, end_text = byte_range.strip().partition("-")
+    if not separator:
+        return None
+    try:
+        if not start_text:
+            # bytes=-N 表示最后 N 个字节
+            suffix_length = int(end_text)
+            if suffix_length <= 0:
+                return size, size
+            return max(size - suffix_length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return size, size
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match 使用弱比较，忽略 W/ 前缀
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+class StaticFileRequestHandler(SimpleHTTPRequestHandler):
+    """
+    在 SimpleHTTPRequestHandler 的基础上支持单个 Range 请求、强 ETag 与 304 协商缓存，
+    较大的响应体用 socket.sendfile 发送，系统支持时为零拷贝的 os.sendfile。
+    Adds single Range requests, strong ETags with 304 revalidation to SimpleHTTPRequestHandler, and sends
+    larger bodies with socket.sendfile, which is a zero-copy os.sendfile where the platform supports it.
+    """
+
+    sendfile_threshold = 64 * 1024
+
+    def end_headers(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET")
+        # 浏览器可以缓存，但每次使用前用 ETag 验证
+        self.send_header("Cache-Control", "no-cache")
+        return super().end_headers()
+
+    def send_head(self):
+        self.body_range = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or path.endswith("/"):
+            return super().send_head()
+        try:
+            file = open(path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        try:
+            stat = os.fstat(file.fileno())
+            # 文件只会整体写入或替换，大小和修改时间（纳秒）确定内容
+            etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+            if etag_matches(self.headers.get("If-None-Match"), etag):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                file.close()
+                return None
+
+            start, end = 0, stat.st_size - 1
+            status = HTTPStatus.OK
+            if_range = self.headers.get("If-Range")
+            byte_range = self.headers.get("Range")
+            if byte_range and (if_range is None or if_range.strip() == etag):
+                parsed_range = parse_byte_range(byte_range, stat.st_size)
+                if parsed_range is not None:
+                    start, end = parsed_range
+                    if start >= stat.st_size:
+                        self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                        self.send_header("Content-Range", f"bytes */{stat.st_size}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        file.close()
+                        return None
+                    status = HTTPStatus.PARTIAL_CONTENT
+
+            self.send_response(status)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+            self.send_header("ETag", etag)
+            self.send_header("Accept-Ranges", "bytes")
+            if status == HTTPStatus.PARTIAL_CONTENT:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{stat.st_size}")
+            self.end_headers()
+            self.body_range = (start, end - start + 1)
+            return file
+        except Exception:
+            file.close()
+            raise
+
+    def copyfile(self, source, outputfile):
+        if self.body_range is None:
+            return super().copyfile(source, outputfile)
+        offset, count = self.body_range
+        if count >= self.sendfile_threshold:
+            self.connection.sendfile(source, offset, count)
+            return
+        source.seek(offset)
+        outputfile.write(source.read(count))
+
+
+class StaticHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有 5，页面同时请求多张图片时多余的连接会等待 1 秒后重试
+    # The default listen backlog is 5; with many images requested at once the extra connections
+    # would wait a second for the SYN to be retried
+    request_queue_size = 128
+
+
 class StaticFileServer:
     host = "localhost"
     port = 13286
 
     def __init__(self, static_folder_path: str | Path):
-        class MyRequestHandler(SimpleHTTPRequestHandler):
-            def end_headers(self):
-                self.send_header("Access-Control-Allow-Origin", "*")
-                self.send_header("Access-Control-Allow-Methods", "GET")
-                self.send_header("Cache-Control", "no-store, no-cache, must-revalidate")
-                return super(MyRequestHandler, self).end_headers()
-
-            def translate_path(self, path):
-                path = unquote(path.split("?", 1)[0].split("#", 1)[0])
-                file_path = str(Path(static_folder_path, path.strip("/")))
-                return file_path
-
-            def do_GET(self):
-                self.path = unquote(self.path)
-                super().do_GET()
-
         self.static_folder_path = Path(static_folder_path)
-        self.static_file_server = HTTPServer((StaticFileServer.host, StaticFileServer.port), MyRequestHandler)
+        # 静态目录的内容索引，用于查找内容相同的文件
+        self.file_index = StaticFileIndex(self.static_folder_path)
+        # 在 start 时才绑定端口，这样进程池的子进程导入本模块时不会占用端口
+        # Bind on start so that process pool workers importing this module do not grab the port
+        # 每个请求一个线程，下载大文件时不会阻塞其他请求
+        # One thread per request so that a large download does not block other requests
+        self.static_file_server = StaticHTTPServer(
+            (StaticFileServer.host, StaticFileServer.port),
+            partial(StaticFileRequestHandler, directory=str(self.static_folder_path)),
+            bind_and_activate=False,
+        )
+        self.static_file_server_bound = False
         self.static_file_server_thread = None
 
     @staticmethod
@@ -50,6 +180,14 @@ class StaticFileServer:
 
     def start(self, block: bool = False):
         mprint(f"Starting at http://{StaticFileServer.host}:{StaticFileServer.port}")
+        if not self.static_file_server_bound:
+            try:
+                self.static_file_server.server_bind()
+                self.static_file_server.server_activate()
+            except Exception:
+                self.static_file_server.server_close()
+                raise
+            self.static_file_server_bound = True
         if block:
             self.static_file_server.serve_forever()
         else:
@@ -78,59 +216,66 @@ class StaticFileServer:
             return dst
         return None
 
-    @staticmethod
-    def copy_online_file(file_url: str, folder: str | Path):
-        response = new_httpx_client(is_async=False).get(file_url, timeout=30)
-        if response.status_code == 200:
-            file_type = response.headers.get("Content-Type", "").split("/")[-1]
-            file_name = urlparse(file_url).path.split("/")[-1]
-            if len(file_name) == 0:
-                file_name = uuid.uuid4().hex
-            if isinstance(folder, str):
-                folder = Path(folder)
-            original_file = dst = folder / file_name
-            if dst.exists():
-                dst = dst.with_name(f"{uuid.uuid4().hex}_{dst.name}")
-            else:
-                dst = dst.with_suffix(f".{file_type}")
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            with open(dst, "wb") as f:
-                f.write(response.content)
-
-            if all(
-                (
-                    original_file.exists(),
-                    StaticFileServer.calculate_md5(original_file) == StaticFileServer.calculate_md5(dst),
-                    original_file.absolute() != dst.absolute(),
-                )
-            ):
-                dst.unlink()
-                return original_file
-            return dst
+    def copy_online_file(self, file_url: str, folder: str | Path):
+        """
+        流式下载文件到 folder：数据按块写入同目录下的临时文件并同时计算 MD5，内存占用与文件大小无关。
+        folder 中已经有相同内容的文件（按内容索引查找）时删除临时文件并返回已有文件，否则原子地重命名到目标路径。
+        Stream a file into folder: chunks are written to a temporary file in the same directory and hashed
+        as they arrive, so memory use does not depend on the file size. If folder already holds a file with
+        the same content (looked up in the content index) the temporary file is removed and the existing
+        file returned; otherwise it is atomically renamed into place.
+        """
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        with new_httpx_client(is_async=False).stream("GET", file_url, timeout=30) as response:
+            if response.status_code != 200:
+                return None
+            content_type = response.headers.get("Content-Type", "").split(";")[0]
+            file_type = content_type.split("/")[-1].strip()
+            hasher = hashlib.md5()
+            with tempfile.NamedTemporaryFile(dir=folder, prefix=".download_", delete=False) as temp_file:
+                try:
+                    for chunk in response.iter_bytes(HASH_CHUNK_SIZE):
+                        hasher.update(chunk)
+                        temp_file.write(chunk)
+                except BaseException:
+                    temp_file.close()
+                    os.unlink(temp_file.name)
+                    raise
+        temp_path = Path(temp_file.name)
+        md5 = hasher.hexdigest()
+
+        indexed = folder.is_relative_to(self.static_folder_path)
+        if indexed:
+            found_file = self.file_index.find(md5, temp_path.stat().st_size, self.file_index.relative_path(folder))
+            if found_file is not None:
+                temp_path.unlink()
+                return self.static_folder_path / found_file
+
+        file_name = urlparse(file_url).path.split("/")[-1]
+        if len(file_name) == 0:
+            file_name = uuid.uuid4().hex
+        dst = folder / file_name
+        if dst.exists():
+            dst = dst.with_name(f"{uuid.uuid4().hex}_{dst.name}")
+        elif file_type:
+            dst = dst.with_suffix(f".{file_type}")
+        os.replace(temp_path, dst)
+        if indexed:
+            self.file_index.record(dst, md5=md5)
+        return dst
 
     @staticmethod
     def calculate_md5(file_path: str | Path):
         if not Path(file_path).exists():
             return None
-        hasher = hashlib.md5()
-        with open(file_path, "rb") as f:
-            buf = f.read()
-            hasher.update(buf)
-        return hasher.hexdigest()
+        return calculate_file_md5(file_path)
 
     def find_file_in_static_dir(self, local_file_path, static_subdir):
         local_file_md5 = self.calculate_md5(local_file_path)
-        static_dir_path: Path = self.static_folder_path / static_subdir
-
-        if not static_dir_path.exists():
+        if local_file_md5 is None:
             return None
-
-        for file in static_dir_path.iterdir():
-            if file.is_file():
-                if self.calculate_md5(file) == local_file_md5:
-                    return file.relative_to(self.static_folder_path).as_posix()
-
-        return None
+        return self.file_index.find(local_file_md5, Path(local_file_path).stat().st_size, static_subdir)
 
     def get_static_file_url(self, file: str | Path, static_subdir: str | Path):
         """
@@ -155,8 +300,9 @@ class StaticFileServer:
         if found_file:
             return self.get_file_url(found_file)
         else:
-            dst_path = self.static_folder_path / static_subdir / Path(file).name
-            if self.copy_file(file, dst_path):
+            dst_path = self.copy_file(file, self.static_folder_path / static_subdir / Path(file).name)
+            if dst_path:
+                self.file_index.record(dst_path)
                 return self.get_file_url(dst_path.relative_to(self.static_folder_path).as_posix())
             else:
                 return None
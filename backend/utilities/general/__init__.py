@@ -3,6 +3,8 @@
 from .print_utils import LogServer, mprint_with_name, mprint
 from .ratelimit import add_request_record, clear_expired_records, is_request_allowed
 from .retry import Retry
+from .task_queue import TaskQueue, DelayedTaskQueue
+from .list_mapping import map_list
 
 
 def align_elements(input_data):
@@ -52,8 +54,11 @@ __all__ = [
     "Retry",
     "mprint",
     "LogServer",
+    "TaskQueue",
+    "map_list",
     "align_elements",
     "mprint_with_name",
+    "DelayedTaskQueue",
     "add_request_record",
     "is_request_allowed",
     "clear_expired_records",
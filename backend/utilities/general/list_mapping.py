@@ -0,0 +1,118 @@
+# @Author: Bi Ying
+# @Date:   2024-08-26 10:08:44
+import os
+import time
+from threading import Lock, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, TypeVar
+
+from utilities.config import config
+from utilities.general.print_utils import mprint_with_name
+
+
+mprint = mprint_with_name(name="List Mapping")
+
+ItemType = TypeVar("ItemType")
+ResultType = TypeVar("ResultType")
+
+
+class ProviderLimiter:
+    """
+    同一服务商的请求在整个进程内共享的限制：最多 concurrency 个同时进行，相邻两次请求开始至少间隔 interval 秒。
+    A process wide limit shared by all requests to one provider: at most concurrency at a time and at least
+    interval seconds between the starts of two requests.
+    """
+
+    def __init__(self, concurrency: int, interval: float = 0):
+        self.concurrency = max(int(concurrency), 1)
+        self.interval = float(interval)
+        self.semaphore = BoundedSemaphore(self.concurrency)
+        self.lock = Lock()
+        self.next_start_time = 0.0
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        if self.interval > 0:
+            with self.lock:
+                start_time = max(time.monotonic(), self.next_start_time)
+                self.next_start_time = start_time + self.interval
+            time.sleep(max(start_time - time.monotonic(), 0))
+        return self
+
+    def __exit__(self, *args):
+        self.semaphore.release()
+
+
+_limiters: dict[str, ProviderLimiter] = {}
+_limiters_lock = Lock()
+
+
+def get_provider_limiter(provider: str) -> ProviderLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            providers: dict = config.get("list_mapping.providers", {})
+            limits = {"concurrency": 4, "interval": 0, **providers.get("default", {}), **providers.get(provider, {})}
+            concurrency = limits["concurrency"]
+            if concurrency is None:
+                concurrency = os.cpu_count() or 1
+            limiter = _limiters[provider] = ProviderLimiter(concurrency, limits["interval"])
+        return limiter
+
+
+def set_provider_limits(provider: str, concurrency: int, interval: float = 0):
+    """
+    在运行时替换某个服务商的限制，之后开始的 map_list 调用使用新的限制。
+    Replace the limits of a provider at runtime; map_list calls started afterwards use the new limits.
+    """
+    with _limiters_lock:
+        _limiters[provider] = ProviderLimiter(concurrency, interval)
+
+
+def map_list(
+    func: Callable[[ItemType], ResultType],
+    items: Iterable[ItemType],
+    provider: str = "default",
+    errors: str = "raise",
+    default: Any = None,
+) -> list[ResultType]:
+    """
+    并发地对列表中的每一项调用 func，结果与输入顺序一致。并发数和请求间隔由服务商的限制决定，
+    见配置 list_mapping.providers。只有一项时直接在当前线程中执行。
+
+    errors 为 "raise" 时所有项结束后抛出第一个失败项的异常；为 "ignore" 时失败项记录日志并以 default 代替。
+
+    Call func on every item concurrently and return the results in input order. Concurrency and the
+    interval between requests come from the provider's limits, see the list_mapping.providers config.
+    A single item runs directly in the calling thread.
+
+    With errors="raise" the exception of the first failed item is raised once all items have finished;
+    with errors="ignore" failed items are logged and replaced by default.
+    """
+    items = list(items)
+    limiter = get_provider_limiter(provider)
+
+    def call(item: ItemType) -> tuple[bool, Any]:
+        try:
+            with limiter:
+                return True, func(item)
+        except Exception as e:
+            return False, e
+
+    if len(items) <= 1:
+        outcomes = [call(item) for item in items]
+    else:
+        max_workers = min(limiter.concurrency, len(items))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"map-{provider}") as executor:
+            outcomes = list(executor.map(call, items))
+
+    results = []
+    for index, (succeeded, value) in enumerate(outcomes):
+        if succeeded:
+            results.append(value)
+        elif errors == "raise":
+            raise value
+        else:
+            mprint.error(f"{provider} item {index + 1}/{len(items)} failed: {value}")
+            results.append(default)
+    return results
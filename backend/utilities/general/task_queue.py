@@ -0,0 +1,253 @@
+# @Author: Bi Ying
+# @Date:   2024-08-14 10:12:33
+import time
+import uuid
+import heapq
+from pathlib import Path
+from collections import deque
+from typing import Any
+from threading import Condition, Lock
+
+from diskcache import Cache
+
+
+class TaskQueue:
+    """
+    以 diskcache Cache 作为持久化存储的多通道任务队列。
+    同一进程内的入队操作会立即唤醒阻塞在 get 上的 worker，不需要轮询。
+    A multi-lane task queue persisted in a diskcache Cache.
+    Enqueueing in the same process wakes a worker blocked in get immediately, without polling.
+
+    每个通道有一个权重，get 按平滑加权轮询在非空通道之间选择，权重高的通道优先但不会饿死其他通道；
+    同一通道内按来源（source）轮流取出，单个来源的大量任务不会挡住同通道的其他来源。
+    Each lane has a weight and get picks among non-empty lanes by smooth weighted round robin,
+    so heavier lanes go first without starving the others. Inside a lane, sources take turns,
+    so a burst from one source does not block other sources of the same lane.
+
+    键的格式为 "{lane}|{source}|{seq}|{id}"，内存中的索引在启动时从已有的键重建。
+    Keys look like "{lane}|{source}|{seq}|{id}" and the in-memory index is rebuilt from them on start.
+    """
+
+    _instances: dict[str, "TaskQueue"] = {}
+    _instances_lock = Lock()
+
+    def __init__(self, directory: str | Path, lanes: dict[str, int] | None = None):
+        self.directory = Path(directory)
+        self.lanes: dict[str, int] = lanes or {"default": 1}
+        self.default_lane = next(iter(self.lanes))
+        self.cache = Cache(directory=self.directory)
+        self.condition = Condition()
+        # lane -> source -> 按出队顺序排列的键
+        self.index: dict[str, dict[str, deque[str]]] = {}
+        self.current_weights: dict[str, int] = {lane: 0 for lane in self.lanes}
+        self.size = 0
+        self._rebuild_index()
+
+    @classmethod
+    def open(cls, directory: str | Path, lanes: dict[str, int] | None = None) -> "TaskQueue":
+        """
+        同一目录只创建一个实例，这样生产者和消费者共享同一个 Condition。
+        Return the shared instance for a directory so producers and consumers share one Condition.
+        """
+        key = str(Path(directory).resolve())
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(directory, lanes=lanes)
+            return cls._instances[key]
+
+    def _rebuild_index(self):
+        entries: dict[tuple[str, str], list[tuple[int, str]]] = {}
+        legacy_keys = []
+        for key in self.cache.iterkeys():
+            if not isinstance(key, str):
+                # 旧版本 diskcache Deque 留下的任务
+                legacy_keys.append(key)
+                continue
+            lane, source, seq, _ = key.split("|", 3)
+            entries.setdefault((lane, source), []).append((int(seq), key))
+
+        self.index = {lane: {} for lane in self.lanes}
+        self.size = 0
+        for (lane, source), keys in entries.items():
+            keys.sort()
+            self.index.setdefault(lane, {})[source] = deque(key for _, key in keys)
+            self.size += len(keys)
+
+        # 旧版本队列从最大的键开始出队
+        for key in sorted(legacy_keys, reverse=True):
+            item = self.cache.pop(key, default=None)
+            if item is not None:
+                self._push(item, self.default_lane, "", front=False)
+
+    def _push(self, item: Any, lane: str | None, source: str | None, front: bool):
+        lane = lane if lane in self.lanes else self.default_lane
+        source = source or ""
+        # 插到队首的任务使用负的序号，排在所有普通任务之前，且越晚插入越靠前
+        seq = -time.time_ns() if front else time.time_ns()
+        key = f"{lane}|{source}|{seq}|{uuid.uuid4().hex[:8]}"
+        self.cache[key] = item
+        keys = self.index[lane].setdefault(source, deque())
+        if front:
+            keys.appendleft(key)
+        else:
+            keys.append(key)
+        self.size += 1
+
+    def put(self, item: Any, lane: str | None = None, source: str | None = None):
+        """追加到通道中该来源的队尾，按先进先出的顺序执行。"""
+        with self.condition:
+            self._push(item, lane, source, front=False)
+            self.condition.notify()
+
+    def put_front(self, item: Any, lane: str | None = None, source: str | None = None):
+        """插到通道中该来源的队首，下一个被取出（用于重试和被唤醒的任务）。"""
+        with self.condition:
+            self._push(item, lane, source, front=True)
+            self.condition.notify()
+
+    def _next_key(self) -> str | None:
+        non_empty_lanes = [lane for lane, sources in self.index.items() if sources]
+        if not non_empty_lanes:
+            return None
+
+        # 平滑加权轮询：每次所有非空通道加上自身权重，选出当前值最大的通道并减去总权重
+        total_weight = 0
+        for lane in non_empty_lanes:
+            weight = self.lanes.get(lane, 1)
+            self.current_weights[lane] = self.current_weights.get(lane, 0) + weight
+            total_weight += weight
+        lane = max(non_empty_lanes, key=lambda lane: self.current_weights[lane])
+        self.current_weights[lane] -= total_weight
+
+        # 同一通道内的来源轮流出队：取出后把该来源移到末尾
+        sources = self.index[lane]
+        source, keys = next(iter(sources.items()))
+        key = keys.popleft()
+        del sources[source]
+        if keys:
+            sources[source] = keys
+        self.size -= 1
+        return key
+
+    def get(self, timeout: float | None = None) -> Any | None:
+        """
+        取出一个任务，队列为空时阻塞等待，超时返回 None。
+        其他进程写入的任务不会触发通知，超时时重新扫描磁盘上的键后被取到。
+        Pop a task, blocking while the queue is empty. Returns None on timeout.
+        Items written by other processes are not notified; they are found by a rescan on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                key = self._next_key()
+                if key is not None:
+                    item = self.cache.pop(key, default=None)
+                    if item is not None:
+                        return item
+                    continue
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if len(self.cache) != self.size:
+                        self._rebuild_index()
+                        if self.size:
+                            continue
+                    return None
+                self.condition.wait(remaining)
+
+    def lane_lengths(self) -> dict[str, int]:
+        with self.condition:
+            return {lane: sum(len(keys) for keys in sources.values()) for lane, sources in self.index.items()}
+
+    def __len__(self):
+        return self.size
+
+
+class DelayedTaskQueue:
+    """
+    按到期时间排序的延迟任务队列。任务数据持久化在 diskcache Cache 中，
+    内存中用最小堆维护到期时间索引，入队和出队都是 O(log n)。
+    Delayed tasks ordered by due time. Task data is persisted in a diskcache Cache and an
+    in-memory min-heap indexes due times, so put and pop are O(log n).
+
+    键的格式与原先保持一致（"{scheduled_time:.6f}_{task_id}"），重启时从已有的键重建堆。
+    Keys keep the "{scheduled_time:.6f}_{task_id}" format and the heap is rebuilt from them on start.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.cache = Cache(directory=self.directory)
+        self.condition = Condition()
+        self.heap: list[tuple[float, str]] = []
+        self.task_keys: dict[str, str] = {}
+        for key in self.cache.iterkeys():
+            scheduled_time_str, task_id = str(key).split("_", 1)
+            self.heap.append((float(scheduled_time_str), str(key)))
+            self.task_keys[task_id] = str(key)
+        heapq.heapify(self.heap)
+
+    def put(self, item: Any, delay: float) -> tuple[str, float]:
+        """
+        添加延迟任务。如果新任务比当前最早的任务更早到期，唤醒等待中的调度器。
+        Add a delayed task, waking the scheduler if it is now the earliest one.
+        """
+        scheduled_time = time.time() + delay
+        task_id = uuid.uuid4().hex
+        key = f"{scheduled_time:.6f}_{task_id}"
+        with self.condition:
+            self.cache[key] = item
+            self.task_keys[task_id] = key
+            heapq.heappush(self.heap, (scheduled_time, key))
+            if self.heap[0][1] == key:
+                self.condition.notify()
+        return task_id, scheduled_time
+
+    def get_due(self, timeout: float | None = None) -> list[tuple[str, Any]]:
+        """
+        等待到最早的任务到期（或有更早的任务加入），返回所有已到期的 (task_id, item)。
+        超时仍没有到期任务时返回空列表。
+        Sleep until the earliest task is due (or a sooner one is added) and return every due
+        (task_id, item). Returns an empty list on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                current_time = time.time()
+                if self.heap and self.heap[0][0] <= current_time:
+                    due_items = []
+                    while self.heap and self.heap[0][0] <= current_time:
+                        _, key = heapq.heappop(self.heap)
+                        task_id = key.split("_", 1)[1]
+                        self.task_keys.pop(task_id, None)
+                        # 已经被 wake 提前取出的任务在缓存中不存在，直接跳过
+                        item = self.cache.pop(key, default=None)
+                        if item is not None:
+                            due_items.append((task_id, item))
+                    if due_items:
+                        return due_items
+                    continue
+
+                wait_time = self.heap[0][0] - current_time if self.heap else None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return []
+                    wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                self.condition.wait(wait_time)
+
+    def wake(self, task_id: str) -> Any | None:
+        """
+        提前取出一个尚未到期的任务，任务不存在（已到期或已被取出）时返回 None。
+        Take a task out before it is due. Returns None if it is no longer parked.
+        """
+        with self.condition:
+            key = self.task_keys.pop(task_id, None)
+            if key is None:
+                return None
+            # 堆中的条目保留到到期时再丢弃，避免 O(n) 的删除
+            return self.cache.pop(key, default=None)
+
+    def __len__(self):
+        return len(self.task_keys)
@@ -1,6 +1,7 @@
 # @Author: Bi Ying
 # @Date:   2024-06-09 12:04:08
 from .image import get_screenshot, ImageProcessor
+from .image_pipeline import render_images
 from .audio import TTSClient, SpeechRecognitionClient, Microphone
 
 
@@ -9,5 +10,6 @@ __all__ = [
     "Microphone",
     "get_screenshot",
     "ImageProcessor",
+    "render_images",
     "SpeechRecognitionClient",
 ]
@@ -391,6 +391,8 @@ class DeepgramProvider(ASRProvider):
 
     def transcribe(self, file: FileTypes, output_type: str):
         if isinstance(file, IOBase):
+            # Deepgram SDK 的 buffer 只接受 bytes，文件会整体读入内存，这里没有流式上传
+            # The Deepgram SDK buffer source takes bytes, so the whole file is read into memory here
             payload: FileSource = {"buffer": file.read()}
         elif isinstance(file, bytes):
             payload: FileSource = {"buffer": file}
@@ -1,6 +1,7 @@
 # @Author: Bi Ying
 # @Date:   2024-06-09 00:21:23
 import base64
+import hashlib
 from io import BytesIO
 from pathlib import Path
 from datetime import datetime
@@ -9,6 +10,7 @@ from typing import Literal, Union, TypeGuard
 
 import mss
 import mss.tools
+from diskcache import Cache
 from PIL.ImageFile import ImageFile
 from PIL import Image, ImageDraw, ImageFont
 
@@ -57,41 +59,23 @@ class ImageProcessor:
         max_width: int | None = None,
         max_height: int | None = None,
     ):
-        img_bytes = BytesIO()
         image_format = img.format or "JPEG"
-        _img = img.copy()
-        _img.save(img_bytes, format=image_format, optimize=True)
-
-        if max_width is not None and _img.width > max_width:
-            new_size = (max_width, int(max_width * _img.height / _img.width))
-            _img = _img.resize(new_size, Image.Resampling.LANCZOS)
-
-        if max_height is not None and _img.height > max_height:
-            new_size = (int(max_height * _img.width / _img.height), max_height)
-            _img = _img.resize(new_size, Image.Resampling.LANCZOS)
-
-        img_bytes = BytesIO()
-        _img.save(img_bytes, format=image_format, optimize=True)
-
-        if max_size is not None and img_bytes.getbuffer().nbytes <= max_size:
-            return img_bytes
-
-        original_size = _img.size
-        scale_factor = 0.9
-
-        while True:
-            new_size = (int(original_size[0] * scale_factor), int(original_size[1] * scale_factor))
-            img_resized = _img.resize(new_size, Image.Resampling.LANCZOS)
-
-            img_bytes_resized = BytesIO()
-            img_resized.save(img_bytes_resized, format=image_format, optimize=True)
-
-            if max_size is not None and img_bytes_resized.getbuffer().nbytes <= max_size:
-                return img_bytes_resized
-
-            scale_factor -= 0.1
-            if scale_factor < 0.1:
-                return img_bytes_resized
+        cache_key = get_encoded_image_cache_key(img, image_format, max_size, max_width, max_height)
+        encoded_image_cache = get_encoded_image_cache()
+        image_bytes = encoded_image_cache.get(cache_key)
+        if image_bytes is None:
+            _img = img
+            if max_width is not None and _img.width > max_width:
+                new_size = (max_width, int(max_width * _img.height / _img.width))
+                _img = _img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+            if max_height is not None and _img.height > max_height:
+                new_size = (int(max_height * _img.width / _img.height), max_height)
+                _img = _img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+            image_bytes, _passes = encode_image_to_size(_img, image_format, max_size)
+            encoded_image_cache.set(cache_key, image_bytes)
+        return BytesIO(image_bytes)
 
     def crop(
         self,
@@ -160,13 +144,20 @@ class ImageProcessor:
         self._image.format = self._image_format
         return self
 
-    def scale(self, method: str = "proportional_scale", ratio: float = 1.0, width: int = 0, height: int = 0):
+    def scale(
+        self,
+        method: str = "proportional_scale",
+        ratio: float = 1.0,
+        width: int = 0,
+        height: int = 0,
+        reducing_gap: float | None = None,
+    ):
         img = self._image
         self._image_format = img.format or "JPEG"
         if method == "proportional_scale":
             new_width = int(img.width * ratio)
             new_height = int(img.height * ratio)
-            self._image = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            self._image = img.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
         elif method == "fixed_width_height":
             if width == 0:
                 # If width is 0, then scale the image to the height
@@ -174,7 +165,7 @@ class ImageProcessor:
             elif height == 0:
                 # If height is 0, then scale the image to the width
                 height = int(img.height * width / img.width)
-            self._image = img.resize((width, height), Image.Resampling.LANCZOS)
+            self._image = img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
         else:
             raise ValueError("Invalid scale_method")
 
@@ -427,11 +418,7 @@ class ImageProcessor:
 
     @cached_property
     def base64_image(self):
-        if self.max_size is None and self.max_width is None and self.max_height is None:
-            return base64.b64encode(self.bytes).decode()
-
-        img_bytes_resized = self._resize_image(self._image, self.max_size, self.max_width, self.max_height)
-        return base64.b64encode(img_bytes_resized.getvalue()).decode()
+        return base64.b64encode(self.bytes).decode()
 
     @cached_property
     def mime_type(self):
@@ -442,6 +429,129 @@ class ImageProcessor:
         return f"data:{self.mime_type};base64,{self.base64_image}"
 
 
+_encoded_image_cache: Cache | None = None
+
+# 有损格式先降低质量再缩小尺寸，质量不低于 MIN_QUALITY
+# Lossy formats lower the quality before shrinking the image, never below MIN_QUALITY
+LOSSY_FORMATS = ("JPEG", "WEBP")
+DEFAULT_QUALITY = 75
+MIN_QUALITY = 50
+
+
+def get_encoded_image_cache() -> Cache:
+    """
+    按尺寸上限编码后的图片缓存，键为像素内容的哈希，同一张图片发给多个提示词时只编码一次。
+    Cache of images encoded to a size limit, keyed by a hash of the pixels, so an image sent with several
+    prompts is encoded once.
+    """
+    global _encoded_image_cache
+    if _encoded_image_cache is None:
+        _encoded_image_cache = Cache(
+            directory=Path(config.data_path) / "cache" / "encoded_images",
+            size_limit=config.get("image_processing.encoded_cache_size_limit", 256 * 1024 * 1024),
+            eviction_policy="least-recently-used",
+        )
+    return _encoded_image_cache
+
+
+def get_encoded_image_cache_key(
+    img: Image.Image,
+    image_format: str,
+    max_size: int | None,
+    max_width: int | None,
+    max_height: int | None,
+) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img.mode}:{img.size}:{image_format}:{max_size}:{max_width}:{max_height}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def encode_image_to_size(
+    img: Image.Image,
+    image_format: str,
+    max_size: int | None,
+    max_passes: int = 8,
+) -> tuple[bytes, int]:
+    """
+    把图片编码到不超过 max_size 字节，返回编码结果和编码次数。
+
+    先按原尺寸编码一次，放得下就直接返回。有损格式接着在 [MIN_QUALITY, DEFAULT_QUALITY] 上二分质量，
+    最低质量仍然放不下时再缩小尺寸：编码大小大致与像素数成正比，由字节比例估计缩放比例，
+    之后在放得下和放不下的缩放比例之间二分，取放得下的最大尺寸。编码次数用完时返回最好的结果。
+
+    Encode img to at most max_size bytes and return the encoded bytes and the number of encode passes.
+
+    The image is first encoded at its original size and returned if it fits. Lossy formats then bisect
+    the quality over [MIN_QUALITY, DEFAULT_QUALITY], and only shrink the image when the lowest quality
+    still does not fit: the encoded size is roughly proportional to the pixel count, so the scale is
+    estimated from the byte ratio and then bisected between a scale that fits and one that does not,
+    keeping the largest size that fits. When the passes run out the best result so far is returned.
+    """
+    passes = 0
+    is_lossy = image_format in LOSSY_FORMATS
+
+    def encode(scale: float, quality: int) -> bytes:
+        nonlocal passes
+        passes += 1
+        if scale < 1:
+            new_size = (max(int(img.width * scale), 1), max(int(img.height * scale), 1))
+            _img = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        else:
+            _img = img
+        img_bytes = BytesIO()
+        if is_lossy:
+            _img.save(img_bytes, format=image_format, quality=quality, optimize=True)
+        else:
+            _img.save(img_bytes, format=image_format, optimize=True)
+        return img_bytes.getvalue()
+
+    encoded = encode(1, DEFAULT_QUALITY)
+    if max_size is None or len(encoded) <= max_size:
+        return encoded, passes
+
+    quality = DEFAULT_QUALITY
+    if is_lossy:
+        lowest = encode(1, MIN_QUALITY)
+        if len(lowest) <= max_size:
+            # 质量在 (low, high) 之间二分，low 放得下，high 放不下
+            low, high, best = MIN_QUALITY, DEFAULT_QUALITY, lowest
+            while high - low > 5 and passes < max_passes:
+                middle = (low + high) // 2
+                encoded = encode(1, middle)
+                if len(encoded) <= max_size:
+                    low, best = middle, encoded
+                else:
+                    high = middle
+            return best, passes
+        quality, encoded = MIN_QUALITY, lowest
+
+    # 缩放比例在 (fit_scale, too_large_scale) 之间搜索
+    # Search the scale between fit_scale (fits) and too_large_scale (does not fit)
+    fit_scale, fit_encoded = 0.0, None
+    too_large_scale, too_large_size = 1.0, len(encoded)
+    smallest = encoded
+    while passes < max_passes:
+        if fit_encoded is None:
+            # 还没有放得下的尺寸时按字节比例估计，留出一些余量
+            scale = too_large_scale * (max_size / too_large_size) ** 0.5 * 0.95
+        else:
+            scale = (fit_scale + too_large_scale) / 2
+        encoded = encode(scale, quality)
+        if len(encoded) < len(smallest):
+            smallest = encoded
+        if len(encoded) <= max_size:
+            fit_scale, fit_encoded = scale, encoded
+            # 已经接近上限或者区间足够小时停止
+            if len(encoded) >= max_size * 0.9 or too_large_scale - fit_scale < 0.02:
+                break
+        else:
+            too_large_scale, too_large_size = scale, len(encoded)
+            if fit_encoded is not None and too_large_scale - fit_scale < 0.02:
+                break
+    return (fit_encoded if fit_encoded is not None else smallest), passes
+
+
 def get_screenshot(
     output_type: str = "base64", monitor_number: int = 0, compression_level: int = 1, max_length: int = 1920
 ):
@@ -0,0 +1,119 @@
+# @Author: Bi Ying
+# @Date:   2024-08-27 15:40:18
+import os
+import uuid
+from io import BytesIO
+from pathlib import Path
+from functools import lru_cache
+
+from PIL import Image
+
+from utilities.general import map_list
+from utilities.media_processing.image import ImageProcessor
+
+
+# 一组图片操作，每项为 (ImageProcessor 的方法名, 参数)，按顺序在内存中执行
+# A chain of image operations, each a (ImageProcessor method name, params) pair applied in memory in order
+ImageOperations = list[tuple[str, dict]]
+
+
+@lru_cache(maxsize=16)
+def _load_watermark_image(source: str, file_version: tuple[int, int] | None) -> Image.Image:
+    image = ImageProcessor(source, max_size=None).image
+    image.load()
+    return image
+
+
+def load_watermark_image(source: str) -> Image.Image:
+    """
+    同一批次中的水印图片通常相同，每个进程只解码一次。本地文件以修改时间和大小作为缓存键的一部分，
+    同一路径的文件被替换后会重新解码。
+    The watermark is usually the same for a whole batch, so each process decodes it once. Local files
+    are also keyed by modification time and size, so a file replaced at the same path is decoded again.
+    """
+    try:
+        stat = os.stat(source)
+        file_version = (stat.st_mtime_ns, stat.st_size)
+    except (OSError, ValueError):
+        # URL 或 base64 等不是本地文件的来源
+        file_version = None
+    return _load_watermark_image(source, file_version)
+
+
+def encode_image(image: Image.Image, image_format: str, quality: int | None = None) -> tuple[bytes, str]:
+    """
+    把图片编码一次，返回编码结果和实际使用的格式。有透明通道时使用 PNG。
+    quality 与 ImageProcessor.compress 的含义相同，为 None 或 100 时不压缩。
+    Encode the image once and return the bytes and the format actually used. Images with transparency
+    are saved as PNG. quality has the same meaning as in ImageProcessor.compress; None or 100 means no
+    compression.
+    """
+    has_transparency = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if has_transparency:
+        image_format = "PNG"
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    params = {}
+    if quality is not None and quality < 100:
+        if image_format == "JPEG":
+            params["quality"] = int(quality * 0.95)
+        elif image_format == "PNG":
+            params["compress_level"] = int(9 - (quality / 100 * 9))
+        else:
+            params["quality"] = quality
+
+    img_bytes = BytesIO()
+    try:
+        image.save(img_bytes, format=image_format, optimize=True, **params)
+    except ValueError:
+        img_bytes = BytesIO()
+        image.save(img_bytes, format=image_format)
+    return img_bytes.getvalue(), image_format
+
+
+def render_image(image_source: str, operations: ImageOperations, output_folder: str | Path) -> str:
+    """
+    解码一次图片，在内存中依次执行 operations，编码一次后写入 output_folder，返回文件名。
+    compress 不单独编码，而是作为最终编码的质量。
+    Decode the image once, apply operations in memory, encode it once and write it to output_folder.
+    Returns the file name. compress does not encode on its own; it sets the quality of the final encode.
+    """
+    image_processor = ImageProcessor(image_source, max_size=None)
+    quality = None
+    for method, params in operations:
+        if method == "compress":
+            quality = params["quality"]
+            continue
+        if method == "scale":
+            # 大幅缩小时先用 reduce 按整数倍缩小，再用 LANCZOS 完成剩余部分，结果几乎没有差别
+            # Large reductions first shrink by an integer factor with reduce, then finish with LANCZOS
+            params = {"reducing_gap": 3.0, **params}
+        elif method == "add_image_watermark":
+            params = {**params, "watermark_image": load_watermark_image(params["watermark_image"])}
+        getattr(image_processor, method)(**params)
+
+    image = image_processor.image
+    image_bytes, image_format = encode_image(image, image.format or "JPEG", quality)
+    extension = Image.MIME[image_format].split("/")[1].lower()
+    image_name = f"{uuid.uuid4().hex}.{extension}"
+    with open(Path(output_folder) / image_name, "xb") as file:
+        file.write(image_bytes)
+    return image_name
+
+
+def render_images(
+    jobs: list[tuple[str, ImageOperations]], output_folder: str | Path, errors: str = "raise"
+) -> list[str | None]:
+    """
+    对每个 (图片来源, 操作) 执行 render_image，返回与输入顺序一致的文件名。
+    调用它的节点已经在 WorkflowServer 的进程池中运行，这里只在线程中并行，不再创建进程池；
+    Pillow 解码、缩放和编码时释放 GIL，线程数默认为 CPU 核数，见配置 list_mapping.providers.image_processing。
+    errors 与 map_list 相同，为 "ignore" 时失败的图片对应 None。
+    Run render_image for every (image source, operations) job and return the file names in input order.
+    The calling nodes already run in the WorkflowServer process pool, so images are only spread across
+    threads here rather than a second process pool. Pillow releases the GIL while decoding, resizing and
+    encoding, and the thread count defaults to the CPU count, see list_mapping.providers.image_processing.
+    errors works as in map_list; with "ignore" a failed image maps to None.
+    """
+    return map_list(lambda job: render_image(*job, output_folder), jobs, provider="image_processing", errors=errors)
@@ -1,6 +1,9 @@
 # @Author: Bi Ying
 # @Date:   2024-06-09 11:45:57
-from .workflow import DAG, Node, Workflow, WorkflowData
+from .workflow import DAG, Node, Workflow, WorkflowData, workflow_finished_listeners
+from .continuation import ContinuationStore
+from .run_queue import WORKFLOW_QUEUE_LANES, get_queue_route, open_workflow_queue
+from .trace import add_span, trace_span, build_timeline
 
 
 __all__ = [
@@ -8,4 +11,12 @@ __all__ = [
     "Node",
     "Workflow",
     "WorkflowData",
+    "ContinuationStore",
+    "workflow_finished_listeners",
+    "WORKFLOW_QUEUE_LANES",
+    "get_queue_route",
+    "open_workflow_queue",
+    "add_span",
+    "trace_span",
+    "build_timeline",
 ]
@@ -0,0 +1,127 @@
+# @Author: Bi Ying
+# @Date:   2024-08-16 14:27:05
+import pickle
+import hashlib
+from pathlib import Path
+from threading import Lock
+
+from diskcache import Cache
+
+
+class ContinuationStore:
+    """
+    保存挂起（重试或等待子工作流）中的工作流运行状态，以运行记录 ID 为索引。
+    延迟队列和主队列中只保存轻量的引用 {"continuation": rid, "node_id": ..., "attempt": ...}。
+
+    工作流数据按顶层字段和节点拆分保存，每部分记录内容摘要，内容没有变化的部分不会重复写入，
+    因此包含大文件内容或 base64 图片的节点只会写入一次。
+
+    Stores the state of parked (retrying or waiting) runs keyed by record id. The delayed and
+    main queues only hold a lightweight reference {"continuation": rid, "node_id": ..., "attempt": ...}.
+
+    Workflow data is split into top-level fields and nodes, each stored with a content digest.
+    Unchanged parts are not written again, so nodes holding file contents or base64 images are
+    written once per run.
+    """
+
+    def __init__(self, directory: str | Path, expire: int = 60 * 60 * 24 * 7):
+        self.directory = Path(directory)
+        # 挂起的状态只能由运行结束时的 delete 或过期删除，不能因缓存大小被淘汰
+        self.cache = Cache(directory=self.directory, eviction_policy="none")
+        self.expire = expire
+        self.lock = Lock()
+        # 累计写入的字节数，用于基准测试
+        self.bytes_written = 0
+
+    @staticmethod
+    def is_reference(task_data: dict) -> bool:
+        return "continuation" in task_data
+
+    def _split(self, workflow_data: dict) -> dict[str, object]:
+        parts: dict[str, object] = {}
+        node_ids = []
+        for node in workflow_data.get("nodes", []):
+            parts[f"node:{node['id']}"] = node
+            node_ids.append(node["id"])
+        for key, value in workflow_data.items():
+            if key != "nodes":
+                parts[f"field:{key}"] = value
+        parts["node_ids"] = node_ids
+        return parts
+
+    def park(self, task_data: dict) -> dict | None:
+        """
+        保存工作流状态并返回用于入队的引用。没有运行记录 ID 时返回 None，由调用方直接入队完整数据。
+        Save the workflow state and return the reference to enqueue. Returns None when there is
+        no record id, in which case the caller enqueues the full data as before.
+        """
+        workflow_data = dict(task_data)
+        node_id = workflow_data.pop("node_id", None)
+        record_id = workflow_data.get("rid")
+        if not record_id:
+            return None
+
+        with self.lock:
+            index_key = f"{record_id}:index"
+            index: dict = self.cache.get(index_key, default={})  # type: ignore
+            digests: dict[str, str] = index.get("digests", {})
+            new_digests = {}
+            for part, value in self._split(workflow_data).items():
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+                new_digests[part] = digest
+                part_key = f"{record_id}:{part}"
+                # 内容没有变化且仍在缓存中时只延长过期时间；已被淘汰或过期时重新写入
+                if digests.get(part) == digest and self.cache.touch(part_key, expire=self.expire):
+                    continue
+                self.cache.set(part_key, data, expire=self.expire)
+                self.bytes_written += len(data)
+
+            # 删除已经不存在的部分（例如被清理掉的字段）
+            for part in set(digests) - set(new_digests):
+                self.cache.delete(f"{record_id}:{part}")
+
+            attempt = index.get("attempt", 0) + 1
+            self.cache.set(index_key, {"digests": new_digests, "attempt": attempt}, expire=self.expire)
+
+        # 队列通道随引用一起保存，恢复入队时不需要先读取完整数据
+        return {
+            "continuation": record_id,
+            "node_id": node_id,
+            "attempt": attempt,
+            "queue_route": workflow_data.get("queue_route"),
+        }
+
+    def resume(self, reference: dict) -> dict | None:
+        """
+        根据引用还原工作流数据，状态已丢失时返回 None。
+        Rebuild the workflow data from a reference. Returns None if the state is gone.
+        """
+        record_id = reference["continuation"]
+        with self.lock:
+            index = self.cache.get(f"{record_id}:index")
+            if not isinstance(index, dict):
+                return None
+            parts = {}
+            for part in index["digests"]:
+                data = self.cache.get(f"{record_id}:{part}")
+                if data is None:
+                    return None
+                parts[part] = pickle.loads(data)  # type: ignore
+
+        workflow_data = {}
+        for part, value in parts.items():
+            if part.startswith("field:"):
+                workflow_data[part[len("field:") :]] = value
+        workflow_data["nodes"] = [parts[f"node:{node_id}"] for node_id in parts["node_ids"]]
+        if reference.get("node_id") is not None:
+            workflow_data["node_id"] = reference["node_id"]
+        return workflow_data
+
+    def delete(self, record_id: str):
+        with self.lock:
+            index = self.cache.pop(f"{record_id}:index", default=None)
+            if not isinstance(index, dict):
+                return
+            for part in index["digests"]:
+                self.cache.delete(f"{record_id}:{part}")
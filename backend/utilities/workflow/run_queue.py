@@ -0,0 +1,42 @@
+# @Author: Bi Ying
+# @Date:   2024-08-20 15:06:41
+from pathlib import Path
+
+from models import WorkflowRunRecord
+from utilities.config import config
+from utilities.general import TaskQueue
+
+
+# 工作流运行队列的通道及权重，按优先级从高到低排列
+# Lanes of the workflow run queue and their weights, from highest to lowest priority
+WORKFLOW_QUEUE_LANES = {
+    "interactive": 4,  # 聊天中的工具调用、编辑器中的运行，用户在等待结果
+    "background": 2,  # API 调用、定时运行
+    "child": 1,  # workflow_invoke / workflow_loop 启动的子工作流
+}
+
+RUN_FROM_LANES = {
+    WorkflowRunRecord.RunFromTypes.CHAT: "interactive",
+    WorkflowRunRecord.RunFromTypes.WEB: "interactive",
+    WorkflowRunRecord.RunFromTypes.API: "background",
+    WorkflowRunRecord.RunFromTypes.SCHEDULE: "background",
+    WorkflowRunRecord.RunFromTypes.WORKFLOW: "child",
+}
+
+
+def get_queue_route(run_from: str, parent_record_id: str | None = None) -> dict:
+    """
+    根据运行来源和父工作流确定运行所在的通道和来源。
+    子工作流以父工作流的运行记录 ID 作为来源，多个父工作流的子工作流轮流执行。
+    Pick the lane and source of a run from its run_from and parent run.
+    Child runs use the parent record id as source, so the children of different parents take turns.
+    """
+    if parent_record_id:
+        return {"lane": "child", "source": parent_record_id}
+    return {"lane": RUN_FROM_LANES.get(run_from, "background"), "source": run_from}
+
+
+def open_workflow_queue(directory: str | Path | None = None) -> TaskQueue:
+    if directory is None:
+        directory = Path(config.data_path) / "cache" / "workflow_task"
+    return TaskQueue.open(directory, lanes=WORKFLOW_QUEUE_LANES)
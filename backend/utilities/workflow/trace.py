@@ -0,0 +1,94 @@
+# @Author: Bi Ying
+# @Date:   2024-08-23 10:37:15
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+
+def add_span(
+    workflow_data: dict,
+    name: str,
+    start: float,
+    end: float,
+    category: str = "node",
+    node_id: str | None = None,
+    **attributes: Any,
+) -> dict:
+    """
+    在 workflow_data["trace"] 中记录一段耗时。时间为 time.time() 的时间戳，重试和跨进程后仍然可以比较。
+    同一次运行中的节点可能并发执行，list.append 是原子操作，不需要加锁。
+    Record a span in workflow_data["trace"]. Times are time.time() timestamps so spans stay comparable
+    across retries and processes. Nodes of a run may record concurrently; list.append is atomic.
+    """
+    span = {"name": name, "category": category, "node_id": node_id, "start": start, "end": end}
+    if attributes:
+        span["attributes"] = attributes
+    workflow_data.setdefault("trace", []).append(span)
+    return span
+
+
+@contextmanager
+def trace_span(
+    workflow_data: dict,
+    name: str,
+    category: str = "node",
+    node_id: str | None = None,
+    **attributes: Any,
+) -> Iterator[dict]:
+    """
+    记录 with 语句块的耗时，返回的字典可以在块内补充属性。块内抛出异常时记录异常类型。
+    Record the duration of the with block. The yielded dict takes extra attributes; if the block
+    raises, the exception type is recorded.
+    """
+    start = time.time()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        add_span(workflow_data, name, start, time.time(), category=category, node_id=node_id, **attributes)
+
+
+def build_timeline(trace: list[dict]) -> dict:
+    """
+    把运行记录中的 trace 转换为火焰图使用的时间线：时间以运行开始为零点（毫秒），
+    每个 span 按节点分到不同的轨道，并按包含关系计算深度。
+    Turn a run's trace into flame chart timeline data: times are milliseconds from the start of the run,
+    spans are grouped into tracks by node and nested by containment into depths.
+    """
+    if not trace:
+        return {"start_time": None, "duration": 0, "tracks": []}
+
+    start_time = min(span["start"] for span in trace)
+    end_time = max(span["end"] for span in trace)
+    tracks: dict[str, list[dict]] = {}
+    for span in sorted(trace, key=lambda span: (span["start"], -span["end"])):
+        track = span.get("node_id") or span.get("category", "run")
+        tracks.setdefault(track, []).append(
+            {
+                "name": span["name"],
+                "category": span.get("category", "node"),
+                "start": round((span["start"] - start_time) * 1000, 3),
+                "duration": round((span["end"] - span["start"]) * 1000, 3),
+                "end_ms": (span["end"] - start_time) * 1000,
+                "attributes": span.get("attributes", {}),
+            }
+        )
+
+    result_tracks = []
+    for track, spans in tracks.items():
+        # 与仍在进行中的上层 span 重叠的 span 深度加一
+        open_ends: list[float] = []
+        for span in spans:
+            while open_ends and open_ends[-1] <= span["start"]:
+                open_ends.pop()
+            span["depth"] = len(open_ends)
+            open_ends.append(span.pop("end_ms"))
+        result_tracks.append({"name": track, "spans": spans})
+
+    return {
+        "start_time": start_time,
+        "duration": round((end_time - start_time) * 1000, 3),
+        "tracks": result_tracks,
+    }
@@ -8,7 +8,9 @@ import time
 from pathlib import Path
 from copy import deepcopy
 from datetime import datetime
-from typing import List, Any, Union
+from threading import Lock
+from contextlib import contextmanager
+from typing import List, Any, Callable
 from functools import cached_property
 
 from diskcache import Deque
@@ -21,13 +23,14 @@ from utilities.general import mprint_with_name
 
 mprint = mprint_with_name(name="Workflow")
 
-ASYNC_TASKS = [
-    "control_flows.workflow_loop",
-    "tools.workflow_invoke",
-]
-
 node_status_queue = Deque(directory=Path(config.data_path) / "cache" / "node_status")
 
+# 工作流运行结束（成功或失败）后调用，参数为运行记录 ID。
+# WorkflowServer 通过它唤醒正在等待该子工作流的父工作流。
+# Called with the record id when a run finishes or fails. WorkflowServer uses it to wake
+# the parent workflow waiting for that child run.
+workflow_finished_listeners: list[Callable[[str], None]] = []
+
 
 class DAG:
     def __init__(self):
@@ -59,11 +62,15 @@ class DAG:
     def get_all_nodes(self):
         return list(self.nodes)
 
-    def topological_sort(self):
+    def get_in_degrees(self) -> dict:
         in_degree = {node: 0 for node in self.nodes}
         for start, ends in self.edges.items():
             for end in ends:
                 in_degree[end] += 1
+        return in_degree
+
+    def topological_sort(self):
+        in_degree = self.get_in_degrees()
 
         queue = [node for node, degree in in_degree.items() if degree == 0]
 
@@ -81,45 +88,6 @@ class DAG:
 
         return result
 
-    def topological_sort_layered(self):
-        in_degree = {node: 0 for node in self.nodes}
-        for start, ends in self.edges.items():
-            for end in ends:
-                in_degree[end] += 1
-
-        # Initialize the queue with nodes that have no incoming edges
-        queue = [node for node, degree in in_degree.items() if degree == 0]
-
-        layered_result = []
-        while queue:
-            # Process all nodes at the current level
-            current_layer = []
-            for node in queue:
-                current_layer.append(node)
-
-            # Prepare the next level
-            next_queue = []
-            for node in current_layer:
-                for child in self.edges[node]:
-                    in_degree[child] -= 1
-                    if in_degree[child] == 0:
-                        next_queue.append(child)
-
-            # Add the current layer to the result and update the queue
-            layered_result.append(current_layer)
-            queue = next_queue
-
-        # Flatten the result if there's only one node in a layer
-        for i in range(len(layered_result)):
-            if len(layered_result[i]) == 1:
-                layered_result[i] = layered_result[i][0]
-
-        # Check for cycles in the graph
-        if sum(len(layer) if isinstance(layer, list) else 1 for layer in layered_result) != len(self.nodes):
-            raise ValueError("The graph contains cycles")
-
-        return layered_result
-
 
 class Node:
     def __init__(self, node_data: dict):
@@ -166,7 +134,23 @@ class Node:
 
 
 class Workflow:
+    # 正在运行的工作流，以 workflow_data 的 id 为索引。
+    # 同一次运行中所有任务拿到的是同一个 workflow_data，因此可以直接复用已经解析好的 Workflow。
+    # Workflows of running chains, keyed by id(workflow_data). Every task of a run receives
+    # the same workflow_data dict, so the parsed Workflow can be reused instead of rebuilt.
+    _active_workflows: dict[int, "Workflow"] = {}
+    _active_workflows_lock = Lock()
+
+    def __new__(cls, workflow_data: dict):
+        workflow = cls._active_workflows.get(id(workflow_data))
+        if workflow is not None and workflow.workflow_data is workflow_data:
+            return workflow
+        return super().__new__(cls)
+
     def __init__(self, workflow_data: dict):
+        if self.__dict__.get("workflow_data") is workflow_data:
+            # 复用的 Workflow 已经解析过，不需要重新构建节点和 DAG
+            return
         self.workflow_data = workflow_data
         if "original_workflow_data" not in workflow_data:
             self.original_workflow_data = deepcopy(workflow_data)
@@ -178,20 +162,37 @@ class Workflow:
         self.workflow_data["nodes"] = [node for node in self.workflow_data["nodes"] if not node.get("ignored", False)]
         self.__node_id_map = workflow_data.get("__node_id_map", {})
         self.nodes = self.parse_nodes()
+        self.input_edge_map = self.create_input_edge_map()
         self.dag = self.create_dag()
         self.workflow_id: str = workflow_data.get("wid", "")
         self.record_id: str = workflow_data.get("rid", "")
 
+    @contextmanager
+    def activate(self):
+        """
+        在上下文中注册当前工作流，期间 Workflow(self.data) 直接返回本对象，不再重新解析。
+        Register this workflow so that Workflow(self.data) returns it instead of re-parsing.
+        """
+        key = id(self.workflow_data)
+        with self._active_workflows_lock:
+            previous = self._active_workflows.get(key)
+            self._active_workflows[key] = self
+        try:
+            yield self
+        finally:
+            with self._active_workflows_lock:
+                if previous is None:
+                    self._active_workflows.pop(key, None)
+                else:
+                    self._active_workflows[key] = previous
+
     def parse_nodes(self):
         nodes_list: list[dict] = self.workflow_data["nodes"]
         nodes: dict[str, Node] = {}
-        while len(nodes_list) > 0:
-            node = nodes_list.pop(0)
+        for node in nodes_list:
             if node.get("ignored", False):
                 continue
-            node_obj = Node(node)
-            nodes[node["id"]] = node_obj
-            continue
+            nodes[node["id"]] = Node(node)
 
         # 更新原始数据中的nodes
         self.workflow_data["nodes"] = [node.data for node in nodes.values()]
@@ -242,6 +243,7 @@ class Workflow:
             edge["target"] = self.__node_id_map.get(edge["target"] + node_obj.id, edge["target"])
             edge["id"] = f"vueflow__edge-{edge['source']}{edge['sourceHandle']}-{edge['target']}{edge['targetHandle']}"
         self.edges.extend(subworkflow.get("edges", []))
+        self.input_edge_map = self.create_input_edge_map()
         return updated_subnodes
 
     def add_subnode(
@@ -275,6 +277,23 @@ class Workflow:
             subnode_field_data["value"] = node_obj.get_field(subnode_field)["value"]
             subnode_obj.update_field(subnode_field, subnode_field_data)
 
+    def create_input_edge_map(self) -> dict[tuple[str, str], tuple[str, str]]:
+        """
+        建立 (目标节点, 目标字段) -> (源节点, 源字段) 的索引，避免每次读取字段时遍历所有边。
+        同一个目标字段有多条边时，保留第一条有效的边，与原先的遍历顺序一致。
+        Build a (target node, target handle) -> (source node, source handle) index
+        so reading a field does not scan every edge.
+        """
+        input_edge_map: dict[tuple[str, str], tuple[str, str]] = {}
+        for edge in self.edges:
+            source_node = self.get_node(edge["source"])
+            if source_node is None:
+                continue
+            if source_node.type in ("Empty", "ButtonTrigger"):
+                continue
+            input_edge_map.setdefault((edge["target"], edge["targetHandle"]), (edge["source"], edge["sourceHandle"]))
+        return input_edge_map
+
     def create_dag(self):
         dag = DAG()
         for edge in self.edges:
@@ -291,66 +310,6 @@ class Workflow:
             if node_id not in all_nodes and node.category not in ["triggers", "assistedNodes"]:
                 dag.add_node(node_id)
 
-    def get_sorted_task_order(self) -> list:
-        nodes_order = self.dag.topological_sort()
-        tasks = []
-        for node_id in nodes_order:
-            node = self.get_node(node_id)
-            if node is None:
-                continue
-            task_name = node.task_name
-            tasks.append(
-                {
-                    "node_id": node_id,
-                    "task_name": task_name,
-                }
-            )
-        return tasks
-
-    def get_layer_sorted_task_order(self) -> list[Union[dict[str, str], list[dict[str, str]]]]:
-        nodes_order = self.dag.topological_sort_layered()
-        tasks: list[dict[str, str] | list[dict[str, str]]] = []
-        for item in nodes_order:
-            if isinstance(item, str):
-                node = self.get_node(item)
-                if node is None:
-                    continue
-                task_name = node.task_name
-                tasks.append(
-                    {
-                        "node_id": item,
-                        "task_name": task_name,
-                    }
-                )
-            elif isinstance(item, list):
-                batch_tasks = []
-                async_tasks = []
-                for node_id in item:
-                    node = self.get_node(node_id)
-                    if node is None:
-                        continue
-                    task_name = node.task_name
-                    if task_name in ASYNC_TASKS:
-                        async_tasks.append(
-                            {
-                                "node_id": node_id,
-                                "task_name": task_name,
-                            }
-                        )
-                    else:
-                        batch_tasks.append(
-                            {
-                                "node_id": node_id,
-                                "task_name": task_name,
-                            }
-                        )
-                if batch_tasks:
-                    tasks.append(batch_tasks)
-                # 异步任务要一个个单独执行
-                if async_tasks:
-                    tasks.extend(async_tasks)
-        return tasks
-
     def get_field_actual_node(self, node: Node, field_data: dict):
         if node.type != "WorkflowInvoke":
             return node
@@ -375,6 +334,8 @@ class Workflow:
         self.workflow_data.pop("related_workflows", None)
         self.workflow_data.pop("__node_id_map", None)
         self.workflow_data.pop("async_tasks", None)
+        self.workflow_data.pop("completed_nodes", None)
+        self.workflow_data.pop("queue_route", None)
 
     def get_node(self, node_id: str) -> Node | None:
         return self.nodes.get(node_id)
@@ -391,35 +352,87 @@ class Workflow:
         if node is None:
             return default
 
-        source_node_id = source_handle_id = ""
-        for edge in self.edges:
-            source_node = self.get_node(edge["source"])
-            if source_node is None:
-                continue
-            if source_node.type in ("Empty", "ButtonTrigger"):
-                continue
-            if edge["target"] == node_id and edge["targetHandle"] == field:
-                source_node_id = edge["source"]
-                source_handle_id = edge["sourceHandle"]
-                break
-        else:
+        source = self.input_edge_map.get((node_id, field))
+        if source is None:
             return node.get_field(field).get("value", default)
 
+        source_node_id, source_handle_id = source
         source_node = self.get_node(source_node_id)
         if source_node is None:
             return default
         input_data = source_node.get_field(source_handle_id).get("value", default)
-        self.update_node_field_value(node_id, field, input_data)
+        self._set_node_field_value(node, field, input_data)
         return input_data
 
     def update_node_field_value(self, node_id: str, field: str, value):
         node = self.get_node(node_id)
         if node is None:
             return
+        self._set_node_field_value(node, field, value)
+
+    @staticmethod
+    def _set_node_field_value(node: Node, field: str, value):
         field_data = node.get_field(field)
         field_data.update({"value": value})
         node.update_field(field, field_data)
 
+    def get_node_slice(self, node_id: str) -> dict:
+        """
+        只包含该节点、连接到它输入字段的上游节点和对应连线的工作流数据，
+        用于把节点发送到其他进程执行，避免传输整个工作流。
+        Workflow data holding only the node, the upstream nodes wired to its inputs and those
+        edges. Used to send a node to another process without pickling the whole workflow.
+        """
+        skipped_keys = (
+            "nodes",
+            "edges",
+            "original_workflow_data",
+            "related_workflows",
+            "completed_nodes",
+            "node_run_time",
+            "memoized_nodes",
+            "trace",
+        )
+        workflow_slice = {key: value for key, value in self.workflow_data.items() if key not in skipped_keys}
+        # 子进程中不需要原始数据，提供空值避免 Workflow 初始化时深拷贝
+        workflow_slice["original_workflow_data"] = {}
+
+        node_ids = [node_id]
+        edges = []
+        for (target, target_handle), (source, source_handle) in self.input_edge_map.items():
+            if target != node_id:
+                continue
+            if source not in node_ids:
+                node_ids.append(source)
+            edges.append(
+                {"source": source, "sourceHandle": source_handle, "target": target, "targetHandle": target_handle}
+            )
+        workflow_slice["nodes"] = [self.nodes[_node_id].data for _node_id in node_ids if _node_id in self.nodes]
+        workflow_slice["edges"] = edges
+        return workflow_slice
+
+    def merge_node_result(self, node_id: str, result_data: dict):
+        """
+        把在其他进程中执行的节点结果合并回当前工作流。
+        Merge the result of a node executed in another process back into this workflow.
+        """
+        node = self.get_node(node_id)
+        if node is None:
+            return
+        for result_node in result_data.get("nodes", []):
+            if result_node["id"] != node_id:
+                continue
+            for field, field_data in result_node["data"]["template"].items():
+                node.update_field(field, field_data)
+            if "status" in result_node["data"]:
+                node.status = result_node["data"]["status"]
+            break
+        for key in ("node_run_time", "memoized_nodes"):
+            value = result_data.get(key, {}).get(node_id)
+            if value is not None:
+                self.workflow_data.setdefault(key, {})[node_id] = value
+        self.workflow_data.setdefault("trace", []).extend(result_data.get("trace", []))
+
     def get_node_field_value_by_key(self, node_id: str, field: str, key: str, default: Any | None = None) -> Any:
         node = self.get_node(node_id)
         if node is None:
@@ -443,8 +456,10 @@ class Workflow:
             workflow_record = WorkflowRunRecord.get(WorkflowRunRecord.rid == self.record_id)
 
             workflow_record.status = "FINISHED" if status == 200 else "FAILED"
+            # trace 单独保存，不放在运行数据中
+            workflow_record.trace = self.workflow_data.pop("trace", [])
             workflow_record.data = self.workflow_data
-            workflow_record.data["error_task"] = error_task if not error_task.endswith("batch_tasks") else ""
+            workflow_record.data["error_task"] = error_task
             workflow_record.end_time = datetime.now()
 
             if workflow_record.run_from == WorkflowRunRecord.RunFromTypes.CHAT:
@@ -467,11 +482,17 @@ class Workflow:
                     source_message.save()
 
             workflow_record.save()
-            return True
         except Exception as e:
             mprint.error(f"report_workflow_status failed: {e}")
             return False
 
+        for listener in workflow_finished_listeners:
+            try:
+                listener(self.record_id)
+            except Exception as e:
+                mprint.error(f"workflow finished listener failed: {e}")
+        return True
+
     def set_node_status(
         self,
         node_id: str,
@@ -560,6 +581,22 @@ class Workflow:
         async_task: dict = self.workflow_data.get("async_tasks", {}).get(node_id, {})
         return async_task.get("data", None)
 
+    def mark_node_completed(self, node_id: str):
+        """
+        记录节点已完成。重试时工作流数据会整体重新入队，已完成的节点不需要再次执行。
+        Checkpoint a finished node so a retried run does not execute it again.
+        """
+        completed_nodes = self.workflow_data.setdefault("completed_nodes", [])
+        if node_id not in completed_nodes:
+            completed_nodes.append(node_id)
+
+    def is_node_completed(self, node_id: str) -> bool:
+        return node_id in self.workflow_data.get("completed_nodes", [])
+
+    @property
+    def completed_nodes(self) -> list[str]:
+        return self.workflow_data.get("completed_nodes", [])
+
     @property
     def has_async_task_timeout(self):
         async_tasks = self.workflow_data.get("async_tasks", {})
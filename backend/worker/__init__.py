@@ -3,184 +3,76 @@
 # @Date:   2023-05-15 16:56:55
 # @Last Modified by:   Bi Ying
 # @Last Modified time: 2024-08-07 18:02:57
+import os
 import time
-import uuid
-import inspect
 import traceback
-import threading
+import multiprocessing
 from pathlib import Path
 from threading import Thread, Lock
+from concurrent.futures import ProcessPoolExecutor
 
-from diskcache import Deque, Cache
-
-from utilities.config import config
-from utilities.workflow import Workflow
-from utilities.general import mprint_with_name
-from worker.tasks import chain, on_finish, TaskError, TaskRetry, task
-from worker.tasks import (
-    llms,
-    tools,
-    output,
-    triggers,
-    vector_db,
-    web_crawlers,
-    media_editing,
-    relational_db,
-    control_flows,
-    file_processing,
-    text_processing,
-    image_generation,
-    media_processing,
-)
-from worker.types import Task
+from models import WorkflowRunRecord
+from utilities.config import config, cache
+from utilities.workflow import Workflow, ContinuationStore, workflow_finished_listeners, open_workflow_queue
+from utilities.workflow import add_span, trace_span
+from utilities.general import DelayedTaskQueue, mprint_with_name
+from worker.tasks import graph, on_finish, TaskError, TaskRetry
+# 任务模块在第一次运行其中的任务时才导入，见 worker.tasks.registry
+# Task modules are imported the first time one of their tasks runs, see worker.tasks.registry
+from worker.tasks.registry import task_functions
 
 
 mprint = mprint_with_name(name="Workflow Task Server")
 
-task_functions = {}
-task_modules = [
-    llms,
-    tools,
-    output,
-    triggers,
-    vector_db,
-    web_crawlers,
-    media_editing,
-    relational_db,
-    control_flows,
-    file_processing,
-    text_processing,
-    image_generation,
-    media_processing,
-]
-for module in task_modules:
-    functions = {}
-    module_name = module.__name__.split(".")[-1]
-    for name, obj in inspect.getmembers(module):
-        if (
-            callable(obj)
-            and not inspect.isclass(obj)
-            and not inspect.ismethod(obj)
-            and obj.__class__.__name__ == "Task"
-        ):
-            functions[name] = obj
-    task_functions[module_name] = functions
-
-
-@task
-def merge_results(workflow_data_list: list, node_ids: list):
-    """Merge results from multiple workflows.
-
-    Args:
-        workflow_data_list (list): _description_
-        node_ids (list): _description_
-
-    Returns:
-        _type_: merged workflow data
-    """
-    merged_data = Workflow(workflow_data_list[0]).data
-    for workflow_data, node_id in zip(workflow_data_list[1:], node_ids[1:]):
-        current_workflow = Workflow(workflow_data)
-        merged_workflow = Workflow(merged_data)
-        node = current_workflow.get_node(node_id=node_id)
-        if node is None:
-            continue
-        node_fields = current_workflow.get_node_fields(node_id=node_id)
-        for field in node_fields:
-            field_value = current_workflow.get_node_field_value(node_id=node_id, field=field)
-            merged_workflow.update_node_field_value(node_id=node_id, field=field, value=field_value)
-        merged_data = merged_workflow.data
-    return merged_data
-
-
-@task
-def batch_tasks(workflow_data: dict, tasks: list[Task]):
-    """手动构造的并发运行任务
-
-    Args:
-        workflow_data (dict): 上一个节点传入的 workflow data
-        tasks (list): 任务列表，格式如下
-            [
-                {"node_id": "fbe608e8-853e-4a8b-a9de-e07071f6e058", "task_name": "llms.chat_glm"},
-                {"node_id": "6c18de8a-78f9-4124-af57-634b6440a1d1", "task_name": "llms.moonshot"},
-                {"node_id": "ed1bbd53-d9b6-4176-aa1c-09e040bbcffd", "task_name": "llms.open_ai"},
-            ],
-    Returns:
-        _type_: merged workflow data
-    """
-    results = {}
-    threads = []
-    has_failed_task = False
-    error_tasks = []
-    result_lock = threading.Lock()
-
-    def run_task(task: Task):
-        nonlocal has_failed_task
-        module, function = task["task_name"].split(".")
-        # 执行任务并获取结果
-        try:
-            task_result = task_functions[module][function](workflow_data, task["node_id"])
-            # 使用锁来确保结果合并时的线程安全
-            with result_lock:
-                results[task["node_id"]] = task_result
-        except Exception as e:
-            has_failed_task = True
-            with result_lock:
-                error_tasks.append(task)
-            mprint.error(f"Error in task {task['task_name']} -> {task['node_id']}: {e}")
-            mprint.error(traceback.format_exc())
-            workflow = Workflow(workflow_data)
-            workflow.report_workflow_status(500, task["task_name"])
-
-        return None
-
-    # 为每个任务创建一个守护线程
-    for task_item in tasks:
-        thread = threading.Thread(target=run_task, args=(task_item,), daemon=True)
-        threads.append(thread)
-        thread.start()
-
-    # 等待所有线程完成或任何一个任务失败
-    while True:
-        if has_failed_task:
-            break
-        all_threads_finished = True
-        for thread in threads:
-            if thread.is_alive():
-                all_threads_finished = False
-                break
-        if all_threads_finished:
-            break
-        time.sleep(0.1)
-
-    if has_failed_task:
-        mprint.error(error_tasks)
-        raise Exception("Some tasks failed")
-
-    sorted_task_results = [results[task["node_id"]] for task in tasks]
-    merged_result = merge_results(sorted_task_results, [task["node_id"] for task in tasks])
-    return merged_result
-
 
 class WorkflowServer:
-    def __init__(self, cache_dir: str | Path | None = None, num_workers: int = 2):
+    def __init__(
+        self,
+        cache_dir: str | Path | None = None,
+        num_workers: int | None = None,
+        num_node_workers: int | None = None,
+        num_process_workers: int | None = None,
+    ):
         if cache_dir is None:
             cache_dir = Path(config.data_path) / "cache"
         self.cache_dir = Path(cache_dir)
         self.workflow_tasks_queue_directory = self.cache_dir / "workflow_task"
-        self.num_workers = num_workers
+        # 同时运行的工作流数量
+        self.num_workers: int = num_workers or config.get("workflow.num_workers", 2)
+        # 每个工作流运行时并发执行节点的线程数
+        self.num_node_workers: int = num_node_workers or config.get("workflow.num_node_workers", 8)
+        # 执行 CPU 密集型节点的进程数，0 表示不使用进程池
+        if num_process_workers is None:
+            num_process_workers = config.get("workflow.num_process_workers")
+        if num_process_workers is None:
+            num_process_workers = os.cpu_count() or 1
+        self.num_process_workers: int = num_process_workers
+        self.process_pool: ProcessPoolExecutor | None = None
+        self.process_pool_lock = Lock()
         self.threads = []
         self.shutdown_event = False
 
-        # 主任务队列
-        self.main_queue = Deque(directory=self.workflow_tasks_queue_directory)
+        # 主任务队列，按通道加权轮询取出任务，见 utilities.workflow.run_queue
+        self.main_queue = open_workflow_queue(self.workflow_tasks_queue_directory)
 
         # 延迟任务队列
         self.delayed_tasks_directory = self.cache_dir / "delayed_tasks"
-        self.delayed_tasks_cache = Cache(directory=self.delayed_tasks_directory)
-        self.delayed_tasks_lock = Lock()
+        self.delayed_tasks = DelayedTaskQueue(self.delayed_tasks_directory)
+
+        # 挂起中的工作流状态，队列中只保存引用
+        self.continuations = ContinuationStore(self.cache_dir / "continuations")
+
+        # 子工作流结束时唤醒等待它的父工作流
+        workflow_finished_listeners.append(self.wake_waiting_workflow)
 
     def start(self):
+        if self.num_process_workers > 0:
+            self.process_pool = self.create_process_pool()
+
+        # 在后台提前导入任务模块，第一次运行工作流时不必等待导入
+        if config.get("workflow.warm_up_task_modules", False):
+            task_functions.warm_up()
+
         # 启动 worker 线程
         for index in range(self.num_workers):
             thread = Thread(target=self.run, args=(index,), daemon=True)
@@ -199,90 +91,198 @@ class WorkflowServer:
             if thread and thread.is_alive():
                 thread.join()
         self.threads = []
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = None
+
+    def create_process_pool(self) -> ProcessPoolExecutor:
+        # 使用 spawn 避免在多线程进程中 fork
+        return ProcessPoolExecutor(
+            max_workers=self.num_process_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def replace_broken_process_pool(self, broken_pool: ProcessPoolExecutor):
+        """
+        子进程崩溃后进程池中所有未完成和之后提交的任务都会失败，重新创建进程池。
+        多个运行同时发现时只替换一次，停止过程中不再创建。
+        After a child process dies, every pending and later submission to the pool fails, so recreate it.
+        When several runs notice at once it is replaced only once, and never while stopping.
+        """
+        with self.process_pool_lock:
+            if self.process_pool is not broken_pool or self.shutdown_event:
+                return
+            mprint.error("Process pool is broken, creating a new one.")
+            broken_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = self.create_process_pool()
 
     def scheduler(self):
         mprint("Scheduler thread started.")
         while not self.shutdown_event:
             try:
-                current_time = time.time()
-                with self.delayed_tasks_lock:
-                    keys = sorted(self.delayed_tasks_cache.iterkeys())
-                    for key in keys:
-                        try:
-                            scheduled_time_str, task_id = str(key).split("_", 1)
-                            scheduled_time = float(scheduled_time_str)
-                            if scheduled_time <= current_time:
-                                task_data = self.delayed_tasks_cache.pop(key)
-                                self.main_queue.append(task_data)
-                                mprint(f"Task {task_id} moved from delayed queue to main queue.")
-                            else:
-                                # 由于 keys 是排序的，一旦遇到未来的任务，可以停止检查
-                                break
-                        except Exception as e:
-                            mprint.error(f"Error processing delayed task key {key}: {e}")
-                time.sleep(0.5)
+                # 睡眠到最早的延迟任务到期，有更早的任务加入时会被提前唤醒
+                for task_id, task_data in self.delayed_tasks.get_due(timeout=1):
+                    self.requeue(task_data)
+                    mprint(f"Task {task_id} moved from delayed queue to main queue.")
             except Exception:
                 mprint.error(f"Scheduler error: {traceback.format_exc()}")
                 time.sleep(1)
         mprint("Scheduler thread stopped.")
 
+    def requeue(self, task_data: dict):
+        """
+        重试或被唤醒的任务放回原通道的队首，已经开始的运行优先于同通道中新的运行。
+        Put a retried or woken task at the front of its own lane, ahead of new runs of that lane.
+        """
+        queue_route = task_data.get("queue_route") or {}
+        self.main_queue.put_front(task_data, lane=queue_route.get("lane"), source=queue_route.get("source"))
+
     def schedule_retry(self, task_data: dict, retry_delay: int):
-        scheduled_time = time.time() + retry_delay
-        task_id = uuid.uuid4().hex
-        key = f"{scheduled_time:.6f}_{task_id}"
-        with self.delayed_tasks_lock:
-            self.delayed_tasks_cache[key] = task_data
+        task_id, scheduled_time = self.delayed_tasks.put(self.continuations.park(task_data) or task_data, retry_delay)
         mprint(
             f"Scheduled task {task_id} to retry at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(scheduled_time))}."
         )
 
+    def park(self, task_data: dict, wait_for: list[str], timeout: int):
+        """
+        挂起等待子工作流的父工作流。任务数据放在延迟队列中，timeout 秒后兜底重试；
+        任意一个子工作流结束时由 wake_waiting_workflow 提前唤醒。
+        Park a parent workflow waiting for child runs. It sits in the delayed queue with
+        timeout as a fallback and is woken early by wake_waiting_workflow when any child finishes.
+        """
+        task_id, _ = self.delayed_tasks.put(self.continuations.park(task_data) or task_data, timeout)
+        for record_id in wait_for:
+            cache.set(f"workflow:record:{record_id}:waiting_task", task_id, expire=60 * 60 * 24)
+        mprint(f"Parked task {task_id} waiting for {len(wait_for)} workflow runs.")
+
+        # 子工作流可能在登记之前就已经结束，这种情况下没有通知，需要立即唤醒
+        # A child may have finished before registration and its notification was missed
+        for record_id in wait_for:
+            if cache.get(f"workflow:record:{record_id}:finished"):
+                self.wake_waiting_workflow(record_id)
+                break
+
+    def wake_waiting_workflow(self, record_id: str):
+        cache.set(f"workflow:record:{record_id}:finished", True, expire=60 * 60)
+        task_id = cache.pop(f"workflow:record:{record_id}:waiting_task", default=None)
+        if task_id is None:
+            return
+        task_data = self.delayed_tasks.wake(task_id)
+        if task_data is None:
+            return
+        self.requeue(task_data)
+        mprint(f"Task {task_id} woken up by finished workflow run {record_id}.")
+
+    @staticmethod
+    def fail_lost_continuation(record_id: str):
+        """
+        挂起的状态丢失时无法继续运行，把运行记录标记为失败，并通知等待它的父工作流。
+        Runs whose parked state is lost cannot continue; mark the record as failed and wake waiting parents.
+        """
+        try:
+            # 保留运行记录中原有的工作流数据
+            workflow_data = dict(WorkflowRunRecord.get(WorkflowRunRecord.rid == record_id).data)
+            workflow = Workflow({**workflow_data, "rid": record_id})
+        except Exception:
+            workflow = Workflow({"rid": record_id, "nodes": [], "edges": []})
+        workflow.report_workflow_status(500)
+
+    @staticmethod
+    def trace_queue_wait(task_data: dict):
+        """
+        记录从入队（新运行、重试或等待子工作流）到被 worker 取出的耗时。
+        Record the time from being queued (new run, retry or waiting for child runs) until a worker picks it up.
+        """
+        queued_at = task_data.pop("queued_at", None)
+        queued_reason = task_data.pop("queued_reason", "queue")
+        if queued_at is not None:
+            add_span(task_data, queued_reason, queued_at, time.time(), category="queue", node_id=task_data.get("node_id"))
+
     def run_task(self, task_data: dict):
+        # 重试时 task_data 中带有请求重试的节点 ID，已完成的节点记录在 completed_nodes 中，
+        # 这些节点会被跳过，只从重试的节点继续执行
+        # On retry, task_data carries the node that asked to retry; checkpointed nodes are skipped
+        retry_node_id = task_data.pop("node_id", None)
         workflow = Workflow(task_data)
+        if retry_node_id is not None:
+            mprint(
+                f"Resuming workflow {workflow.record_id} at node {retry_node_id}, "
+                f"{len(workflow.completed_nodes)} completed nodes skipped."
+            )
 
-        tasks = workflow.get_layer_sorted_task_order()
-        func_list = []
-        for task_item in tasks:
-            if isinstance(task_item, list):  # 如果当前任务是一个列表，则并行执行里面的任务
-                group_tasks = batch_tasks.s(task_item)
-                func_list.append(group_tasks)
-            else:  # 如果当前任务是一个字典，则表示它是一个单一任务
-                # 检查是否是链中的第一个任务
-                module, function = task_item["task_name"].split(".")
-                func_list.append(task_functions[module][function].s(task_item["node_id"]))
-        task_chain = chain(*func_list, on_finish.s())
-        task_chain(workflow.data)
+        # 每个节点在其所有父节点完成后立即执行，不再按层等待
+        node_tasks = {}
+        for node_id in workflow.dag.get_all_nodes():
+            node = workflow.get_node(node_id)
+            if node is None:
+                continue
+            try:
+                node_task = task_functions.get_task(node.task_name)
+            except ImportError as e:
+                # 任务模块延迟导入，缺少依赖时在这里才会发现，按任务出错处理以便更新运行记录
+                # Task modules are imported lazily, so a missing dependency surfaces here; report it
+                # as a task error so that the run record gets updated
+                raise TaskError(f"Failed to load task module: {e}", node.task_name) from e
+            node_tasks[node_id] = node_task.s(node_id)
+        process_pool = self.process_pool
+        task_graph = graph(workflow.dag, node_tasks, max_workers=self.num_node_workers, process_pool=process_pool)
+        try:
+            with trace_span(workflow.data, "run", category="run", resume_node_id=retry_node_id):
+                task_graph(workflow.data, workflow=workflow)
+        finally:
+            # 本次运行按任务出错处理，之后的运行使用新的进程池
+            if task_graph.process_pool_broken and process_pool is not None:
+                self.replace_broken_process_pool(process_pool)
+        on_finish(workflow.data)
 
     def run(self, worker_index: int):
         mprint(f"Worker {worker_index} started.")
-        task_data = dict()
         while not self.shutdown_event:
+            # 每次循环重置，出错时不会误删上一个（可能已挂起的）运行的状态
+            task_data = dict()
             try:
-                if len(self.main_queue) > 0:
-                    task_data = self.main_queue.pop()
-                    if not isinstance(task_data, dict):
+                # 阻塞等待新任务，超时后重新检查是否需要停止
+                task_data = self.main_queue.get(timeout=1)
+                if not isinstance(task_data, dict):
+                    continue
+                if ContinuationStore.is_reference(task_data):
+                    reference = task_data
+                    task_data = self.continuations.resume(reference)
+                    if task_data is None:
+                        mprint.error(f"Continuation of workflow run {reference['continuation']} not found.")
+                        self.fail_lost_continuation(reference["continuation"])
                         continue
-                    mprint(f"Worker {worker_index} received workflow request.")
-                    self.run_task(task_data)
-                    mprint(f"Worker {worker_index} finished workflow request.")
-                else:
-                    time.sleep(1)
+                self.trace_queue_wait(task_data)
+                mprint(f"Worker {worker_index} received workflow request.")
+                self.run_task(task_data)
+                self.continuations.delete(task_data.get("rid", ""))
+                mprint(f"Worker {worker_index} finished workflow request.")
             except TaskRetry as e:
-                mprint.error(f"Scheduling retry for task function: {e.func_name}")
-                self.schedule_retry(e.task, e.retry_delay)
+                e.task["queued_at"] = time.time()
+                e.task["queued_reason"] = "wait" if e.wait_for else "retry"
+                if e.wait_for:
+                    self.park(e.task, e.wait_for, e.retry_delay)
+                else:
+                    mprint.error(f"Scheduling retry for task function: {e.func_name}")
+                    self.schedule_retry(e.task, e.retry_delay)
             except TaskError as e:
                 mprint.error(traceback.format_exc())
                 mprint.error(f"workflow worker error: {e}")
-                for module_name, functions in task_functions.items():
-                    if e.task_name in functions:
-                        mprint.error(f"error_module: {module_name}")
-                        break
+                # 加载失败时 task_name 已经是 "模块名.函数名"
+                module_name, _, function_name = e.task_name.rpartition(".")
+                module_name = module_name or task_functions.find_module(function_name)
+                if module_name is not None:
+                    mprint.error(f"error_module: {module_name}")
                 else:
                     module_name = "unknown"
                     mprint.error(f"Unknown error: {e.task_name}")
                 assert isinstance(task_data, dict)
                 if workflow := Workflow(task_data):
-                    workflow.report_workflow_status(500, f"{module_name}.{e.task_name}")
+                    workflow.report_workflow_status(500, f"{module_name}.{function_name}")
+                self.continuations.delete(task_data.get("rid", ""))
             except Exception:
                 mprint.error(f"Unexpected error: {traceback.format_exc()}")
+                # 运行已经失败，不再保留它的挂起状态
+                if isinstance(task_data, dict):
+                    self.continuations.delete(task_data.get("rid") or task_data.get("continuation") or "")
                 time.sleep(1)
         mprint("Stopped.")
@@ -3,11 +3,22 @@
 # @Date:   2023-04-13 15:43:01
 # @Last Modified by:   Bi Ying
 # @Last Modified time: 2024-06-15 14:32:42
+import json
 import time
+import hashlib
+import importlib
+import traceback
+from pathlib import Path
 from functools import wraps
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from concurrent.futures import Executor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from typing import Callable, TypeVar, Optional, overload, Any, Union
 
-from utilities.workflow import Workflow
+from diskcache import Cache
+
+from utilities.config import config
+from utilities.workflow import DAG, Workflow, Node, add_span, trace_span
 from utilities.general import mprint_with_name
 
 
@@ -16,32 +27,177 @@ mprint = mprint_with_name(name="Workflow Task Server")
 
 F = TypeVar("F", bound=Callable[..., Any])
 
+_node_result_cache: Cache | None = None
+
+
+def get_node_result_cache() -> Cache:
+    """
+    节点结果缓存，磁盘占用超过上限后淘汰最久未使用的结果。
+    On-disk cache of node results, evicting the least recently used ones past the size limit.
+    """
+    global _node_result_cache
+    if _node_result_cache is None:
+        _node_result_cache = Cache(
+            directory=Path(config.data_path) / "cache" / "node_results",
+            size_limit=config.get("workflow.node_result_cache_size_limit", 256 * 1024 * 1024),
+            eviction_policy="least-recently-used",
+        )
+    return _node_result_cache
+
 
 class TaskError(Exception):
     def __init__(self, message, task_name):
         super().__init__(message)
         self.task_name = task_name
 
+    def __reduce__(self):
+        # 默认的 pickle 只用 args 重建异常，缺少 task_name，从子进程传回时会反序列化失败
+        return (TaskError, (str(self), self.task_name))
+
 
 class TaskRetry(Exception):
-    def __init__(self, func_name: str, task: dict, retry_delay: int):
+    def __init__(self, func_name: str, task: dict, retry_delay: int, wait_for: list[str] | None = None):
         super().__init__("Task needs to be retried")
         self.func_name = func_name
         self.task = task  # 任务数据
         self.retry_delay = retry_delay  # 重试延迟时间（秒）
+        # 等待的子工作流运行记录 ID，任意一个结束时立即重试，retry_delay 作为超时时间
+        self.wait_for = wait_for or []
+
+    def __reduce__(self):
+        return (TaskRetry, (self.func_name, self.task, self.retry_delay, self.wait_for))
+
+    @staticmethod
+    def combine(first: "TaskRetry", second: "TaskRetry") -> "TaskRetry":
+        """
+        合并同一次运行中多个节点的重试请求：有普通重试时按最短的延迟重试，
+        都在等待子工作流时合并等待列表。
+        Combine retry requests of several nodes in one run: a plain retry wins with the
+        shortest delay, otherwise the waited child runs are merged.
+        """
+        retry_delay = min(first.retry_delay, second.retry_delay)
+        if not first.wait_for or not second.wait_for:
+            wait_for = []
+        else:
+            wait_for = first.wait_for + [rid for rid in second.wait_for if rid not in first.wait_for]
+        return TaskRetry(first.func_name, first.task, retry_delay, wait_for=wait_for)
+
+
+class ProcessTaskError(Exception):
+    """
+    进程池中任务抛出的异常。原异常不一定能 pickle（例如 __init__ 需要额外参数的用户自定义异常），
+    反序列化失败会使整个进程池不可用，因此在子进程中转换为只包含消息和堆栈文本的异常。
+    An exception raised by a task in the process pool. The original exception may not pickle (e.g. a
+    user-defined exception whose __init__ takes extra arguments), and failing to unpickle it would break
+    the whole pool, so the child converts it into one holding only the message and traceback text.
+    """
+
+    def __init__(self, message: str, traceback_text: str = ""):
+        super().__init__(message, traceback_text)
+        self.message = message
+        self.traceback_text = traceback_text
+
+    def __str__(self):
+        return self.message
 
 
 class Task:
-    def __init__(self, func: Callable, max_retries: int = 300, retry_delay: int = 1):
+    def __init__(
+        self,
+        func: Callable,
+        max_retries: int = 300,
+        retry_delay: int = 1,
+        cpu_bound: bool = False,
+        memoize: bool = False,
+    ):
         self.func: Callable = func
         self.func_name: str = func.__name__
+        self.module_name: str = func.__module__
         self.max_retries: int = max_retries
         self.retry_delay: int = retry_delay
         self.retry_count: int = 0
+        # CPU 密集型任务在进程池中执行，避免和其他线程争抢 GIL
+        self.cpu_bound: bool = cpu_bound
+        # 相同输入总是得到相同输出的任务，可以直接复用之前的结果
+        self.memoize: bool = memoize
 
     def __call__(self, *args, **kwargs):
+        if self.memoize:
+            return self.call_memoized(*args, **kwargs)
         return self.func(*args, **kwargs)
 
+    @staticmethod
+    def get_memoize_key(node: Node, input_values: dict) -> str:
+        """
+        以节点类型和输入字段值的稳定哈希作为缓存键。输入中的本地文件加入修改时间和大小，文件变化后不会命中旧结果。
+        The cache key is the node type plus a stable hash of the input values. Local files among the
+        inputs add their mtime and size so that a changed file does not hit a stale result.
+        """
+        files = {}
+        for value in input_values.values():
+            for item in value if isinstance(value, list) else [value]:
+                if not isinstance(item, str) or len(item) > 1024 or "\n" in item:
+                    continue
+                try:
+                    stat = Path(item).stat()
+                except (OSError, ValueError):
+                    continue
+                files[item] = [stat.st_mtime_ns, stat.st_size]
+
+        data = json.dumps([input_values, files], sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.blake2b(data.encode("utf8"), digest_size=16).hexdigest()
+        return f"{node.type}:{digest}"
+
+    def call_memoized(self, workflow_data: dict, node_id: str):
+        """
+        以解析后的输入字段值查找缓存，命中时直接写回缓存的字段值，否则执行任务并缓存执行后的全部字段值。
+        每个节点是否命中以及节省的时间记录在 workflow_data["memoized_nodes"] 中。
+        Look up the resolved input values in the cache. On a hit the cached field values are written
+        back, otherwise the task runs and all its field values are cached. Whether each node hit and
+        the time saved are recorded in workflow_data["memoized_nodes"].
+        """
+        workflow = Workflow(workflow_data)
+        node = workflow.get_node(node_id)
+        if node is None:
+            return self.func(workflow_data, node_id)
+
+        with workflow.activate():
+            start_time = time.time()
+            fields = workflow.get_node_fields(node_id)
+            # 上一次运行留下的输出值不计入缓存键
+            input_values = {
+                field: workflow.get_node_field_value(node_id, field)
+                for field in fields
+                if not workflow.is_node_field_output(node_id, field)
+                and field != "output"
+                and not field.startswith("output-")
+            }
+            key = self.get_memoize_key(node, input_values)
+            node_result_cache = get_node_result_cache()
+            cached_result = node_result_cache.get(key)
+            memoized_nodes = workflow_data.setdefault("memoized_nodes", {})
+
+            if isinstance(cached_result, dict):
+                for field, value in cached_result["fields"].items():
+                    workflow.update_node_field_value(node_id, field, value)
+                elapsed_time = time.time() - start_time
+                time_saved = max(cached_result["run_time"] - elapsed_time, 0)
+                memoized_nodes[node_id] = {"hit": True, "time_saved": time_saved}
+                workflow_data.setdefault("node_run_time", {})[node_id] = elapsed_time
+                mprint(f"<Node:{node_id}> Function {self.func_name} reused cached result, saved {time_saved} seconds.")
+                return workflow_data
+
+            result = self.func(workflow_data, node_id)
+            run_time = time.time() - start_time
+            result_node = Workflow(result).get_node(node_id) or node
+            cached_fields = {field: result_node.get_field(field).get("value") for field in fields}
+            try:
+                node_result_cache.set(key, {"fields": cached_fields, "run_time": run_time})
+            except Exception as e:
+                mprint.error(f"Failed to cache result of node {node_id}: {e}")
+            memoized_nodes[node_id] = {"hit": False, "time_saved": 0}
+            return result
+
     def s(self, *args, **kwargs):
         return (self, args, kwargs)
 
@@ -53,48 +209,210 @@ class Task:
         self.retry_count += 1
         raise TaskRetry(self.func_name, task_data, self.retry_delay)
 
+    def wait(self, workflow_data: dict, node_id: str, record_ids: list[str], timeout: int = 300):
+        """
+        挂起当前工作流，直到 record_ids 中任意一个子工作流运行结束后再重新执行该节点，
+        不再每秒轮询。timeout 秒后即使没有收到通知也会重新执行一次。
+        Park the workflow until any child run in record_ids finishes, then run this node again
+        instead of polling every second. The node also runs again after timeout seconds.
+        """
+        # 等待子工作流不计入重试次数
+        task_data = workflow_data.copy()
+        task_data["node_id"] = node_id
+        raise TaskRetry(self.func_name, task_data, timeout, wait_for=record_ids)
+
 
 @overload
 def task(func: Callable[..., Any]) -> Task: ...
 
 
 @overload
-def task(*, max_retries: int = 300, retry_delay: int = 1) -> Callable[[Callable[..., Any]], Task]: ...
+def task(
+    *, max_retries: int = 300, retry_delay: int = 1, cpu_bound: bool = False, memoize: bool = False
+) -> Callable[[Callable[..., Any]], Task]: ...
 
 
 def task(
-    func: Optional[F] = None, *, max_retries: int = 300, retry_delay: int = 1
+    func: Optional[F] = None,
+    *,
+    max_retries: int = 300,
+    retry_delay: int = 1,
+    cpu_bound: bool = False,
+    memoize: bool = False,
 ) -> Union[Task, Callable[[F], Task]]:
-    if func is None:
-        return lambda f: Task(f, max_retries=max_retries, retry_delay=retry_delay)
-    return Task(func, max_retries=max_retries, retry_delay=retry_delay)
-
+    def decorator(f: Callable[..., Any]) -> Task:
+        return Task(f, max_retries=max_retries, retry_delay=retry_delay, cpu_bound=cpu_bound, memoize=memoize)
 
-class Chain:
-    def __init__(self, *tasks):
-        self.tasks: tuple[tuple[Task, list, dict]] = tasks
-
-    def __call__(self, initial_data):
-        result = initial_data
-        for task, args, kwargs in self.tasks:
-            while True:
-                try:
-                    result = task(result, *args, **kwargs)
+    if func is None:
+        return decorator
+    return decorator(func)
+
+
+def run_task_in_process(module_name: str, func_name: str, workflow_data: dict, node_id: str):
+    """
+    进程池中执行任务的入口。Task 对象本身无法被 pickle，因此通过模块名和函数名重新获取。
+    Entry point for tasks run in the process pool. Task objects cannot be pickled, so the task
+    is looked up again by module and function name.
+    """
+    try:
+        module = importlib.import_module(module_name)
+        return getattr(module, func_name)(workflow_data, node_id)
+    except (TaskRetry, TaskError):
+        raise
+    except Exception as e:
+        raise ProcessTaskError(f"{type(e).__name__}: {e}", traceback.format_exc()) from None
+
+
+class TaskGraph:
+    """
+    按依赖关系调度节点任务：一个节点的所有父节点完成后立即提交到有界线程池执行，
+    不再按层等待同一层中最慢的节点。
+    Schedule node tasks by dependency: a node is submitted to a bounded thread pool as soon as
+    all of its parents finish, instead of waiting for the slowest node of its layer.
+    """
+
+    def __init__(
+        self,
+        dag: DAG,
+        node_tasks: dict[str, tuple[Task, tuple, dict]],
+        max_workers: int = 8,
+        process_pool: Executor | None = None,
+    ):
+        self.dag = dag
+        self.node_tasks = node_tasks
+        self.max_workers = max_workers
+        # 传入进程池时，cpu_bound 的任务只把节点及其上游节点发送到子进程执行，结果再合并回来
+        self.process_pool = process_pool
+        # 子进程异常退出后进程池不可再用，由调用方重新创建
+        self.process_pool_broken = False
+
+    def __call__(self, initial_data, workflow: Workflow | None = None):
+        if workflow is None:
+            return self.run(initial_data)
+        with workflow.activate():
+            return self.run(initial_data, workflow)
+
+    def run(self, initial_data, workflow: Workflow | None = None):
+        """
+        传入 workflow 时，节点完成后会记录到 workflow 的 completed_nodes 中，
+        已记录完成的节点（例如重试前已经执行过的节点）直接跳过。
+        When a workflow is given, finished nodes are checkpointed into it and nodes that are
+        already checkpointed (e.g. finished before a retry) are skipped.
+        """
+        in_degree = self.dag.get_in_degrees()
+        ready = deque(node_id for node_id, degree in in_degree.items() if degree == 0)
+        running: dict[Future, str] = {}
+        # 在进程池中执行的节点及其提交时间
+        process_nodes: dict[str, float] = {}
+        finished_count = 0
+        task_retry: TaskRetry | None = None
+        task_error: TaskError | None = None
+
+        def finish_node(node_id: str):
+            nonlocal finished_count
+            finished_count += 1
+            for child in self.dag.get_children(node_id):
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    ready.append(child)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="workflow-node") as executor:
+            while ready or running:
+                # 出现重试或错误后不再提交新节点，只等待正在运行的节点结束
+                while ready and task_retry is None and task_error is None:
+                    node_id = ready.popleft()
+                    if node_id not in self.node_tasks:
+                        # DAG 中没有对应任务的节点（例如已被删除的节点），直接视为完成
+                        finish_node(node_id)
+                        continue
+                    if workflow is not None and workflow.is_node_completed(node_id):
+                        finish_node(node_id)
+                        continue
+                    task, args, kwargs = self.node_tasks[node_id]
+                    if task.cpu_bound and self.process_pool is not None and workflow is not None:
+                        try:
+                            future = self.process_pool.submit(
+                                run_task_in_process,
+                                task.module_name,
+                                task.func_name,
+                                workflow.get_node_slice(node_id),
+                                node_id,
+                            )
+                        except BrokenProcessPool as e:
+                            self.process_pool_broken = True
+                            task_error = TaskError(f"Process pool is broken: {e}", task.func_name)
+                            continue
+                        process_nodes[node_id] = time.time()
+                    else:
+                        future = executor.submit(self.run_node, task, initial_data, node_id, args, kwargs)
+                    running[future] = node_id
+
+                if not running:
                     break
-                except TaskRetry as e:
-                    if task.retry_count >= task.max_retries:
-                        raise TaskError("Max retries exceeded", task.func.__name__)
-                    mprint(
-                        f"Retrying task {task.func.__name__}. Attempt {task.retry_count}/{task.max_retries} after {e.retry_delay} seconds."
-                    )
-                    raise e  # 将 TaskRetry 异常抛出，交由外部调度
-                except Exception as e:
-                    raise TaskError(str(e), task.func.__name__)
-        return result
-
 
-def chain(*tasks):
-    return Chain(*tasks)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node_id = running.pop(future)
+                    task = self.node_tasks[node_id][0]
+                    if node_id in process_nodes:
+                        # 进程池中的节点从提交开始计时，包含传输数据的耗时
+                        add_span(
+                            initial_data, task.func_name, process_nodes[node_id], time.time(), node_id=node_id, process=True
+                        )
+                    try:
+                        result = future.result()
+                        if node_id in process_nodes and workflow is not None:
+                            workflow.merge_node_result(node_id, result)
+                    except TaskRetry as e:
+                        if task.retry_count >= task.max_retries:
+                            task_error = task_error or TaskError("Max retries exceeded", task.func_name)
+                            continue
+                        mprint(
+                            f"Retrying task {task.func_name}. Attempt {task.retry_count}/{task.max_retries} after {e.retry_delay} seconds."
+                        )
+                        task_retry = e if task_retry is None else TaskRetry.combine(task_retry, e)
+                    except BrokenProcessPool as e:
+                        # 子进程崩溃或调用了 os._exit，只让本次运行失败
+                        self.process_pool_broken = True
+                        mprint.error(f"Process pool broken while running {task.func_name} -> {node_id}: {e}")
+                        task_error = task_error or TaskError(f"Process pool is broken: {e}", task.func_name)
+                    except ProcessTaskError as e:
+                        mprint.error(f"Error in task {task.func_name} -> {node_id}: {e}\n{e.traceback_text}")
+                        task_error = task_error or TaskError(str(e), task.func_name)
+                    except Exception as e:
+                        mprint.error(f"Error in task {task.func_name} -> {node_id}: {e}")
+                        task_error = task_error or TaskError(str(e), task.func_name)
+                    else:
+                        if workflow is not None:
+                            workflow.mark_node_completed(node_id)
+                        finish_node(node_id)
+
+        if task_error is not None:
+            raise task_error
+        if task_retry is not None:
+            # 重新生成重试数据，以包含等待期间其他节点写入的结果
+            # Rebuild the retry payload so it includes results written by nodes that were still running
+            task_data = initial_data.copy()
+            task_data["node_id"] = task_retry.task.get("node_id")
+            raise TaskRetry(task_retry.func_name, task_data, task_retry.retry_delay, wait_for=task_retry.wait_for)
+        if finished_count != len(in_degree):
+            raise ValueError("The graph contains cycles")
+        return initial_data
+
+    @staticmethod
+    def run_node(task: Task, initial_data, node_id: str, args: tuple, kwargs: dict):
+        # 在线程中开始执行时才计时，不包含等待空闲线程的时间；重试或出错时记录异常类型
+        with trace_span(initial_data, task.func_name, node_id=node_id):
+            return task(initial_data, *args, **kwargs)
+
+
+def graph(
+    dag: DAG,
+    node_tasks: dict[str, tuple[Task, tuple, dict]],
+    max_workers: int = 8,
+    process_pool: Executor | None = None,
+):
+    return TaskGraph(dag, node_tasks, max_workers=max_workers, process_pool=process_pool)
 
 
 def timer(func):
@@ -110,16 +428,39 @@ def timer(func):
             node_id = kwargs.get("node_id")
         mprint(f"<Node:{node_id}> Function {func.__name__} took {elapsed_time} seconds to run.")
         if node_id is not None and isinstance(result, dict):
-            if "node_run_time" not in result:
-                result["node_run_time"] = {}
-            result["node_run_time"][node_id] = elapsed_time
+            # 同一次运行中的节点可能并发执行，共享同一个 result
+            result.setdefault("node_run_time", {})[node_id] = elapsed_time
         return result
 
     return wrapper
 
 
+def list_errors_mode(workflow: Workflow, node_id: str) -> str:
+    """
+    节点对列表输入逐项处理时单项失败的处理方式，作为 map_list 的 errors 参数。
+    节点开启 ignore_item_errors 时失败项输出空值，其他项照常输出；默认任意一项失败时节点失败。
+    How a node handling list inputs item by item treats a failed item, passed to map_list as errors.
+    With ignore_item_errors enabled a failed item outputs an empty value and the other items are kept;
+    by default the node fails when any item fails.
+    """
+    return "ignore" if workflow.get_node_field_value(node_id, "ignore_item_errors", False) else "raise"
+
+
+def report_memoization(workflow_data: dict):
+    memoized_nodes: dict = workflow_data.get("memoized_nodes", {})
+    if not memoized_nodes:
+        return
+    hits = sum(1 for node in memoized_nodes.values() if node["hit"])
+    time_saved = sum(node["time_saved"] for node in memoized_nodes.values())
+    mprint(
+        f"Workflow {workflow_data.get('rid', '')} node result cache: {hits}/{len(memoized_nodes)} hits "
+        f"({hits / len(memoized_nodes):.0%}), saved {time_saved:.3f} seconds."
+    )
+
+
 @task
 def on_finish(workflow_data: dict):
+    report_memoization(workflow_data)
     workflow = Workflow(workflow_data)
     workflow.clean_workflow_data()
     workflow.report_workflow_status(200)
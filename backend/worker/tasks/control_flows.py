@@ -5,6 +5,7 @@
 # @Last Modified time: 2024-04-29 19:29:46
 import re
 import json
+import time
 import random
 from typing import Any
 
@@ -14,6 +15,7 @@ from vectorvein.settings import settings as vectorvein_settings
 from vectorvein.types.llm_parameters import ChatCompletionMessage
 
 from worker.tasks import task, timer
+from worker.tasks.inline import InlineWorkflowPlan
 from utilities.config import Settings
 from utilities.workflow import Workflow
 from api.utils import run_workflow_common
@@ -103,7 +105,7 @@ def random_choice(
     return workflow.data
 
 
-@task
+@task(memoize=True)
 @timer
 def json_process(
     workflow_data: dict,
@@ -244,6 +246,7 @@ def workflow_loop(
         "judgement_model",
         "judgement_prompt",
         "judgement_end_output",
+        "inline_execution",
     ]
 
     assignment_in_loop = workflow.get_node_field_value(node_id, "assignment_in_loop")
@@ -255,11 +258,129 @@ def workflow_loop(
     judgement_model = workflow.get_node_field_value(node_id, "judgement_model")
     judgement_prompt = workflow.get_node_field_value(node_id, "judgement_prompt")
     judgement_end_output = workflow.get_node_field_value(node_id, "judgement_end_output")
+    # 默认每次循环通过队列运行一个子工作流并各自生成运行记录。开启 inline_execution 时在当前 worker 中
+    # 直接运行循环体，只写一条汇总记录，循环体中有需要挂起等待的节点时仍然通过队列运行
+    # By default every iteration runs as a queued child run with its own record. With inline_execution the
+    # loop body runs in this worker and writes one summary record; bodies with nodes that need to suspend
+    # still go through the queue
+    inline_execution = workflow.get_node_field_value(node_id, "inline_execution", False)
 
     used_credits = 0
     judgement_model_backend, judgement_model = judgement_model.split("⋄")
     max_loop_count = min(int(max_loop_count), 100)
 
+    def get_input_fields() -> dict[str, dict[str, Any]]:
+        input_fields: dict[str, dict[str, Any]] = {}
+        for field in workflow.get_node_fields(node_id):
+            if field not in internal_fields and not workflow.is_node_field_output(node_id, field):
+                field_original_node_id = workflow.get_node_field_value_by_key(node_id, field, "nodeId")
+                field_value = workflow.get_node_field_value(node_id, field)
+                input_fields.setdefault(field_original_node_id, {})[field] = field_value
+        return input_fields
+
+    def set_input_values(_workflow_data: dict, input_fields: dict[str, dict[str, Any]]):
+        for _node_id, node_fields in input_fields.items():
+            for original_node in _workflow_data["nodes"]:
+                if original_node["id"] == _node_id:
+                    break
+            else:
+                raise Exception("node not found")
+            for field_name, field_value in node_fields.items():
+                original_node["data"]["template"][field_name]["value"] = field_value
+
+    def update_output_fields(nodes: list[dict]):
+        for node in nodes:
+            for output_field, output_field_data in output_fields.items():
+                if node["id"] != output_field_data["node_id"]:
+                    continue
+                output_value = node["data"]["template"][output_field_data["output_field_key"]]["value"]
+                output_field_data["value"] = output_value
+                output_fields_cumulative[output_field].append(output_value)  # 添加新的输出值到累积列表
+
+        # 更新输出字段
+        for output_field, output_field_data in output_fields.items():
+            output_value = output_field_data["value"]
+            workflow.update_node_field_value(node_id, output_field, output_value)
+
+    def check_should_continue(loop_count: int) -> bool:
+        # 检查循环终止条件
+        should_continue = True
+        if loop_count >= max_loop_count:
+            should_continue = False
+        elif loop_end_condition == "output_field_condition":
+            condition_value = workflow.get_node_field_value(node_id, output_field_condition_field)
+            should_continue = not check_condition(
+                condition_value, output_field_condition_operator, output_field_condition_value
+            )
+        elif loop_end_condition == "ai_model_judgement":
+            prompt = render_template(judgement_prompt, output_fields)
+            ai_response = call_ai_model(judgement_model_backend, judgement_model, prompt)
+            ai_response_content = ai_response.content or ""
+            if ai_response_content.strip() == judgement_end_output.strip():
+                should_continue = False
+        return should_continue
+
+    def assign_loop_values(loop_count: int):
+        # 更新循环内赋值
+        for field, assignment in assignment_in_loop.items():
+            if assignment["source"] == "constant":
+                new_value = assignment["value"]
+            elif assignment["source"] == "input_field":
+                new_value = workflow.get_node_field_value(node_id, assignment["value"])
+            elif assignment["source"] == "output_field":
+                new_value = output_fields[assignment["value"]]["value"]
+            elif assignment["source"] == "output_field_cumulative":
+                new_value = "\n\n".join(map(str, output_fields_cumulative[assignment["value"]]))
+            elif assignment["source"] == "loop_count":
+                new_value = loop_count
+            else:
+                new_value = None
+
+            workflow.update_node_field_value(node_id, field, new_value)
+
+    def run_loop_inline(workflow_model: WorkflowModel, plan: InlineWorkflowPlan):
+        """
+        在当前 worker 中逐次运行循环体，只写入一条汇总的运行记录：最后一次迭代的数据、每次迭代的耗时以及全部 trace。
+        Run the loop body iteration by iteration in this worker and write a single summary run record:
+        the data of the last iteration, the time of each iteration and the traces of all of them.
+        """
+        _workflow_data = plan.workflow_data
+        _workflow_data["wid"] = workflow_model.wid.hex
+        record = WorkflowRunRecord.create(
+            workflow=workflow_model,
+            data=_workflow_data,
+            status="RUNNING",
+            run_from=WorkflowRunRecord.RunFromTypes.WORKFLOW,
+            workflow_version=workflow_model.version,
+        )
+        # 计划在运行时才复制数据，这里写入的 rid 对每次迭代都生效
+        _workflow_data["rid"] = record.rid.hex
+
+        loop_count = 1
+        iteration_times = []
+        trace = []
+        result = _workflow_data
+        try:
+            while True:
+                start_time = time.time()
+                result = plan.run(get_input_fields())
+                iteration_times.append(time.time() - start_time)
+                trace.extend(result.pop("trace", []))
+                update_output_fields(result["nodes"])
+                if not check_should_continue(loop_count):
+                    break
+                loop_count += 1
+                assign_loop_values(loop_count)
+        except Exception as e:
+            Workflow(result).report_workflow_status(500, getattr(e, "task_name", ""))
+            raise Exception("Run workflow failed!") from e
+
+        result["trace"] = trace
+        result["loop_summary"] = {"loop_count": loop_count, "iteration_times": iteration_times}
+        summary_workflow = Workflow(result)
+        summary_workflow.clean_workflow_data()
+        summary_workflow.report_workflow_status(200)
+
     async_task_data = workflow.get_async_task(node_id)
     if async_task_data is None:
         workflow_id = workflow.get_node_field_value(node_id, "workflow_id")
@@ -267,7 +388,6 @@ def workflow_loop(
             raise Exception("Can't invoke self!")
 
         fields = workflow.get_node_fields(node_id)
-        input_fields: dict[str, dict[str, Any]] = {}
         output_fields: dict[str, dict[str, Any]] = {}
         output_fields_cumulative: dict[str, list[str]] = {}
 
@@ -282,28 +402,21 @@ def workflow_loop(
                     "value": None,
                 }
                 output_fields_cumulative[field] = []
-                continue
-
-            field_original_node_id = workflow.get_node_field_value_by_key(node_id, field, "nodeId")
-            field_value = workflow.get_node_field_value(node_id, field)
-            input_fields.setdefault(field_original_node_id, {})[field] = field_value
 
         workflow_model = WorkflowModel.get(WorkflowModel.wid == workflow_id)
         _workflow_data = workflow_model.data
-        data = {"input_fields": input_fields}
-        for _node_id, node_fields in data["input_fields"].items():
-            for original_node in _workflow_data["nodes"]:
-                if original_node["id"] == _node_id:
-                    break
-            else:
-                raise Exception("node not found")
-            for field_name, field_value in node_fields.items():
-                original_node["data"]["template"][field_name]["value"] = field_value
+        set_input_values(_workflow_data, get_input_fields())
+
+        plan = InlineWorkflowPlan(_workflow_data) if inline_execution else None
+        if plan is not None and plan.can_run_inline:
+            run_loop_inline(workflow_model, plan)
+            return workflow.data
 
         record_rid = run_workflow_common(
             workflow_data=_workflow_data,
             workflow=workflow_model,
             run_from=WorkflowRunRecord.RunFromTypes.WORKFLOW,
+            parent_record_id=workflow.record_id,
         )
 
         workflow.add_async_task(
@@ -316,7 +429,7 @@ def workflow_loop(
                 "used_credits": 0,
             },
         )
-        workflow_loop.retry(workflow.data, node_id, retry_delay=1)
+        workflow_loop.wait(workflow.data, node_id, [record_rid])
     else:
         record_id = async_task_data["record_id"]
         output_fields = async_task_data["output_fields"]
@@ -325,86 +438,28 @@ def workflow_loop(
         used_credits = async_task_data["used_credits"]
         record = WorkflowRunRecord.select().join(WorkflowModel).where(WorkflowRunRecord.rid == record_id).first()
         if record.status in ("RUNNING", "QUEUED"):
-            workflow_loop.retry(workflow.data, node_id, retry_delay=1)
+            workflow_loop.wait(workflow.data, node_id, [record_id])
         elif record.status != "FINISHED":
             raise Exception("Run workflow failed!")
 
-        nodes = record.data["nodes"]
-        for node in nodes:
-            for output_field, output_field_data in output_fields.items():
-                if node["id"] != output_field_data["node_id"]:
-                    continue
-                output_value = node["data"]["template"][output_field_data["output_field_key"]]["value"]
-                output_field_data["value"] = output_value
-                output_fields_cumulative[output_field].append(output_value)  # 添加新的输出值到累积列表
+        update_output_fields(record.data["nodes"])
 
-        # 更新输出字段
-        for output_field, output_field_data in output_fields.items():
-            output_value = output_field_data["value"]
-            workflow.update_node_field_value(node_id, output_field, output_value)
-
-        # 检查循环终止条件
-        should_continue = True
-        if loop_count >= max_loop_count:
-            should_continue = False
-        elif loop_end_condition == "output_field_condition":
-            condition_value = workflow.get_node_field_value(node_id, output_field_condition_field)
-            should_continue = not check_condition(
-                condition_value, output_field_condition_operator, output_field_condition_value
-            )
-        elif loop_end_condition == "ai_model_judgement":
-            prompt = render_template(judgement_prompt, output_fields)
-            ai_response = call_ai_model(judgement_model_backend, judgement_model, prompt)
-            ai_response_content = ai_response.content or ""
-            if ai_response_content.strip() == judgement_end_output.strip():
-                should_continue = False
-
-        if should_continue:
+        if check_should_continue(loop_count):
             # 继续循环
             loop_count += 1
-
-            # 更新循环内赋值
-            for field, assignment in assignment_in_loop.items():
-                if assignment["source"] == "constant":
-                    new_value = assignment["value"]
-                elif assignment["source"] == "input_field":
-                    new_value = workflow.get_node_field_value(node_id, assignment["value"])
-                elif assignment["source"] == "output_field":
-                    new_value = output_fields[assignment["value"]]["value"]
-                elif assignment["source"] == "output_field_cumulative":
-                    new_value = "\n\n".join(map(str, output_fields_cumulative[assignment["value"]]))
-                elif assignment["source"] == "loop_count":
-                    new_value = loop_count
-                else:
-                    new_value = None
-
-                workflow.update_node_field_value(node_id, field, new_value)
+            assign_loop_values(loop_count)
 
             # 重新调用工作流
             workflow_id = workflow.get_node_field_value(node_id, "workflow_id")
-            input_fields = {}
-            for field in workflow.get_node_fields(node_id):
-                if field not in internal_fields and not workflow.is_node_field_output(node_id, field):
-                    field_original_node_id = workflow.get_node_field_value_by_key(node_id, field, "nodeId")
-                    field_value = workflow.get_node_field_value(node_id, field)
-                    input_fields.setdefault(field_original_node_id, {})[field] = field_value
-
             workflow_model = WorkflowModel.get(WorkflowModel.wid == workflow_id)
             _workflow_data = workflow_model.data
-            data = {"input_fields": input_fields}
-            for _node_id, node_fields in data["input_fields"].items():
-                for original_node in _workflow_data["nodes"]:
-                    if original_node["id"] == _node_id:
-                        break
-                else:
-                    raise Exception("node not found")
-                for field_name, field_value in node_fields.items():
-                    original_node["data"]["template"][field_name]["value"] = field_value
+            set_input_values(_workflow_data, get_input_fields())
 
             record_rid = run_workflow_common(
                 workflow_data=_workflow_data,
                 workflow=workflow_model,
                 run_from=WorkflowRunRecord.RunFromTypes.WORKFLOW,
+                parent_record_id=workflow.record_id,
             )
 
             workflow.update_async_task(
@@ -417,6 +472,6 @@ def workflow_loop(
                     "used_credits": used_credits,
                 },
             )
-            workflow_loop.retry(workflow.data, node_id, retry_delay=1)
+            workflow_loop.wait(workflow.data, node_id, [record_rid])
 
     return workflow.data
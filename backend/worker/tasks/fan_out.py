@@ -0,0 +1,114 @@
+# @Author: Bi Ying
+# @Date:   2024-08-25 10:21:37
+from copy import deepcopy
+from typing import Any
+
+from api.utils import run_workflows_bulk
+from models.workflow_models import WorkflowRunRecord, Workflow as WorkflowModel
+
+
+class WorkflowFanOut:
+    """
+    以有限的并发窗口启动同一个工作流的一组运行：排队或运行中的子工作流不超过 concurrency 个，
+    有子工作流结束时再补充新的运行，不会一次把所有运行塞进队列。
+    每次唤醒只查询窗口内的运行记录，进度以计数的形式保存在 state 中，可以随父工作流一起挂起和恢复。
+    Start a set of runs of one workflow through a bounded window: at most concurrency child runs are
+    queued or running, and new runs are started as others finish instead of flooding the queue.
+    Each wake-up only queries the records inside the window. Progress is kept as counters in state,
+    which is parked and resumed together with the parent workflow.
+    """
+
+    def __init__(
+        self,
+        workflow_id: str,
+        batches: list[dict[str, dict[str, Any]]],
+        concurrency: int,
+        state: dict | None = None,
+    ):
+        self.workflow_id = workflow_id
+        # 每个 batch 为一次运行的输入：节点 ID -> 字段名 -> 值
+        self.batches = batches
+        self.concurrency = max(int(concurrency), 1)
+        state = state or {}
+        self.next_index: int = state.get("next_index", 0)
+        # 窗口内的运行，记录 ID -> batch 序号
+        self.running: dict[str, int] = state.get("running", {})
+        self.finished_count: int = state.get("finished_count", 0)
+
+    @property
+    def state(self) -> dict:
+        return {
+            "next_index": self.next_index,
+            "running": self.running,
+            "finished_count": self.finished_count,
+        }
+
+    @property
+    def total(self) -> int:
+        return len(self.batches)
+
+    @property
+    def done(self) -> bool:
+        return self.next_index >= self.total and not self.running
+
+    @property
+    def progress(self) -> str:
+        return f"{self.finished_count}/{self.total} finished, {len(self.running)} running"
+
+    def launch(self, parent_record_id: str) -> list[str]:
+        """
+        把窗口补满，返回新启动的运行记录 ID。
+        Fill up the window and return the record ids of the runs just started.
+        """
+        count = min(self.concurrency - len(self.running), self.total - self.next_index)
+        if count <= 0:
+            return []
+
+        workflow_model = WorkflowModel.get(WorkflowModel.wid == self.workflow_id)
+        workflow_data_list = []
+        for input_fields in self.batches[self.next_index : self.next_index + count]:
+            _workflow_data = deepcopy(workflow_model.data)
+            for _node_id, node_fields in input_fields.items():
+                for original_node in _workflow_data["nodes"]:
+                    if original_node["id"] == _node_id:
+                        break
+                else:
+                    raise Exception("node not found")
+                for field_name, field_value in node_fields.items():
+                    original_node["data"]["template"][field_name]["value"] = field_value
+            workflow_data_list.append(_workflow_data)
+
+        record_ids = run_workflows_bulk(
+            workflow_data_list,
+            workflow_model,
+            run_from=WorkflowRunRecord.RunFromTypes.WORKFLOW,
+            parent_record_id=parent_record_id,
+        )
+        for offset, record_id in enumerate(record_ids):
+            self.running[record_id] = self.next_index + offset
+        self.next_index += count
+        return record_ids
+
+    def collect(self) -> list[tuple[int, dict]]:
+        """
+        用一次查询取出窗口内已经结束的运行，按结束时间返回 (batch 序号, 运行数据)。有运行失败时抛出异常。
+        Fetch the runs of the window that have ended in a single query and return (batch index, run data)
+        in the order they finished. Raises if any of them failed.
+        """
+        if not self.running:
+            return []
+        records = (
+            WorkflowRunRecord.select(WorkflowRunRecord.rid, WorkflowRunRecord.status, WorkflowRunRecord.data)
+            .where(
+                WorkflowRunRecord.rid.in_(list(self.running)),
+                WorkflowRunRecord.status.not_in(("RUNNING", "QUEUED")),
+            )
+            .order_by(WorkflowRunRecord.end_time)
+        )
+        finished = []
+        for record in records:
+            if record.status != "FINISHED":
+                raise Exception("Run workflow failed!")
+            finished.append((self.running.pop(record.rid.hex), record.data))
+        self.finished_count += len(finished)
+        return finished
@@ -8,7 +8,7 @@ from utilities.file_processing import get_files_contents, remove_markdown_image,
 from worker.tasks import task, timer
 
 
-@task
+@task(memoize=True)
 @timer
 def file_loader(
     workflow_data: dict,
@@ -6,9 +6,10 @@
 import uuid
 import base64
 
-from worker.tasks import task, timer
+from worker.tasks import task, timer, list_errors_mode
 from utilities.config import Settings
 from utilities.workflow import Workflow
+from utilities.general import map_list
 from utilities.network import new_httpx_client
 from utilities.file_processing import static_file_server
 from utilities.ai_utils import get_openai_client_and_model_id
@@ -72,12 +73,13 @@ def stable_diffusion(
     elif len(prompts) > len(negative_prompts) and len(negative_prompts) == 1:
         negative_prompts = negative_prompts * len(prompts)
 
-    results = []
     image_folder = static_file_server.static_folder_path / "images"
     settings = Settings()
     STABILITY_KEY = settings.stability_key
     http_client = new_httpx_client(is_async=False)
-    for index, prompt in enumerate(prompts):
+
+    def generate_image(index: int) -> str | None:
+        prompt = prompts[index]
         if provider == "self-host":
             stable_diffusion_base_url = settings.stable_diffusion_base_url.rstrip("/")
             url = f"{stable_diffusion_base_url}/sdapi/v1/txt2img"
@@ -136,11 +138,20 @@ def stable_diffusion(
 
         image_url = static_file_server.get_file_url(f"images/{image_name}")
         if output_type == "only_link":
-            results.append(image_url)
+            return image_url
         elif output_type == "markdown":
-            results.append(f"![{image_url}]({image_url})")
+            return f"![{image_url}]({image_url})"
         elif output_type == "html":
-            results.append(f'<img src="{image_url}"/>')
+            return f'<img src="{image_url}"/>'
+
+    results = map_list(
+        generate_image,
+        range(len(prompts)),
+        provider=f"stable-diffusion:{provider}",
+        errors=list_errors_mode(workflow, node_id),
+        default="",
+    )
+    results = [result for result in results if result is not None]
 
     output = results[0] if isinstance(input_prompt, str) and isinstance(input_negative_prompt, str) else results
     workflow.update_node_field_value(node_id, "output", output)
@@ -170,8 +181,8 @@ def dall_e(
 
     client, model_id = get_openai_client_and_model_id(is_async=False, model_id=model)
     image_folder = static_file_server.static_folder_path / "images"
-    results = []
-    for prompt in prompts:
+
+    def generate_image(prompt: str) -> str | None:
         response = client.images.generate(
             model=model_id,
             prompt=prompt,
@@ -194,11 +205,16 @@ def dall_e(
         image_url = static_file_server.get_file_url(f"images/{image_name}")
 
         if output_type == "only_link":
-            results.append(image_url)
+            return image_url
         elif output_type == "markdown":
-            results.append(f"![{image_url}]({image_url})")
+            return f"![{image_url}]({image_url})"
         elif output_type == "html":
-            results.append(f'<img src="{image_url}"/>')
+            return f'<img src="{image_url}"/>'
+
+    results = map_list(
+        generate_image, prompts, provider="openai", errors=list_errors_mode(workflow, node_id), default=""
+    )
+    results = [result for result in results if result is not None]
 
     output = results[0] if isinstance(input_prompt, str) else results
     workflow.update_node_field_value(node_id, "output", output)
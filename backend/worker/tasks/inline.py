@@ -0,0 +1,65 @@
+# @Author: Bi Ying
+# @Date:   2024-08-24 09:36:18
+import time
+from copy import deepcopy
+
+from utilities.workflow import Workflow, add_span
+from worker.tasks import TaskRetry, graph
+from worker.tasks.registry import task_functions
+
+
+class InlineWorkflowPlan:
+    """
+    在当前 worker 中直接运行的子工作流。节点、DAG 和任务函数只解析一次，之后每次运行只复制数据、
+    写入输入字段值，然后在当前线程中执行，不创建运行记录也不经过队列。
+    A sub workflow run directly in the current worker. Nodes, the DAG and the task functions are
+    resolved once; each run only copies the data, writes the input values and executes it in the
+    current thread, without creating a run record or going through the queue.
+    """
+
+    # 这些任务需要把工作流挂起等待其他运行结束，只能通过队列运行
+    # These tasks suspend the workflow to wait for other runs and can only run through the queue
+    QUEUED_ONLY_TASKS = ("tools.workflow_invoke", "control_flows.workflow_loop")
+
+    def __init__(self, workflow_data: dict, max_workers: int = 8):
+        self.workflow_data = workflow_data
+        self.max_workers = max_workers
+        workflow = Workflow(deepcopy(workflow_data))
+        self.dag = workflow.dag
+        self.task_names: dict[str, str] = {}
+        for node_id in self.dag.get_all_nodes():
+            node = workflow.get_node(node_id)
+            if node is not None:
+                self.task_names[node_id] = node.task_name
+        self.node_tasks = None
+        self.runs = 0
+
+    @property
+    def can_run_inline(self) -> bool:
+        return not any(task_name in self.QUEUED_ONLY_TASKS for task_name in self.task_names.values())
+
+    def run(self, input_fields: dict[str, dict[str, object]]) -> dict:
+        """
+        以 input_fields（节点 ID -> 字段名 -> 值）为输入运行一次，返回运行后的工作流数据。
+        Run once with input_fields (node id -> field -> value) and return the resulting workflow data.
+        """
+        if self.node_tasks is None:
+            self.node_tasks = {
+                node_id: task_functions.get_task(task_name).s(node_id) for node_id, task_name in self.task_names.items()
+            }
+
+        data = deepcopy(self.workflow_data)
+        for node in data["nodes"]:
+            for field, value in input_fields.get(node["id"], {}).items():
+                node["data"]["template"][field]["value"] = value
+
+        workflow = Workflow(data)
+        start_time = time.time()
+        try:
+            graph(self.dag, self.node_tasks, max_workers=self.max_workers)(workflow.data, workflow=workflow)
+        except TaskRetry as e:
+            raise Exception(f"Task {e.func_name} can't run inline") from e
+        finally:
+            self.runs += 1
+            add_span(data, "inline_run", start_time, time.time(), category="run", run=self.runs)
+        return workflow.data
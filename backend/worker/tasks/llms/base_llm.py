@@ -25,12 +25,13 @@ from vectorvein.types import (
 )
 
 from utilities.config import Settings
-from utilities.workflow import Workflow
+from utilities.workflow import Workflow, add_span, trace_span
 from utilities.general import mprint_with_name
 from utilities.network import new_httpx_client
 from utilities.general.ratelimit import is_request_allowed, add_request_record
 
 from .types.output import ModelOutput
+from .response_cache import get_llm_response_cache, get_llm_response_cache_ttl, get_response_cache_key
 
 
 mprint = mprint_with_name(name="LLM Tasks")
@@ -98,9 +99,9 @@ class BaseLLMTask:
         self.stream: bool = self.workflow.get_node_field_value(node_id, "stream", False)
         self.top_p: float | NotGiven = self.workflow.get_node_field_value(node_id, "top_p", NOT_GIVEN)
         self.system_prompt: str = self.workflow.get_node_field_value(node_id, "system_prompt", "")
+        self.cache_response: bool = self.workflow.get_node_field_value(node_id, "cache_response", False)
 
-        user_settings = Settings()
-        vectorvein_settings.load(user_settings.llm_settings)
+        self.load_llm_settings()
 
         if self.model in ("o1-mini", "o1-preview", "o1"):
             self.temperature = 1.0
@@ -170,6 +171,36 @@ class BaseLLMTask:
         self.total_completion_tokens = 0
         mprint(f"Prompts count: {self.prompts_count}")
 
+    def load_llm_settings(self):
+        user_settings = Settings()
+        vectorvein_settings.load(user_settings.llm_settings)
+
+    @property
+    def response_cacheable(self) -> bool:
+        """
+        temperature 为 0 时输出基本确定，可以缓存；其他情况需要节点显式开启 cache_response。
+        Responses are cached for temperature 0, otherwise only when the node enables cache_response.
+        """
+        if self.cache_response:
+            return True
+        try:
+            return float(self.temperature) == 0  # type: ignore
+        except (TypeError, ValueError):
+            return False
+
+    def replay_cached_stream(self, output: ModelOutput):
+        """
+        把缓存的回复按流式输出的格式推送给前端。
+        Push a cached response to the frontend the same way a stream is pushed.
+        """
+        self.workflow.set_node_status(self.node_id, 202)
+        self.workflow.report_node_status(self.node_id)
+        if output.reasoning_content:
+            self.workflow.push_node_data(self.node_id, {"reasoning_content": output.reasoning_content})
+        if output.content_output:
+            self.workflow.push_node_data(self.node_id, {"content": output.content_output})
+        self.workflow.push_node_data(self.node_id, {"end": True})
+
     def endpoint_available(self, endpoint: EndpointSetting, add_record: bool = True) -> bool:
         """
         Check if the endpoint is available under the current rate limits.
@@ -223,9 +254,45 @@ class BaseLLMTask:
             max_tokens = 16000
             self.thinking["budget_tokens"] = max_tokens - 1000
 
+        response_cache_key = None
+        cache_lookup_start = time.time()
+        if self.response_cacheable:
+            response_cache_key = get_response_cache_key(
+                backend=self.MODEL_TYPE,
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                max_tokens=max_tokens,
+                response_format=self.response_format,
+                tools=self.tools,
+                tool_choice=self.tool_choice,
+                thinking=self.thinking,
+                reasoning_effort=self.reasoning_effort,
+            )
+            cached_output = get_llm_response_cache().get(response_cache_key)
+            if isinstance(cached_output, dict):
+                mprint(f"Prompt {index + 1}/{self.prompts_count} hit the response cache")
+                output = ModelOutput(**cached_output)
+                if self.stream:
+                    self.replay_cached_stream(output)
+                add_span(
+                    self.workflow.data,
+                    "llm_request",
+                    cache_lookup_start,
+                    time.time(),
+                    category="llm",
+                    node_id=self.node_id,
+                    index=index,
+                    model=self.model,
+                    cached=True,
+                )
+                return output
+
         request_success = False
         stream_response = response = None
-        start_time = time.time()
+        endpoint = None
+        start_time = request_start_time = time.time()
         endpoints = self.model_settings.endpoints.copy()
         random.shuffle(endpoints)
         _chat_client = create_chat_client(
@@ -240,6 +307,7 @@ class BaseLLMTask:
                 endpoint = vectorvein_settings.get_endpoint(endpoint_id)
                 if not self.endpoint_available(endpoint):
                     continue
+                request_start_time = time.time()
                 _chat_client.endpoint = endpoint
                 if endpoint.endpoint_type and endpoint.endpoint_type.startswith("openai"):
                     backend_type = BackendType.OpenAI
@@ -282,7 +350,10 @@ class BaseLLMTask:
                 except APIStatusError as e:
                     if e.status_code == 429:
                         mprint.error(f"Rate limit exceeded with endpoint {endpoint.id}: {e}")
-                        time.sleep(5)
+                        with trace_span(
+                            self.workflow.data, "rate_limit_wait", category="llm", node_id=self.node_id, index=index
+                        ):
+                            time.sleep(5)
                     else:
                         raise e
                 except Exception as e:
@@ -290,7 +361,11 @@ class BaseLLMTask:
                     mprint.error(format_exc())
 
             if not request_success:
-                time.sleep(1)
+                # 所有端点都超出了速率限制
+                with trace_span(
+                    self.workflow.data, "rate_limit_wait", category="llm", node_id=self.node_id, index=index
+                ):
+                    time.sleep(1)
 
         if not request_success:
             raise Exception("Failed to request the model")
@@ -367,28 +442,69 @@ class BaseLLMTask:
             completion_tokens=completion_tokens,
         )
 
+        add_span(
+            self.workflow.data,
+            "llm_request",
+            request_start_time,
+            time.time(),
+            category="llm",
+            node_id=self.node_id,
+            index=index,
+            model=self.model,
+            endpoint=endpoint.id if endpoint else None,
+            stream=self.stream,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
+
+        if response_cache_key is not None:
+            try:
+                get_llm_response_cache().set(
+                    response_cache_key, output.model_dump(), expire=get_llm_response_cache_ttl()
+                )
+            except Exception as e:
+                mprint.error(f"Failed to cache model response: {e}")
+
         return output
 
     def run(self):
+        # 可缓存的请求中，同一批次里重复的提示词只请求一次
+        # For cacheable requests, duplicate prompts within the batch are requested once
+        prompt_indices: dict[Any, list[int]] = {}
+        for index, prompt in enumerate(self.prompts):
+            if self.response_cacheable and isinstance(prompt, str):
+                prompt_indices.setdefault(prompt, []).append(index)
+            else:
+                prompt_indices[("index", index)] = [index]
+
         max_concurrent = self.get_max_concurrent_requests()
-        with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
-            future_to_index = {
-                executor.submit(self.process_prompt, prompt, index): index for index, prompt in enumerate(self.prompts)
+        with trace_span(
+            self.workflow.data,
+            "llm_batch",
+            category="llm",
+            node_id=self.node_id,
+            prompts=self.prompts_count,
+            requests=len(prompt_indices),
+        ), ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+            future_to_indices = {
+                executor.submit(self.process_prompt, self.prompts[indices[0]], indices[0]): indices
+                for indices in prompt_indices.values()
             }
 
-            for future in as_completed(future_to_index):
-                index = future_to_index[future]
+            for future in as_completed(future_to_indices):
+                indices = future_to_indices[future]
                 try:
                     result = future.result()
-                    self.content_outputs[index] = result.content_output or ""
-                    self.reasoning_content_outputs[index] = result.reasoning_content or ""
-                    self.function_call_outputs[index] = result.tool_calls or []
-                    self.function_call_arguments_batches[index] = result.function_call_arguments or {}
+                    for index in indices:
+                        self.content_outputs[index] = result.content_output or ""
+                        self.reasoning_content_outputs[index] = result.reasoning_content or ""
+                        self.function_call_outputs[index] = result.tool_calls or []
+                        self.function_call_arguments_batches[index] = result.function_call_arguments or {}
                     self.total_prompt_tokens += result.prompt_tokens
                     self.total_completion_tokens += result.completion_tokens
                 except Exception as exc:
                     mprint.error(f"Generated an exception: {exc}")
-                    mprint.error(f"Prompt: {self.prompts[index]}")
+                    mprint.error(f"Prompt: {self.prompts[indices[0]]}")
 
         content_output = self.content_outputs[0] if isinstance(self.input_prompt, str) else self.content_outputs
         self.workflow.update_node_field_value(self.node_id, "output", content_output)
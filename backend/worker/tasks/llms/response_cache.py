@@ -0,0 +1,41 @@
+# @Author: Bi Ying
+# @Date:   2024-08-21 10:24:37
+import json
+import hashlib
+from pathlib import Path
+
+from diskcache import Cache
+
+from utilities.config import config
+
+
+_llm_response_cache: Cache | None = None
+
+
+def get_llm_response_cache() -> Cache:
+    """
+    大模型回复缓存，磁盘占用超过上限后淘汰最久未使用的回复。
+    On-disk cache of model responses, evicting the least recently used ones past the size limit.
+    """
+    global _llm_response_cache
+    if _llm_response_cache is None:
+        _llm_response_cache = Cache(
+            directory=Path(config.data_path) / "cache" / "llm_responses",
+            size_limit=config.get("llm_response_cache.size_limit", 512 * 1024 * 1024),
+            eviction_policy="least-recently-used",
+        )
+    return _llm_response_cache
+
+
+def get_llm_response_cache_ttl() -> int:
+    return config.get("llm_response_cache.ttl", 60 * 60 * 24 * 7)
+
+
+def get_response_cache_key(**params) -> str:
+    """
+    以请求参数的稳定哈希作为缓存键，NOT_GIVEN 等不能序列化的值按字符串处理。
+    A stable hash of the request parameters. Values that are not JSON serializable (e.g. NOT_GIVEN) are
+    hashed by their string form.
+    """
+    data = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(data.encode("utf8"), digest_size=16).hexdigest()
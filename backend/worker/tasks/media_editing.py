@@ -1,16 +1,31 @@
 # @Author: Bi Ying
 # @Date:   2024-08-05 00:26:36
-import uuid
-
-from worker.tasks import task, timer
+from worker.tasks import task, timer, list_errors_mode
 from utilities.workflow import Workflow
 from utilities.general import align_elements
-from utilities.media_processing import ImageProcessor
+from utilities.media_processing import render_images
 from utilities.text_processing import extract_image_url
 from utilities.file_processing import static_file_server
 
 
-@task
+def format_image_outputs(image_names: list[str | None], output_types: list[str]) -> list[str]:
+    outputs = []
+    for image_name, output_type in zip(image_names, output_types):
+        if image_name is None:
+            # 处理失败并被忽略的图片
+            outputs.append("")
+            continue
+        image_url = static_file_server.get_file_url(f"images/{image_name}")
+        if output_type == "only_link":
+            outputs.append(image_url)
+        elif output_type == "markdown":
+            outputs.append(f"![{image_url}]({image_url})")
+        elif output_type == "html":
+            outputs.append(f'<img src="{image_url}"/>')
+    return outputs
+
+
+@task(cpu_bound=True)
 @timer
 def image_editing(
     workflow_data: dict,
@@ -86,76 +101,46 @@ def image_editing(
 
     image_folder = static_file_server.static_folder_path / "images"
 
-    outputs = []
+    jobs = []
     for index, current_input_image in enumerate(input_images):
-        current_input_image = extract_image_url(current_input_image)
-        image_processor = ImageProcessor(current_input_image, max_size=None)
-        current_crop = crops[index]
-        current_crop_method = crop_methods[index]
-        current_crop_position = crop_positions[index]
-        current_crop_x = crop_xs[index]
-        current_crop_y = crop_ys[index]
-        current_crop_width = crop_widths[index]
-        current_crop_height = crop_heights[index]
-        current_crop_width_ratio = crop_width_ratios[index]
-        current_crop_height_ratio = crop_height_ratios[index]
-        current_scale = scales[index]
-        current_scale_method = scale_methods[index]
-        current_scale_ratio = scale_ratios[index]
-        current_scale_width = scale_widths[index]
-        current_scale_height = scale_heights[index]
-        current_compress = compresss[index]
-        current_rotate = rotates[index]
-        current_output_type = output_types[index]
-
-        if current_crop:
-            image_processor.crop(
-                method=current_crop_method,
-                width_ratio=current_crop_width_ratio,
-                height_ratio=current_crop_height_ratio,
-                position=current_crop_position,
-                x=current_crop_x,
-                y=current_crop_y,
-                width=current_crop_width,
-                height=current_crop_height,
+        operations = []
+        if crops[index]:
+            crop_params = dict(
+                method=crop_methods[index],
+                width_ratio=crop_width_ratios[index],
+                height_ratio=crop_height_ratios[index],
+                position=crop_positions[index],
+                x=crop_xs[index],
+                y=crop_ys[index],
+                width=crop_widths[index],
+                height=crop_heights[index],
             )
-
-        if current_scale:
-            image_processor.scale(
-                method=current_scale_method,
-                ratio=current_scale_ratio,
-                width=current_scale_width,
-                height=current_scale_height,
+            operations.append(("crop", crop_params))
+        if scales[index]:
+            scale_params = dict(
+                method=scale_methods[index],
+                ratio=scale_ratios[index],
+                width=scale_widths[index],
+                height=scale_heights[index],
             )
-
-        if current_compress < 100:
-            image_processor.compress(quality=current_compress)
-
-        if current_rotate > 0:
-            image_processor.rotate(angle=current_rotate)
-
-        mime_type = image_processor.mime_type
-        extension = mime_type.split("/")[1].lower()
-        image_name = f"{uuid.uuid4().hex}.{extension}"
-        local_file = image_folder / image_name
-        with open(local_file, "wb") as file:
-            file.write(image_processor.bytes)
-
-        image_url = static_file_server.get_file_url(f"images/{image_name}")
-
-        if current_output_type == "only_link":
-            outputs.append(image_url)
-        elif current_output_type == "markdown":
-            outputs.append(f"![{image_url}]({image_url})")
-        elif current_output_type == "html":
-            outputs.append(f'<img src="{image_url}"/>')
+            operations.append(("scale", scale_params))
+        if compresss[index] < 100:
+            operations.append(("compress", dict(quality=compresss[index])))
+        if rotates[index] > 0:
+            operations.append(("rotate", dict(angle=rotates[index])))
+        jobs.append((extract_image_url(current_input_image), operations))
+
+    # 每张图片只解码和编码一次
+    # Each image is decoded and encoded once
+    image_names = render_images(jobs, image_folder, errors=list_errors_mode(workflow, node_id))
+    outputs = format_image_outputs(image_names, output_types)
 
     output = outputs[0] if not has_list else outputs
     workflow.update_node_field_value(node_id, "output", output)
     return workflow.data
 
 
-@task
+@task(cpu_bound=True)
 @timer
 def image_watermark(
     workflow_data: dict,
@@ -227,52 +212,38 @@ def image_watermark(
         )
     )
 
-    outputs = []
     image_folder = static_file_server.static_folder_path / "images"
+
+    jobs = []
     for index, image in enumerate(input_images):
-        image = extract_image_url(image)
-        image_processor = ImageProcessor(image, max_size=None)
-        current_image_or_text = image_or_texts[index]
-        if current_image_or_text == "image":
-            watermark_images[index] = extract_image_url(watermark_images[index])
-            watermark_image_processor = ImageProcessor(watermark_images[index], max_size=None)
-            image_processor.add_image_watermark(
-                watermark_image=watermark_image_processor.image,
+        position_params = dict(
+            opacity=opacitys[index],
+            position=positions[index],
+            vertical_gap=vertical_gaps[index],
+            horizontal_gap=horizontal_gaps[index],
+        )
+        operations = []
+        if image_or_texts[index] == "image":
+            watermark_params = dict(
+                watermark_image=extract_image_url(watermark_images[index]),
                 width_ratio=watermark_image_width_ratios[index],
                 height_ratio=watermark_image_height_ratios[index],
-                opacity=opacitys[index],
-                position=positions[index],
-                vertical_gap=vertical_gaps[index],
-                horizontal_gap=horizontal_gaps[index],
+                **position_params,
             )
-        elif current_image_or_text == "text":
-            image_processor.add_text_watermark(
+            operations.append(("add_image_watermark", watermark_params))
+        elif image_or_texts[index] == "text":
+            watermark_params = dict(
                 watermark_text=watermark_texts[index],
                 watermark_text_font=watermark_text_fonts[index],
                 watermark_text_font_size=watermark_text_font_sizes[index],
                 watermark_text_font_color=watermark_text_font_colors[index],
-                opacity=opacitys[index],
-                position=positions[index],
-                vertical_gap=vertical_gaps[index],
-                horizontal_gap=horizontal_gaps[index],
+                **position_params,
             )
+            operations.append(("add_text_watermark", watermark_params))
+        jobs.append((extract_image_url(image), operations))
 
-        mime_type = image_processor.mime_type
-        extension = mime_type.split("/")[1].lower()
-        image_name = f"{uuid.uuid4().hex}.{extension}"
-        local_file = image_folder / image_name
-        with open(local_file, "wb") as file:
-            file.write(image_processor.bytes)
-
-        image_url = static_file_server.get_file_url(f"images/{image_name}")
-
-        current_output_type = output_types[index]
-        if current_output_type == "only_link":
-            outputs.append(image_url)
-        elif current_output_type == "markdown":
-            outputs.append(f"![{image_url}]({image_url})")
-        elif current_output_type == "html":
-            outputs.append(f'<img src="{image_url}"/>')
+    image_names = render_images(jobs, image_folder, errors=list_errors_mode(workflow, node_id))
+    outputs = format_image_outputs(image_names, output_types)
 
     output = outputs[0] if not has_list else outputs
     workflow.update_node_field_value(node_id, "output", output)
@@ -3,18 +3,20 @@
 # @Date:   2023-06-08 13:12:38
 # @Last Modified by:   Bi Ying
 # @Last Modified time: 2024-07-10 17:57:12
-import time
+
+import tempfile
+from contextlib import ExitStack
 
 from vectorvein.types import BackendType
 from vectorvein.chat_clients import create_chat_client
 from vectorvein.chat_clients.utils import format_messages
 from vectorvein.settings import settings as vectorvein_settings
 
-from worker.tasks import task, timer
+from worker.tasks import task, timer, list_errors_mode
 from utilities.config import Settings
 from utilities.workflow import Workflow
-from utilities.general import mprint_with_name
-from utilities.network import new_httpx_client
+from utilities.general import map_list, mprint_with_name
+from utilities.file_processing import static_file_server
 from utilities.media_processing import ImageProcessor, SpeechRecognitionClient
 
 
@@ -53,7 +55,6 @@ def gpt_vision(
     elif len(prompts) > len(images) and len(images) == 1:
         images = images * len(prompts)
 
-    content_outputs = []
     total_prompt_tokens = 0
     total_completion_tokens = 0
     prompts_count = len(prompts)
@@ -64,7 +65,8 @@ def gpt_vision(
     model = workflow.get_node_field_value(node_id, "model")
     client = create_chat_client(backend=BackendType.OpenAI, model=model, stream=False)
 
-    for index, prompt in enumerate(prompts):
+    def describe_image(index: int):
+        prompt = prompts[index]
         mprint(f"Processing prompt {index + 1}/{prompts_count}")
         image_processor = ImageProcessor(image_source=images[index])
         messages = [
@@ -84,13 +86,22 @@ def gpt_vision(
         ]
 
         response = client.create_completion(messages=messages)
-        content_outputs.append(response.content)
-        if response.usage:
-            total_prompt_tokens += response.usage.prompt_tokens
-            total_completion_tokens += response.usage.completion_tokens
-
-        if index < prompts_count - 1:
-            time.sleep(1)
+        return response.content, response.usage
+
+    # 请求间隔和并发数由服务商的限制控制，见配置 list_mapping.providers
+    # The interval and concurrency of requests come from the provider limits, see list_mapping.providers
+    results = map_list(
+        describe_image,
+        range(prompts_count),
+        provider="openai",
+        errors=list_errors_mode(workflow, node_id),
+        default=("", None),
+    )
+    content_outputs = [content for content, _usage in results]
+    for _content, usage in results:
+        if usage:
+            total_prompt_tokens += usage.prompt_tokens
+            total_completion_tokens += usage.completion_tokens
 
     content_output = content_outputs[0] if isinstance(text_prompt, str) else content_outputs
     workflow.update_node_field_value(node_id, "output", content_output)
@@ -128,7 +139,6 @@ def glm_vision(
     elif len(prompts) > len(images) and len(images) == 1:
         images = images * len(prompts)
 
-    content_outputs = []
     total_prompt_tokens = 0
     total_completion_tokens = 0
     prompts_count = len(prompts)
@@ -138,7 +148,9 @@ def glm_vision(
     vectorvein_settings.load(user_settings.get("llm_settings"))
     model = workflow.get_node_field_value(node_id, "model", "glm-4v")
     client = create_chat_client(backend=BackendType.ZhiPuAI, model=model, stream=False)
-    for index, prompt in enumerate(prompts):
+
+    def describe_image(index: int):
+        prompt = prompts[index]
         mprint(f"Processing prompt {index + 1}/{prompts_count}")
         image_processor = ImageProcessor(image_source=images[index])
         messages = [
@@ -155,13 +167,20 @@ def glm_vision(
         ]
 
         response = client.create_completion(messages=messages)
-        content_outputs.append(response.content)
-        if response.usage:
-            total_prompt_tokens += response.usage.prompt_tokens
-            total_completion_tokens += response.usage.completion_tokens
-
-        if index < prompts_count - 1:
-            time.sleep(1)
+        return response.content, response.usage
+
+    results = map_list(
+        describe_image,
+        range(prompts_count),
+        provider="zhipuai",
+        errors=list_errors_mode(workflow, node_id),
+        default=("", None),
+    )
+    content_outputs = [content for content, _usage in results]
+    for _content, usage in results:
+        if usage:
+            total_prompt_tokens += usage.prompt_tokens
+            total_completion_tokens += usage.completion_tokens
 
     content_output = content_outputs[0] if isinstance(text_prompt, str) else content_outputs
     workflow.update_node_field_value(node_id, "output", content_output)
@@ -201,14 +220,15 @@ def local_vision(
 
     model_id = workflow.get_node_field_value(node_id, "llm_model")
 
-    content_outputs = []
     prompts_count = len(prompts)
     mprint(f"Prompts count: {prompts_count}")
 
     user_settings = Settings()
     vectorvein_settings.load(user_settings.get("llm_settings"))
     client = create_chat_client(backend=BackendType.Local, model=model_id, stream=False)
-    for index, prompt in enumerate(prompts):
+
+    def describe_image(index: int):
+        prompt = prompts[index]
         mprint(f"Processing prompt {index + 1}/{prompts_count}")
         image_processor = ImageProcessor(image_source=images[index])
         messages = [
@@ -225,11 +245,15 @@ def local_vision(
         ]
 
         response = client.create_completion(messages=messages)
-        content_output = response.content
-        content_outputs.append(content_output)
+        return response.content
 
-        if index < prompts_count - 1:
-            time.sleep(1)
+    content_outputs = map_list(
+        describe_image,
+        range(prompts_count),
+        provider="local",
+        errors=list_errors_mode(workflow, node_id),
+        default="",
+    )
 
     content_output = content_outputs[0] if isinstance(text_prompt, str) else content_outputs
     workflow.update_node_field_value(node_id, "output", content_output)
@@ -267,7 +291,6 @@ def claude_vision(
     elif len(prompts) > len(images) and len(images) == 1:
         images = images * len(prompts)
 
-    content_outputs = []
     total_prompt_tokens = 0
     total_completion_tokens = 0
     prompts_count = len(prompts)
@@ -288,7 +311,9 @@ def claude_vision(
     user_settings = Settings()
     vectorvein_settings.load(user_settings.get("llm_settings"))
     client = create_chat_client(backend=BackendType.Anthropic, model=model, stream=False)
-    for index, prompt in enumerate(prompts):
+
+    def describe_image(index: int):
+        prompt = prompts[index]
         mprint(f"Processing prompt {index + 1}/{prompts_count}")
         image_processor = ImageProcessor(image_source=images[index])
         messages = [
@@ -309,15 +334,20 @@ def claude_vision(
         ]
 
         response = client.create_completion(messages=messages)
-
-        content_output = response.content
-        content_outputs.append(content_output)
-        if response.usage:
-            total_prompt_tokens += response.usage.prompt_tokens
-            total_completion_tokens += response.usage.completion_tokens
-
-        if index < prompts_count - 1:
-            time.sleep(1)
+        return response.content, response.usage
+
+    results = map_list(
+        describe_image,
+        range(prompts_count),
+        provider="anthropic",
+        errors=list_errors_mode(workflow, node_id),
+        default=("", None),
+    )
+    content_outputs = [content for content, _usage in results]
+    for _content, usage in results:
+        if usage:
+            total_prompt_tokens += usage.prompt_tokens
+            total_completion_tokens += usage.completion_tokens
 
     content_output = content_outputs[0] if isinstance(text_prompt, str) else content_outputs
     workflow.update_node_field_value(node_id, "output", content_output)
@@ -357,7 +387,6 @@ def gemini_vision(
 
     model = workflow.get_node_field_value(node_id, "llm_model")
 
-    content_outputs = []
     total_tokens = 0
     prompts_count = len(prompts)
     mprint(f"Prompts count: {prompts_count}")
@@ -365,7 +394,9 @@ def gemini_vision(
     user_settings = Settings()
     vectorvein_settings.load(user_settings.get("llm_settings"))
     client = create_chat_client(backend=BackendType.Gemini, model=model, stream=False)
-    for index, prompt in enumerate(prompts):
+
+    def describe_image(index: int):
+        prompt = prompts[index]
         mprint(f"Processing prompt {index + 1}/{prompts_count}")
         vectorvein_messages = [
             {
@@ -378,13 +409,18 @@ def gemini_vision(
         messages = format_messages(vectorvein_messages, backend=BackendType.Gemini, native_multimodal=True)
 
         response = client.create_completion(messages=messages)
-        content_output = response.content or ""
-        content_outputs.append(content_output)
+        return response.content or ""
+
+    content_outputs = map_list(
+        describe_image,
+        range(prompts_count),
+        provider="gemini",
+        errors=list_errors_mode(workflow, node_id),
+        default="",
+    )
+    for prompt, content_output in zip(prompts, content_outputs):
         total_tokens += int(len(prompt + content_output) / 1.5) + 258
-        mprint(f"Tokens :{total_tokens}")
-
-        if index < prompts_count - 1:
-            time.sleep(5)
+    mprint(f"Tokens :{total_tokens}")
 
     content_output = content_outputs[0] if isinstance(text_prompt, str) else content_outputs
 
@@ -400,26 +436,39 @@ def speech_recognition(
 ):
     workflow = Workflow(workflow_data)
     files_or_urls = workflow.get_node_field_value(node_id, "files_or_urls")
-    if files_or_urls == "files":
-        files = workflow.get_node_field_value(node_id, "files")
-        if isinstance(files, str):
-            files = [files]
-        files_data = [open(file, "rb") for file in files]
-    elif files_or_urls == "urls":
-        urls = workflow.get_node_field_value(node_id, "urls")
-        if isinstance(urls, str):
-            urls = [urls]
-        elif isinstance(urls, list):
-            urls = urls
-        http_client = new_httpx_client(is_async=False)
-        files_data = [http_client.get(url).content for url in urls]
-    else:
-        raise Exception("Invalid files_or_urls")
-
     engine = workflow.get_node_field_value(node_id, "engine", "openai")
-    client = SpeechRecognitionClient(provider=engine)
     output_type = workflow.get_node_field_value(node_id, "output_type")
-    outputs = client.batch_transcribe(files_data, output_type)
+
+    # 打开的文件和下载用的临时目录在转写结束或出错时统一关闭、删除
+    # Open files and the temporary download folder are closed and removed once transcription ends or fails
+    with ExitStack() as stack:
+        if files_or_urls == "files":
+            files = workflow.get_node_field_value(node_id, "files")
+            if isinstance(files, str):
+                files = [files]
+            files_data = [stack.enter_context(open(file, "rb")) for file in files]
+        elif files_or_urls == "urls":
+            urls = workflow.get_node_field_value(node_id, "urls")
+            if isinstance(urls, str):
+                urls = [urls]
+            elif isinstance(urls, list):
+                urls = urls
+            download_folder = stack.enter_context(tempfile.TemporaryDirectory(prefix="speech_recognition_"))
+
+            def download_audio(url: str):
+                # 流式写入临时目录，不把整个音频读入内存
+                file_path = static_file_server.copy_online_file(url, download_folder)
+                if file_path is None:
+                    raise Exception(f"Failed to download {url}")
+                return file_path
+
+            file_paths = map_list(download_audio, urls, provider="web")
+            files_data = [stack.enter_context(open(file_path, "rb")) for file_path in file_paths]
+        else:
+            raise Exception("Invalid files_or_urls")
+
+        client = SpeechRecognitionClient(provider=engine)
+        outputs = client.batch_transcribe(files_data, output_type)
 
     if files_or_urls == "urls":
         if isinstance(workflow.get_node_field_value(node_id, "urls"), str):
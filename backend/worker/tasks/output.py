@@ -41,7 +41,7 @@ def text(
     return workflow.data
 
 
-@task
+@task(cpu_bound=True)
 @timer
 def table(
     workflow_data: dict,
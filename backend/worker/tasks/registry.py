@@ -0,0 +1,135 @@
+# @Author: Bi Ying
+# @Date:   2024-08-23 10:12:46
+import time
+import inspect
+import importlib
+from types import ModuleType
+from threading import Lock, Thread
+from collections.abc import Mapping
+
+from worker.tasks import Task
+from utilities.general import mprint_with_name
+
+
+mprint = mprint_with_name(name="Workflow Task Server")
+
+
+# 节点的 task_name 为 "模块名.函数名"，模块名即 worker.tasks 下的子模块，无需导入就能确定任务所在的模块
+# A node's task_name is "module.function", where module is a submodule of worker.tasks, so the module
+# holding a task is known without importing anything
+TASK_MODULES = (
+    "llms",
+    "tools",
+    "output",
+    "triggers",
+    "vector_db",
+    "web_crawlers",
+    "media_editing",
+    "relational_db",
+    "control_flows",
+    "file_processing",
+    "text_processing",
+    "image_generation",
+    "media_processing",
+)
+
+
+def collect_task_functions(module: ModuleType) -> dict[str, Task]:
+    functions = {}
+    for name, obj in inspect.getmembers(module):
+        if (
+            callable(obj)
+            and not inspect.isclass(obj)
+            and not inspect.ismethod(obj)
+            and obj.__class__.__name__ == "Task"
+        ):
+            functions[name] = obj
+    return functions
+
+
+class TaskRegistry(Mapping):
+    """
+    任务模块名到任务函数表的映射。任务模块依赖 pandas、yt_dlp、pymupdf 等较重的包，
+    因此只在其中的任务第一次被用到时才导入，也可以调用 warm_up 在后台线程中提前导入。
+    Maps task module names to their task functions. Task modules pull in heavy packages such as
+    pandas, yt_dlp and pymupdf, so each one is imported the first time one of its tasks is used,
+    or ahead of time in a background thread with warm_up.
+    """
+
+    def __init__(self, package: str = "worker.tasks", module_names: tuple[str, ...] = TASK_MODULES):
+        self.package = package
+        self.module_names = module_names
+        self.functions: dict[str, dict[str, Task]] = {}
+        self.lock = Lock()
+
+    def load(self, module_name: str) -> dict[str, Task]:
+        functions = self.functions.get(module_name)
+        if functions is not None:
+            return functions
+        if module_name not in self.module_names:
+            raise KeyError(module_name)
+
+        # import_module 本身是线程安全的，多个线程同时加载同一个模块时只有一个会真正执行导入
+        # import_module is thread safe, only one thread actually imports a module loaded concurrently
+        start_time = time.perf_counter()
+        module = importlib.import_module(f"{self.package}.{module_name}")
+        functions = collect_task_functions(module)
+        with self.lock:
+            if module_name not in self.functions:
+                self.functions[module_name] = functions
+                mprint(f"Loaded task module {module_name} in {time.perf_counter() - start_time:.2f}s.")
+            return self.functions[module_name]
+
+    def get_task(self, task_name: str) -> Task:
+        module_name, function_name = task_name.split(".")
+        return self[module_name][function_name]
+
+    def find_module(self, function_name: str) -> str | None:
+        """
+        在已加载的模块中查找任务函数所在的模块名，不会触发导入。
+        Find the module of a task function among the loaded modules, without importing anything.
+        """
+        with self.lock:
+            loaded = list(self.functions.items())
+        for module_name, functions in loaded:
+            if function_name in functions:
+                return module_name
+        return None
+
+    def warm_up(self, module_names: list[str] | None = None) -> Thread:
+        """
+        在后台线程中依次导入任务模块，导入失败只记录日志，等到真正运行该模块的任务时再报错。
+        Import task modules one by one in a background thread. Failures are only logged and will
+        be raised again when a task of that module actually runs.
+        """
+
+        def warm_up_modules():
+            start_time = time.perf_counter()
+            for module_name in module_names or self.module_names:
+                try:
+                    self.load(module_name)
+                except Exception as e:
+                    mprint.error(f"Failed to load task module {module_name}: {e}")
+            mprint(f"Task modules warmed up in {time.perf_counter() - start_time:.2f}s.")
+
+        thread = Thread(target=warm_up_modules, name="task-module-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def is_loaded(self, module_name: str) -> bool:
+        return module_name in self.functions
+
+    def __getitem__(self, module_name: str) -> dict[str, Task]:
+        return self.load(module_name)
+
+    def __contains__(self, module_name) -> bool:
+        return module_name in self.functions or module_name in self.module_names
+
+    def __iter__(self):
+        return iter(dict.fromkeys([*self.module_names, *self.functions]))
+
+    def __len__(self):
+        return len(set(self.module_names) | set(self.functions))
+
+
+task_functions = TaskRegistry()
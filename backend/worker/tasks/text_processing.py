@@ -14,7 +14,7 @@ from utilities.text_processing import split_text
 from worker.tasks import task, timer
 
 
-@task
+@task(memoize=True)
 @timer
 def template_compose(
     workflow_data: dict,
@@ -100,7 +100,7 @@ def template_compose(
     return workflow.data
 
 
-@task
+@task(memoize=True)
 @timer
 def markdown_to_html(
     workflow_data: dict,
@@ -124,7 +124,7 @@ def markdown_to_html(
     return workflow.data
 
 
-@task
+@task(cpu_bound=True, memoize=True)
 @timer
 def text_splitters(
     workflow_data: dict,
@@ -228,7 +228,7 @@ def text_truncation(
     return workflow.data
 
 
-@task
+@task(memoize=True)
 @timer
 def text_replace(
     workflow_data: dict,
@@ -261,7 +261,7 @@ def text_replace(
     return workflow.data
 
 
-@task
+@task(memoize=True)
 @timer
 def regex_extract(
     workflow_data: dict,
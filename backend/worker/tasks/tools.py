@@ -15,14 +15,13 @@ from typing import Any, Callable, Dict, List
 
 from bs4 import BeautifulSoup
 
-from api.utils import run_workflow_common
-from models.workflow_models import WorkflowRunRecord, Workflow as WorkflowModel
-from utilities.config import Settings
+from utilities.config import Settings, config
 from utilities.workflow import Workflow
-from utilities.general import Retry, mprint_with_name
+from utilities.general import Retry, map_list, mprint_with_name
 from utilities.media_processing import get_screenshot
 from utilities.network import headers, new_httpx_client
-from worker.tasks import task, timer
+from worker.tasks import task, timer, list_errors_mode
+from worker.tasks.fan_out import WorkflowFanOut
 
 
 mprint = mprint_with_name(name="Tools Tasks")
@@ -53,7 +52,7 @@ def convert_parameter_value(value, parameter_type):
     return value  # if none of the types match
 
 
-@task
+@task(cpu_bound=True)
 @timer
 def programming_function(
     workflow_data: dict,
@@ -201,76 +200,80 @@ def image_search(
 
     http_client = new_httpx_client(is_async=False)
 
+    if isinstance(search_text, list):
+        search_texts = search_text
+    else:
+        search_texts = [search_text]
+
+    def search_bing(text: str) -> list[str]:
+        params = {
+            "q": text,
+            "first": "-",
+            "count": 30,
+            "cw": 1920,
+            "ch": 929,
+            "relp": 59,
+            "tsc": "ImageHoverTitle",
+            "datsrc": "I",
+            "layout": "RowBased_Landscape",
+            "mmasync": 1,
+        }
+        images = []
+        response = http_client.get(
+            "https://cn.bing.com/images/async",
+            params=params,
+            headers=headers,
+        )
+        soup = BeautifulSoup(response.text, "lxml")
+        images_elements = soup.select(".imgpt>a")
+        for image_element in images_elements[:count]:
+            m = image_element["m"]
+            if isinstance(m, list):
+                m = m[0]
+            image_data = json.loads(m)
+            title = image_data["t"]
+            url = image_data["murl"]
+            if output_type == "text":
+                images.append(url)
+            elif output_type == "markdown":
+                images.append(f"![{title}]({url})")
+        return images
+
+    def search_pexels(text: str) -> list[str]:
+        params = {
+            "query": text,
+            "per_page": 30,
+        }
+        images = []
+        response = http_client.get(
+            "https://api.pexels.com/v1/search",
+            params=params,
+            headers={"Authorization": pexels_api_key},
+        )
+        data = response.json()
+        for image_data in data["photos"][:count]:
+            title = image_data["photographer"]
+            url = image_data["src"]["original"]
+            photographer = image_data["photographer"]
+            pexels_photo_url = image_data["url"]
+            if output_type == "text":
+                images.append(f"{url}\nPexels {photographer}: {pexels_photo_url}")
+            elif output_type == "markdown":
+                images.append(
+                    f"![{title}]({url})\nPexels {photographer}: [{pexels_photo_url}]({pexels_photo_url})"
+                )
+        return images
+
     results = []
     if search_engine == "bing":
-        if isinstance(search_text, list):
-            search_texts = search_text
-        else:
-            search_texts = [search_text]
-
-        for text in search_texts:
-            params = {
-                "q": text,
-                "first": "-",
-                "count": 30,
-                "cw": 1920,
-                "ch": 929,
-                "relp": 59,
-                "tsc": "ImageHoverTitle",
-                "datsrc": "I",
-                "layout": "RowBased_Landscape",
-                "mmasync": 1,
-            }
-            images = []
-            response = http_client.get(
-                "https://cn.bing.com/images/async",
-                params=params,
-                headers=headers,
-            )
-            soup = BeautifulSoup(response.text, "lxml")
-            images_elements = soup.select(".imgpt>a")
-            for image_element in images_elements[:count]:
-                m = image_element["m"]
-                if isinstance(m, list):
-                    m = m[0]
-                image_data = json.loads(m)
-                title = image_data["t"]
-                url = image_data["murl"]
-                if output_type == "text":
-                    images.append(url)
-                elif output_type == "markdown":
-                    images.append(f"![{title}]({url})")
-            results.append(images)
+        results = map_list(
+            search_bing, search_texts, provider="bing", errors=list_errors_mode(workflow, node_id), default=[]
+        )
     elif search_engine == "pexels":
         pexels_api_key = Settings().pexels_api_key
-        if isinstance(search_text, list):
-            search_texts = search_text
-        else:
-            search_texts = [search_text]
-        for text in search_texts:
-            params = {
-                "query": text,
-                "per_page": 30,
-            }
-            images = []
-            response = http_client.get(
-                "https://api.pexels.com/v1/search",
-                params=params,
-                headers={"Authorization": pexels_api_key},
-            )
-            data = response.json()
-            for image_data in data["photos"][:count]:
-                title = image_data["photographer"]
-                url = image_data["src"]["original"]
-                photographer = image_data["photographer"]
-                pexels_photo_url = image_data["url"]
-                if output_type == "text":
-                    images.append(f"{url}\nPexels {photographer}: {pexels_photo_url}")
-                elif output_type == "markdown":
-                    images.append(
-                        f"![{title}]({url})\nPexels {photographer}: [{pexels_photo_url}]({pexels_photo_url})"
-                    )
-            results.append(images)
+        results = map_list(
+            search_pexels, search_texts, provider="pexels", errors=list_errors_mode(workflow, node_id), default=[]
+        )
 
     output = results if isinstance(search_text, list) else results[0]
     workflow.update_node_field_value(node_id, "output", output)
@@ -402,7 +405,8 @@ def text_search(
     if search_engine == "bing":
         search_url = settings.get("web_search.bing.endpoint")
         headers = {"Ocp-Apim-Subscription-Key": settings.get("web_search.bing.ocp_apim_subscription_key")}
-        for text in search_texts:
+
+        def search_bing(text: str) -> dict | None:
             params = {"q": text, "count": count}
             request_success, response = (
                 Retry(http_client.get)
@@ -417,14 +421,25 @@ def text_search(
                 .run()
             )
             if not request_success or response is None:
-                continue
+                return None
+            return response.json()
 
-            search_results = response.json()
-            handle_bing_results(search_results)
+        search_results_list = map_list(
+            search_bing, search_texts, provider="bing", errors=list_errors_mode(workflow, node_id)
+        )
+        for search_results in search_results_list:
+            # 请求失败的搜索输出空结果，保持与输入一一对应
+            handle_bing_results(search_results or {"webPages": {"value": []}})
 
     elif search_engine == "jina.ai":
-        for text in search_texts:
-            search_results = search_with_jinaai(text, max_results=count)
+        search_results_list = map_list(
+            lambda text: search_with_jinaai(text, max_results=count),
+            search_texts,
+            provider="jina.ai",
+            errors=list_errors_mode(workflow, node_id),
+            default=[],
+        )
+        for search_results in search_results_list:
             output = format_text_search_results(
                 search_results, combine_result_in_text, output_type, max_snippet_length
             )
@@ -451,84 +466,63 @@ def workflow_invoke(
     node_id: str,
 ):
     workflow = Workflow(workflow_data)
-    sleep_interval = 1
+    workflow_id = workflow.get_node_field_value(node_id, "workflow_id")
+    list_input = workflow.get_node_field_value(node_id, "list_input")
+    # 同时排队或运行的子工作流数量上限，避免长列表一次占满队列
+    concurrency = workflow.get_node_field_value(node_id, "max_concurrency") or config.get(
+        "workflow.invoke_concurrency", 8
+    )
+    fields = workflow.get_node_fields(node_id)
+
+    # 每个batch相当于一次工作流调用的参数
+    input_fields_batches: List[Dict[str, Dict[str, Any]]] = []
+    output_fields_batches = {}
+    for field in fields:
+        if field in ("workflow_id", "list_input", "max_concurrency"):
+            continue
+
+        if workflow.get_node_field_value_by_key(node_id, field, "is_output"):
+            output_fields_batches[field] = {
+                "node_id": workflow.get_node_field_value_by_key(node_id, field, "node"),
+                "output_field_key": workflow.get_node_field_value_by_key(node_id, field, "output_field_key"),
+                "values": [],
+            }
+            continue
+
+        field_original_node_id = workflow.get_node_field_value_by_key(node_id, field, "nodeId")
+        field_value = workflow.get_node_field_value(node_id, field)
+        field_values = field_value if list_input else [field_value]
+        if len(input_fields_batches) == 0:
+            input_fields_batches = [dict() for _ in range(len(field_values))]
+        for batch, field_value in zip(input_fields_batches, field_values):
+            batch.setdefault(field_original_node_id, {})[field] = field_value
 
-    if workflow.get_async_task(node_id) is None:
-        workflow_id = workflow.get_node_field_value(node_id, "workflow_id")
+    async_task_data = workflow.get_async_task(node_id)
+    if async_task_data is None:
         if workflow.workflow_id == workflow_id:
             raise Exception("Can't invoke self!")
-        list_input = workflow.get_node_field_value(node_id, "list_input")
-        fields = workflow.get_node_fields(node_id)
-
-        # 每个batch相当于一次工作流调用的参数
-        input_fields_batches: List[Dict[str, Dict[str, Any]]] = []
-        output_fields_batches = {}
-        for field in fields:
-            if field in ("workflow_id", "list_input"):
-                continue
-
-            if workflow.get_node_field_value_by_key(node_id, field, "is_output"):
-                output_fields_batches[field] = {
-                    "node_id": workflow.get_node_field_value_by_key(node_id, field, "node"),
-                    "output_field_key": workflow.get_node_field_value_by_key(node_id, field, "output_field_key"),
-                    "values": [],
-                }
-                continue
-
-            field_original_node_id = workflow.get_node_field_value_by_key(node_id, field, "nodeId")
-            field_value = workflow.get_node_field_value(node_id, field)
-            field_values = field_value if list_input else [field_value]
-            if len(input_fields_batches) == 0:
-                input_fields_batches = [dict() for _ in range(len(field_values))]
-            for batch, field_value in zip(input_fields_batches, field_values):
-                batch.setdefault(field_original_node_id, {})[field] = field_value
-
-        record_ids = []
-        workflow_model = WorkflowModel.get(WorkflowModel.wid == workflow_id)
-        for input_fields in input_fields_batches:
-            _workflow_data = workflow_model.data
-            data = {"input_fields": input_fields}
-            for _node_id, node_fields in data["input_fields"].items():
-                for original_node in _workflow_data["nodes"]:
-                    if original_node["id"] == _node_id:
-                        break
-                else:
-                    raise Exception("node not found")
-                for field_name, field_value in node_fields.items():
-                    original_node["data"]["template"][field_name]["value"] = field_value
-
-            record_rid = run_workflow_common(
-                workflow_data=_workflow_data,
-                workflow=workflow_model,
-                run_from=WorkflowRunRecord.RunFromTypes.WORKFLOW,
-            )
-            record_ids.append(record_rid)
-
-        workflow.add_async_task(
-            node_id,
-            {"record_ids": record_ids, "finished_record_ids": [], "output_fields_batches": output_fields_batches},
-        )
-        workflow_invoke.retry(workflow.data, node_id, retry_delay=1)
+        fan_out = WorkflowFanOut(workflow_id, input_fields_batches, concurrency)
     else:
-        async_task_data = workflow.get_async_task(node_id)
-        if async_task_data is None:
-            raise Exception("Async task not found!")
-        record_ids = async_task_data["record_ids"]
-        finished_record_ids = async_task_data["finished_record_ids"]
         output_fields_batches = async_task_data["output_fields_batches"]
-        for record_id in record_ids:
-            if record_id in finished_record_ids:
-                continue
-            record = WorkflowRunRecord.select().join(WorkflowModel).where(WorkflowRunRecord.rid == record_id).first()
-            if record.status in ("RUNNING", "QUEUED"):
-                continue
-            elif record.status != "FINISHED":
-                raise Exception("Run workflow failed!")
-
-            finished_record_ids.append(record_id)
-
-            nodes = record.data["nodes"]
-            for node in nodes:
+        fan_out_state = async_task_data.get("fan_out")
+        if fan_out_state is None:
+            # 旧版本挂起的任务一次启动了全部子工作流
+            # Tasks parked by older versions started every child run at once
+            finished_record_ids = async_task_data["finished_record_ids"]
+            fan_out_state = {
+                "next_index": len(async_task_data["record_ids"]),
+                "running": {
+                    record_id: index
+                    for index, record_id in enumerate(async_task_data["record_ids"])
+                    if record_id not in finished_record_ids
+                },
+                "finished_count": len(finished_record_ids),
+            }
+        fan_out = WorkflowFanOut(workflow_id, input_fields_batches, concurrency, fan_out_state)
+
+        # 结果按子工作流结束的顺序追加
+        for _, record_data in fan_out.collect():
+            for node in record_data["nodes"]:
                 for output_field_data in output_fields_batches.values():
                     if node["id"] != output_field_data["node_id"]:
                         continue
@@ -536,17 +530,15 @@ def workflow_invoke(
                         node["data"]["template"][output_field_data["output_field_key"]]["value"]
                     )
 
-        if len(finished_record_ids) != len(record_ids):
-            mprint(f"Recheck in {sleep_interval} seconds")
-            workflow.update_async_task(
-                node_id,
-                {
-                    "record_ids": record_ids,
-                    "finished_record_ids": finished_record_ids,
-                    "output_fields_batches": output_fields_batches,
-                },
-            )
-            workflow_invoke.retry(workflow.data, node_id, retry_delay=1)
+    fan_out.launch(workflow.record_id)
+    if not fan_out.done:
+        mprint(f"Waiting for workflow runs: {fan_out.progress}")
+        task_data = {"fan_out": fan_out.state, "output_fields_batches": output_fields_batches}
+        if async_task_data is None:
+            workflow.add_async_task(node_id, task_data)
+        else:
+            workflow.update_async_task(node_id, task_data)
+        workflow_invoke.wait(workflow.data, node_id, list(fan_out.running))
 
     for output_field, output_field_data in output_fields_batches.items():
         # output_values = output_field_data["values"] if list_input else output_field_data["values"][0]
@@ -5,10 +5,9 @@
 # @Last Modified time: 2024-06-25 18:27:50
 import time
 
-from worker.tasks import task, timer
-from utilities.config import cache
+from worker.tasks import task, timer, list_errors_mode
 from utilities.workflow import Workflow
-from utilities.general import mprint_with_name
+from utilities.general import map_list, mprint_with_name
 from utilities.ai_utils import EmbeddingClient
 from utilities.text_processing import split_text, remove_markdown_image
 from background_task.tasks import (
@@ -178,23 +177,29 @@ def search_data(
         provider=vector_database.embedding_provider, model_id=vector_database.embedding_model
     )
 
-    results = []
-    for text in search_texts:
+    def search(text: str):
         text_embedding = embedding_client.get(text)
-        task_id = q_search_point.delay(
+        # 直接等待 Qdrant 线程返回结果，不经过磁盘队列
+        search_results = q_search_point.submit(
             vid=database_vid,
             text_embedding=text_embedding,
             limit=count,
-        )
-        search_results = cache.get(f"task_result_{task_id}", None)
-        while search_results is None:
-            time.sleep(0.1)
-            search_results = cache.get(f"task_result_{task_id}", None)
+        ).result()
 
         if output_type == "text":
-            results.append("\n".join([result["text"] for result in search_results]))
+            return "\n".join([result["text"] for result in search_results])
         elif output_type == "list":
-            results.append([result["text"] for result in search_results])
+            return [result["text"] for result in search_results]
+
+    # 同一个向量数据库的多条查询同时计算 embedding 并提交检索
+    with embedding_client:
+        results = map_list(
+            search,
+            search_texts,
+            provider=f"embedding:{vector_database.embedding_provider}",
+            errors=list_errors_mode(workflow, node_id),
+            default="" if output_type == "text" else [],
+        )
 
     workflow.update_node_field_value(node_id, "output", results if isinstance(search_text, list) else results[0])
     return workflow.data
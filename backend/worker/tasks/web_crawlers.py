@@ -12,9 +12,9 @@ from bilili.api.acg_video import get_acg_video_subtitle
 
 from utilities.config import Settings
 from utilities.workflow import Workflow
-from utilities.general import mprint_with_name
+from utilities.general import map_list, mprint_with_name
 from utilities.network import crawl_text_from_url, new_httpx_client
-from worker.tasks import task, timer
+from worker.tasks import task, timer, list_errors_mode
 
 
 mprint = mprint_with_name(name="Web Crawlers Tasks")
@@ -72,8 +72,14 @@ def text_crawler(
         "text": [],
         "title": [],
     }
-    for url in urls:
-        result = crawl_text_from_url(url)
+    crawl_results = map_list(
+        crawl_text_from_url,
+        urls,
+        provider="web",
+        errors=list_errors_mode(workflow, node_id),
+        default={"text": "", "title": ""},
+    )
+    for result in crawl_results:
         if output_type == "text":
             output_data["text"].append(result["text"])
             output_data["title"].append(result["title"])
@@ -109,10 +115,7 @@ def bilibili_crawler(
 
     http_client = new_httpx_client(is_async=False)
 
-    subtitles = []
-    titles = []
-    videos = []
-    for url in urls:
+    def crawl_video(url: str) -> tuple[str, str | list, str]:
         if "b23.tv" in url:
             resp = http_client.get(url, headers=headers, follow_redirects=True)
             url = f"{resp.url.scheme}://{resp.url.host}{resp.url.path}"
@@ -163,9 +166,18 @@ def bilibili_crawler(
         else:
             video = ""
 
-        titles.append(title)
-        subtitles.append(subtitle_data)
-        videos.append(video)
+        return title, subtitle_data, video
+
+    results = map_list(
+        crawl_video,
+        urls,
+        provider="bilibili",
+        errors=list_errors_mode(workflow, node_id),
+        default=("", [] if output_type == "list" else "", ""),
+    )
+    titles = [result[0] for result in results]
+    subtitles = [result[1] for result in results]
+    videos = [result[2] for result in results]
 
     title = titles if isinstance(url_or_bvid, list) else titles[0]
     subtitle_data = subtitles if isinstance(url_or_bvid, list) else subtitles[0]
@@ -208,19 +220,13 @@ def youtube_crawler(
 
     http_client = new_httpx_client(is_async=False)
 
-    text_results = []
-    title_results = []
-    comments_results = []
-    for url in formatted_urls:
+    def crawl_video(url: str) -> tuple[str, str | list, list]:
+        """返回 (标题, 字幕, 评论)"""
         ydl_opts = {"writeautomaticsub": True, "getcomments": get_comments}
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=False)
             if info is None:
-                title_results.append("")
-                text_results.append("")
-                if get_comments:
-                    comments_results.append([])
-                continue
+                return "", "", []
             title = info["title"]
             comments = info.get("comments", [])
             if comments_type == "text_only":
@@ -247,20 +253,11 @@ def youtube_crawler(
                 break
         else:
             mprint.error("No subtitle found")
-            title_results.append(title)
-            text_results.append("")
-            if get_comments:
-                comments_results.append(comments)
-            continue
-
-        title_results.append(title)
-        if get_comments:
-            comments_results.append(comments)
+            return title, "", comments
 
         if subtitle_url is None:
             mprint.error("No subtitle found")
-            text_results.append("")
-            continue
+            return title, "", comments
         subtitle_resp = http_client.get(subtitle_url, headers=headers)
         subtitle_data_list = subtitle_resp.json()["events"]
         formated_subtitle = []
@@ -272,8 +269,18 @@ def youtube_crawler(
                 continue
             formated_subtitle.append(line)
         subtitle_data = "\n".join(formated_subtitle) if output_type == "str" else formated_subtitle
-
-        text_results.append(subtitle_data)
+        return title, subtitle_data, comments
+
+    results = map_list(
+        crawl_video,
+        formatted_urls,
+        provider="youtube",
+        errors=list_errors_mode(workflow, node_id),
+        default=("", [] if output_type == "list" else "", []),
+    )
+    title_results = [result[0] for result in results]
+    text_results = [result[1] for result in results]
+    comments_results = [result[2] for result in results]
 
     title_value = title_results if isinstance(url_or_video_id, list) else title_results[0]
     workflow.update_node_field_value(node_id, "output_title", title_value)
@@ -138,6 +138,18 @@ export function createTemplateData() {
         "field_type": "select",
         "group": "default",
       },
+      "ignore_item_errors": {
+        "required": false,
+        "placeholder": "",
+        "show": false,
+        "value": false,
+        "name": "ignore_item_errors",
+        "display_name": "ignore_item_errors",
+        "type": "bool",
+        "clear_after_run": false,
+        "list": false,
+        "field_type": "checkbox"
+      },
       "output": {
         "required": true,
         "placeholder": "",
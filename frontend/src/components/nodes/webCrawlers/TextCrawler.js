@@ -43,6 +43,18 @@ export function createTemplateData() {
         "list": true,
         "field_type": "select",
       },
+      "ignore_item_errors": {
+        "required": false,
+        "placeholder": "",
+        "show": false,
+        "value": false,
+        "name": "ignore_item_errors",
+        "display_name": "ignore_item_errors",
+        "type": "bool",
+        "clear_after_run": false,
+        "list": false,
+        "field_type": "checkbox"
+      },
       "output_text": {
         "required": true,
         "placeholder": "",